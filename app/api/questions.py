@@ -1,4 +1,5 @@
 from app import models
+from app.data_version import SCOPE_QUESTIONS, SCOPE_SURVEY, bump_data_version
 from sqlalchemy.orm import Session
 
 def add_all_questions(db: Session):
@@ -28,5 +29,7 @@ def add_all_questions(db: Session):
         models.Question(text='Email', qtype='text', order=18),
     ]
     db.add_all(questions)
+    # Реестр вопросов (app/question_registry.py) и статистика во всех воркерах перечитают вопросы
+    bump_data_version(db, SCOPE_QUESTIONS, SCOPE_SURVEY)
     db.commit()
     return questions 
\ No newline at end of file
@@ -5,12 +5,28 @@ from bokeh.plotting import figure
 from bokeh.models import ColumnDataSource, HoverTool
 from bokeh.transform import cumsum
 from bokeh.palettes import Category20c, Viridis256, Set3_12
-from bokeh.embed import components
+from bokeh.embed import components, json_item
 from bokeh.layouts import column, row
+import hashlib
+import json
 import math
+from datetime import datetime
+from collections import Counter
 from typing import Dict, List
-from app.db import SessionLocal
+from app.db import ReadSessionLocal, read_engine
+from app.data_version import SCOPE_COMMENTS, SCOPE_SURVEY, DataVersionReader
 from app.models import Question, Answer, Response
+from app.question_registry import (
+    ROLE_COMMENT, ROLE_CONCERNS, ROLE_FEES, ROLE_FINANCIAL_READY, ROLE_PARTICIPATION, ROLE_SNT_SUPPORT,
+    QuestionSet, question_registry
+)
+from app.stats_counters import (
+    SEGMENT_FULL, SEGMENT_PARTIAL, SEGMENT_ONLY_SECOND, basic_qids, classify_respondent,
+    compute_counters, read_counters
+)
+from app.stats_cache import LRUCache, StaleWhileRevalidateCache
+import os
+import threading
 import time
 
 # Конфигурация размеров графиков
@@ -38,20 +54,12 @@ CHART_SIZES = {
     }
 }
 
-# === КЭШ ДЛЯ СТАТИСТИКИ ===
-_statistics_cache = None
-_statistics_cache_time = 0
-_CACHE_TTL = 180  # 3 минуты
+# === КЭШ ДЛЯ СТАТИСТИКИ, ГРАФИКОВ И КОММЕНТАРИЕВ ===
+# Кэши сверяются с общей для всех воркеров версией данных (app/data_version.py)
+# Окно (в секундах), в котором изменения данных объединяются в один фоновый пересчёт
+CACHE_DEBOUNCE = float(os.getenv("STATS_CACHE_DEBOUNCE", "5"))
 
-# === КЭШ ДЛЯ ГРАФИКОВ И КОММЕНТАРИЕВ ===
-_bokeh_charts_cache = None
-_bokeh_charts_cache_time = 0
-_comments_data_cache = None
-_comments_data_cache_time = 0
-_all_comments_cache = None
-_all_comments_cache_time = 0
-
-CACHE_TTL = 180  # 3 минуты
+data_versions = DataVersionReader(read_engine)
 
 def get_chart_size(chart_type: str, device_type: str = 'desktop') -> Dict:
     """Получает размеры графика в зависимости от типа устройства"""
@@ -67,147 +75,108 @@ def detect_device_type(user_agent: str = '') -> str:
     else:
         return 'desktop'
 
+def _sorted_value_counts(values: Dict) -> Dict:
+    """Сортирует счётчики значений по убыванию (как pandas value_counts)"""
+    return dict(sorted(values.items(), key=lambda item: (-item[1], item[0])))
+
+def build_statistics(questions: QuestionSet, counters: Counter) -> Dict:
+    """
+    Собирает словарь статистики из счётчиков (формат ключей — см. app/stats_counters.py).
+    questions — снимок вопросов из реестра (app/question_registry.py).
+    """
+    basic = basic_qids(questions)
+    stats = {
+        'total_responses': 0,
+        'total_basic_responses': 0,  # Базовые ответы (включая consent)
+        'questions_stats': {},
+        # Три типа анкет (см. RESPONDENT_SEGMENTS в app/stats_counters.py)
+        SEGMENT_FULL: 0,
+        SEGMENT_PARTIAL: 0,
+        SEGMENT_ONLY_SECOND: 0
+    }
+    complete_values = {}
+    basic_values = {}
+    complete_answers = Counter()
+    for key, count in counters.items():
+        kind = key[0]
+        if kind == 'response':
+            # Анкеты: общие количества и три типа анкет
+            _, status, has_kadastr, has_basic, has_second = key
+            if status == 'complete':
+                stats['total_responses'] += count
+            if status == 'consent' and has_basic:
+                stats['total_basic_responses'] += count
+            segment = classify_respondent(status, has_kadastr, has_second)
+            if segment:
+                stats[segment] += count
+        elif kind == 'answer':
+            # Значения ответов: завершённые анкеты и (для базовых вопросов) анкеты с кадастровым номером
+            _, qid, value, status, has_kadastr = key
+            if status == 'complete':
+                complete_values.setdefault(qid, Counter())[value] += count
+            if qid in basic and has_kadastr and status in ('consent', 'complete'):
+                basic_values.setdefault(qid, Counter())[value] += count
+        elif kind == 'question':
+            _, qid, status, has_kadastr = key
+            if status == 'complete':
+                complete_answers[qid] += count
+
+    for qid, question_text, question_type in questions.questions:
+        if not complete_answers[qid]:
+            continue
+        if qid in basic and basic_values.get(qid):
+            values = basic_values[qid]
+            total = sum(values.values())
+        elif question_type in ['choice', 'priority']:
+            values = complete_values.get(qid, Counter())
+            total = sum(values.values())
+        elif question_type == 'checkbox':
+            values = complete_values.get(qid, Counter())
+            total = complete_answers[qid]
+        else:
+            continue
+        stats['questions_stats'][qid] = {
+            'text': question_text,
+            'type': question_type,
+            'values': _sorted_value_counts(values),
+            'total': total
+        }
+    return stats
+
 def get_survey_statistics() -> Dict:
     """
-    Получает статистику по всем вопросам опроса используя pandas для анализа данных
+    Получает статистику по всем вопросам опроса из таблиц счётчиков (см. app/stats_counters.py).
+    Читает несколько сотен строк вместо всей таблицы answers.
     Возвращает данные готовые для создания графиков Bokeh
     """
-    db = SessionLocal()
+    db = ReadSessionLocal()
     t0 = time.time()
     try:
-        # Получаем ответы - сначала все завершенные
-        query = """
-        SELECT 
-            q.id as question_id,
-            q.text as question_text,
-            q.qtype as question_type,
-            q.[order] as question_order,
-            a.value as answer_value,
-            r.id as response_id,
-            r.status as response_status
-        FROM questions q
-        LEFT JOIN answers a ON q.id = a.question_id
-        LEFT JOIN responses r ON a.response_id = r.id
-        WHERE r.status = 'complete'
-        ORDER BY q.[order], a.value
-        """
-        # Загружаем данные в pandas DataFrame
+        questions = question_registry.get()
+        counters = read_counters(db)
         t1 = time.time()
-        df = pd.read_sql_query(query, db.bind)
+        stats = build_statistics(questions, counters)
         t2 = time.time()
-        # Получаем общую статистику
-        total_responses_complete = df[df['response_status'] == 'complete']['response_id'].nunique() if not df.empty else 0
-        # Для базовых вопросов получаем дополнительный запрос
-        query_basic = """
-        SELECT 
-            q.id as question_id,
-            a.value as answer_value,
-            r.id as response_id,
-            r.status as response_status
-        FROM questions q
-        LEFT JOIN answers a ON q.id = a.question_id
-        LEFT JOIN responses r ON a.response_id = r.id
-        WHERE q.id IN (4, 5) AND r.status IN ('consent', 'complete')
-        """
-        df_basic = pd.read_sql_query(query_basic, db.bind)
-        # --- Новый код: получаем response_id с кадастровым номером ---
-        query_kadastr = """
-        SELECT DISTINCT a.response_id
-        FROM answers a
-        WHERE a.question_id = 2 AND a.value IS NOT NULL AND a.value != ''
-        """
-        df_kadastr = pd.read_sql_query(query_kadastr, db.bind)
-        responses_with_kadastr = set(df_kadastr['response_id'])
-        t3 = time.time()
-        total_responses_basic = df_basic[df_basic['response_status'] == 'consent']['response_id'].nunique() if not df_basic.empty else 0
-        stats = {
-            'total_responses': total_responses_complete,
-            'total_basic_responses': total_responses_basic,  # Базовые ответы (включая consent)
-            'questions_stats': {}
-        }
-        if df.empty:
-            print(f"[PROFILE] SQL+Pandas: {t2-t0:.3f}s, Basic SQL: {t3-t2:.3f}s")
-            return stats
-        # Анализируем каждый вопрос отдельно
-        for question_id in df['question_id'].unique():
-            if pd.isna(question_id):
-                continue
-            question_data = df[df['question_id'] == question_id]
-            if question_data.empty:
-                continue
-            question_info = question_data.iloc[0]
-            question_text = question_info['question_text']
-            question_type = question_info['question_type']
-            # Для базовых вопросов (4 и 5) используем данные из df_basic, но фильтруем по response_id с кадастром
-            if question_id in [4, 5] and not df_basic.empty:
-                basic_question_data = df_basic[(df_basic['question_id'] == question_id) & (df_basic['response_id'].isin(responses_with_kadastr))]
-                if not basic_question_data.empty:
-                    value_counts = basic_question_data['answer_value'].value_counts()
-                    stats['questions_stats'][question_id] = {
-                        'text': question_text,
-                        'type': question_type,
-                        'values': value_counts.to_dict(),
-                        'total': value_counts.sum()
-                    }
-                    continue
-            # Подсчитываем ответы для остальных вопросов
-            if question_type in ['choice', 'priority']:
-                value_counts = question_data['answer_value'].value_counts()
-                stats['questions_stats'][question_id] = {
-                    'text': question_text,
-                    'type': question_type,
-                    'values': value_counts.to_dict(),
-                    'total': value_counts.sum()
-                }
-            elif question_type == 'checkbox':
-                all_options = []
-                for answer_value in question_data['answer_value'].dropna():
-                    if answer_value:
-                        options = [opt.strip() for opt in str(answer_value).split(',')]
-                        all_options.extend(options)
-                checkbox_counts = pd.Series(all_options).value_counts()
-                stats['questions_stats'][question_id] = {
-                    'text': question_text,
-                    'type': question_type,
-                    'values': checkbox_counts.to_dict(),
-                    'total': len(question_data['answer_value'].dropna())
-                }
-        t4 = time.time()
-        print(f"[PROFILE] SQL+Pandas: {t2-t0:.3f}s, Basic SQL: {t3-t2:.3f}s, Stats processing: {t4-t3:.3f}s")
-        # === Подсчёт трёх типов анкет ===
-        # Получаем все ответы (response_id, question_id, value)
-        query_all_answers = """
-        SELECT a.response_id, a.question_id, a.value, r.status
-        FROM answers a
-        LEFT JOIN responses r ON a.response_id = r.id
-        WHERE r.status IN ('consent', 'complete')
-        """
-        df_all = pd.read_sql_query(query_all_answers, db.bind)
-        # Список вопросов второй части
-        second_part_qids = [6,7,8,9,10,11,12,13,14,15,16,17]
-        # Есть ли кадастровый номер у response_id
-        kadastr_map = df_all[(df_all['question_id'] == 2) & df_all['value'].notnull() & (df_all['value'] != '')].groupby('response_id').size() > 0
-        # Есть ли ответы на вторую часть у response_id
-        second_part_map = df_all[(df_all['question_id'].isin(second_part_qids)) & df_all['value'].notnull() & (df_all['value'] != '')].groupby('response_id').size() > 0
-        # Статус анкеты
-        status_map = df_all.drop_duplicates('response_id').set_index('response_id')['status']
-        # Считаем
-        full_with_kadastr = 0
-        partial_with_kadastr = 0
-        only_second_without_kadastr = 0
-        for rid in df_all['response_id'].unique():
-            has_kadastr = kadastr_map.get(rid, False)
-            has_second = second_part_map.get(rid, False)
-            status = status_map.get(rid, None)
-            if has_kadastr and has_second and status == 'complete':
-                full_with_kadastr += 1
-            elif has_kadastr and not has_second and status == 'consent':
-                partial_with_kadastr += 1
-            elif not has_kadastr and has_second:
-                only_second_without_kadastr += 1
-        stats['full_with_kadastr'] = full_with_kadastr
-        stats['partial_with_kadastr'] = partial_with_kadastr
-        stats['only_second_without_kadastr'] = only_second_without_kadastr
+        print(f"[PROFILE] Stats counters SQL: {t1-t0:.3f}s, Stats processing: {t2-t1:.3f}s")
+        return stats
+    finally:
+        db.close()
+
+def get_survey_statistics_raw() -> Dict:
+    """
+    Получает статистику напрямую из сырых данных: подсчёт делается в SQLite через GROUP BY
+    (см. compute_counters), в память попадают только уникальные значения ответов.
+    Эталон для проверки инкрементальных счётчиков.
+    """
+    db = ReadSessionLocal()
+    t0 = time.time()
+    try:
+        questions = question_registry.get()
+        counters = compute_counters(db)
+        t1 = time.time()
+        stats = build_statistics(questions, counters)
+        t2 = time.time()
+        print(f"[PROFILE] Stats GROUP BY SQL: {t1-t0:.3f}s, Stats processing: {t2-t1:.3f}s")
         return stats
     finally:
         db.close()
@@ -215,16 +184,44 @@ def get_survey_statistics() -> Dict:
 def get_survey_statistics_cached() -> Dict:
     """
     Кэшированная версия get_survey_statistics().
-    Кэш обновляется раз в 3 минуты.
+    После сброса отдаёт последнее посчитанное значение, пока в фоне идёт пересчёт.
     """
-    global _statistics_cache, _statistics_cache_time
-    now = time.time()
-    if _statistics_cache is not None and (now - _statistics_cache_time) < _CACHE_TTL:
-        return _statistics_cache
-    stats = get_survey_statistics()
-    _statistics_cache = stats
-    _statistics_cache_time = now
-    return stats
+    return _statistics_cache.get()
+
+def get_survey_statistics_versioned():
+    """Возвращает (статистика, версия данных) — версия нужна для кэширования графиков"""
+    return _statistics_cache.get_versioned()
+
+def get_stats_page_data():
+    """
+    Данные страницы /stats: (статистика, комментарии для дашборда, версия данных, время обновления).
+    Версия составлена из общих для всех воркеров версий данных, по которым посчитаны кэши.
+    """
+    statistics, stats_version, stats_time = _statistics_cache.snapshot()
+    comments_data, comments_version, comments_time = _comments_data_cache.snapshot()
+    version = f'{stats_version}.{comments_version}'
+    return statistics, comments_data, version, max(stats_time, comments_time)
+
+def get_comments_page_data():
+    """
+    Данные страницы /comments: (первая страница комментариев, всего комментариев, версия данных, время обновления).
+    Остальные страницы браузер подгружает через /api/comments.
+    """
+    first_page, page_version, page_time = _comments_page_cache.snapshot()
+    comments_data, data_version, data_time = _comments_data_cache.snapshot()
+    return first_page, comments_data['total_comments'], f'{page_version}.{data_version}', max(page_time, data_time)
+
+def peek_page_data_version(page: str):
+    """
+    Текущая версия данных страницы ('stats' или 'comments') без пересчёта:
+    (версия, время обновления) или None, если данные ещё не загружены.
+    """
+    caches = (_statistics_cache, _comments_data_cache) if page == 'stats' else (_comments_page_cache, _comments_data_cache)
+    versions = [cache.peek_version() for cache in caches]
+    if any(v is None for v in versions):
+        return None
+    version = '.'.join(str(v) for v, _ in versions)
+    return version, max(loaded_at for _, loaded_at in versions)
 
 def create_pie_chart(question_data: Dict, title: str, device_type: str = 'desktop'):
     """Создает круговую диаграмму для вопроса"""
@@ -702,73 +699,38 @@ def create_participation_pie_chart(question_data: Dict, title: str, device_type:
     pie_data = {'values': dict(data)}
     return create_pie_chart(pie_data, title, device_type)
 
+# Графики страницы статистики: имя -> (роль вопроса, функция построения, заголовок).
+# Роль None — график строится по всей статистике (приоритеты).
+CHARTS = {
+    'snt_support': (ROLE_SNT_SUPPORT, create_pie_chart, "Поддержка создания нового СНТ"),
+    'financial_ready': (ROLE_FINANCIAL_READY, create_pie_chart, "Готовность к финансовым обязательствам"),
+    'concerns': (ROLE_CONCERNS, create_horizontal_bar_chart, "Основные опасения жителей"),
+    'fees': (ROLE_FEES, create_fees_pie_chart, "Желаемый ежемесячный взнос"),
+    'participation': (ROLE_PARTICIPATION, create_participation_pie_chart, "Готовность участвовать в управлении СНТ"),
+    'priorities': (None, create_dynamic_priority_chart, None),
+}
+
+def create_chart(name: str, stats: Dict, device_type: str = 'desktop'):
+    """Строит один график по имени из CHARTS; None — если для графика нет данных"""
+    role, create, title = CHARTS[name]
+    if role is None:
+        return create(stats, device_type)
+    qid = question_registry.get().qid(role)
+    if qid not in stats['questions_stats']:
+        return None
+    return create(stats['questions_stats'][qid], title, device_type)
+
 def generate_bokeh_charts(stats: Dict, device_type: str = 'desktop') -> str:
     """
     Генерирует все графики Bokeh как отдельные независимые компоненты
     """
     t0 = time.time()
     charts = {}  # Словарь для хранения отдельных графиков
-    
-    # График 1: Поддержка создания СНТ (question_id = 4)
-    if 4 in stats['questions_stats']:
-        chart = create_pie_chart(
-            stats['questions_stats'][4], 
-            "Поддержка создания нового СНТ",
-            device_type
-        )
-        if chart:
-            script, div = components(chart)
-            charts['snt_support'] = {'script': script, 'div': div}
-    
-    # График 2: Готовность к финансовым обязательствам (question_id = 5)
-    if 5 in stats['questions_stats']:
-        chart = create_pie_chart(
-            stats['questions_stats'][5],
-            "Готовность к финансовым обязательствам",
-            device_type
-        )
-        if chart:
-            script, div = components(chart)
-            charts['financial_ready'] = {'script': script, 'div': div}
-    
-    # График 3: Основные опасения (question_id = 6)
-    if 6 in stats['questions_stats']:
-        chart = create_horizontal_bar_chart(
-            stats['questions_stats'][6],
-            "Основные опасения жителей",
-            device_type
-        )
-        if chart:
-            script, div = components(chart)
-            charts['concerns'] = {'script': script, 'div': div}
-    
-    # График 4: Желаемый ежемесячный взнос (question_id = 7)
-    if 7 in stats['questions_stats']:
-        chart = create_fees_pie_chart(
-            stats['questions_stats'][7],
-            "Желаемый ежемесячный взнос",
-            device_type
-        )
-        if chart:
-            script, div = components(chart)
-            charts['fees'] = {'script': script, 'div': div}
-    
-    # График 5: Участие в управлении (question_id = 8) - теперь пирог
-    if 8 in stats['questions_stats']:
-        chart = create_participation_pie_chart(
-            stats['questions_stats'][8],
-            "Готовность участвовать в управлении СНТ",
-            device_type
-        )
+    for name in CHARTS:
+        chart = create_chart(name, stats, device_type)
         if chart:
             script, div = components(chart)
-            charts['participation'] = {'script': script, 'div': div}
-    
-    # График 6: Тепловая карта приоритетов
-    priority_chart = create_dynamic_priority_chart(stats, device_type)
-    if priority_chart:
-        script, div = components(priority_chart)
-        charts['priorities'] = {'script': script, 'div': div}
+            charts[name] = {'script': script, 'div': div}
     
     # Объединяем все скрипты
     all_scripts = []
@@ -781,176 +743,222 @@ def generate_bokeh_charts(stats: Dict, device_type: str = 'desktop') -> str:
     print(f"[PROFILE] Bokeh charts: {t1-t0:.3f}s")
     return combined_script, charts 
 
+def generate_chart_json(name: str, stats: Dict, device_type: str = 'desktop'):
+    """
+    Один график в формате bokeh.embed.json_item (для ленивой загрузки на странице).
+    Возвращает (JSON-строка, ETag) или None, если для графика нет данных.
+    """
+    t0 = time.time()
+    chart = create_chart(name, stats, device_type)
+    if chart is None:
+        return None
+    body = json.dumps(json_item(chart), ensure_ascii=False)
+    # ETag считаем по исходным данным, а не по JSON: Bokeh генерирует случайные id при каждой отрисовке
+    etag = '"' + hashlib.sha1(f'{name}|{device_type}|{stats!r}'.encode('utf-8')).hexdigest() + '"'
+    print(f"[PROFILE] Bokeh chart {name}: {time.time()-t0:.3f}s")
+    return body, etag
+
+# Сколько комментариев отдаётся за один запрос страницы /comments и /api/comments
+COMMENTS_PAGE_SIZE = 20
+COMMENTS_PAGE_MAX = 100
+# Сколько самых популярных комментариев показывается на дашборде
+TOP_COMMENTS_COUNT = 3
+
+# Комментарии, которые показываются жителям: завершённые анкеты, прошедшие модерацию, не короче 10 символов
+_COMMENTS_FROM_SQL = """
+FROM answers a
+JOIN responses r ON r.id = a.response_id
+WHERE a.question_id = :question_id
+AND r.status = 'complete'
+AND a.moderated = 1
+AND TRIM(a.value) != ''
+AND LENGTH(a.value) > 10
+"""
+
+# Порядок «по лайкам, затем по дате» с keyset-пагинацией.
+# Счётчик лайков хранится в answers.likes_count (см. app/likes.py), а дата анкеты
+# растёт вместе с responses.id, поэтому сортировка идёт прямо по индексу ix_answers_top_comments
+# и читает только LIMIT строк. Следующая страница начинается строго после курсора последнего комментария.
+_COMMENTS_PAGE_SQL = """
+SELECT a.id AS answer_id, a.value AS comment_text, a.likes_count AS likes_count,
+       a.response_id AS response_id, r.created_at AS created_at
+""" + _COMMENTS_FROM_SQL + """
+{where}
+ORDER BY a.likes_count DESC, a.response_id DESC, a.id DESC
+LIMIT :limit
+"""
+
+_COMMENTS_COUNT_SQL = "SELECT COUNT(*)" + _COMMENTS_FROM_SQL
+
+def _format_comment_date(created_at, date_format: str = '%d.%m.%Y %H:%M') -> str:
+    if not created_at:
+        return 'Дата неизвестна'
+    if isinstance(created_at, str):
+        try:
+            created_at = datetime.fromisoformat(created_at)
+        except ValueError:
+            return created_at
+    return created_at.strftime(date_format)
+
+def _query_comments(db: Session, question_id: int, after: str = None, limit: int = COMMENTS_PAGE_SIZE) -> List:
+    params = {'question_id': question_id, 'limit': limit}
+    where = ''
+    if after:
+        params['likes'], params['response_id'], params['answer_id'] = decode_comments_cursor(after)
+        where = 'AND (a.likes_count, a.response_id, a.id) < (:likes, :response_id, :answer_id)'
+    return db.execute(text(_COMMENTS_PAGE_SQL.format(where=where)), params).all()
+
 def get_comments_data() -> Dict:
     """
     Получает комментарии жителей для отображения на дашборде
     Возвращает топ-3 комментария по лайкам и общую статистику
     """
     t0 = time.time()
-    db = SessionLocal()
+    db = ReadSessionLocal()
     try:
-        # Ищем question_id для комментариев (текст содержит "комментарии" или "предложения")
-        query = """
-        SELECT 
-            q.id as question_id,
-            q.text as question_text,
-            a.id as answer_id,
-            a.value as comment_text,
-            r.created_at as created_at,
-            COUNT(cl.id) as likes_count
-        FROM questions q
-        LEFT JOIN answers a ON q.id = a.question_id
-        LEFT JOIN responses r ON a.response_id = r.id
-        LEFT JOIN comment_likes cl ON a.id = cl.answer_id
-        WHERE r.status = 'complete' 
-        AND (LOWER(q.text) LIKE '%комментари%' OR LOWER(q.text) LIKE '%предложени%')
-        AND a.value IS NOT NULL 
-        AND TRIM(a.value) != ''
-        AND a.moderated = 1
-        GROUP BY q.id, q.text, a.id, a.value, r.created_at
-        ORDER BY likes_count DESC, r.created_at DESC
-        """
-        
-        # Загружаем данные в pandas DataFrame
-        df = pd.read_sql_query(query, db.bind)
-        t1 = time.time()
-        
-        if df.empty:
-            print(f"[PROFILE] Comments SQL+Pandas: {t1-t0:.3f}s")
+        question_id = question_registry.get().qid(ROLE_COMMENT)
+        if question_id is None:
             return {
                 'total_comments': 0,
                 'recent_comments': [],
                 'has_comments': False
             }
-        
-        # Фильтруем пустые комментарии
-        df = df[df['comment_text'].str.len() > 10]  # Минимум 10 символов
-        
-        total_comments = len(df)
-        
-        # Получаем топ-3 комментария (по лайкам, потом по дате)
-        recent_comments = []
-        for _, row in df.head(3).iterrows():
-            comment_text = row['comment_text']
-            
-            # Обрезаем длинные комментарии для предварительного просмотра
-            if len(comment_text) > 120:
-                preview_text = comment_text[:120] + "..."
-            else:
-                preview_text = comment_text
-            
-            recent_comments.append({
-                'answer_id': int(row['answer_id']),
-                'text': preview_text,
-                'full_text': comment_text,
-                'likes_count': int(row['likes_count']),
-                'created_at': row['created_at'].strftime('%d.%m.%Y') if pd.notna(row['created_at']) and hasattr(row['created_at'], 'strftime') else str(row['created_at']) if pd.notna(row['created_at']) else 'Дата неизвестна'
-            })
-        
-        print(f"[PROFILE] Comments SQL+Pandas: {t1-t0:.3f}s")
-        return {
-            'total_comments': total_comments,
-            'recent_comments': recent_comments,
-            'has_comments': total_comments > 0
-        }
-    
+        total_comments = db.execute(text(_COMMENTS_COUNT_SQL), {'question_id': question_id}).scalar()
+        # Топ-3 комментария (по лайкам, потом по дате) — LIMIT по индексу, без сортировки всех комментариев
+        rows = _query_comments(db, question_id, limit=TOP_COMMENTS_COUNT)
     finally:
         db.close()
 
-def get_all_comments() -> List[Dict]:
+    recent_comments = []
+    for row in rows:
+        comment_text = row.comment_text
+        
+        # Обрезаем длинные комментарии для предварительного просмотра
+        if len(comment_text) > 120:
+            preview_text = comment_text[:120] + "..."
+        else:
+            preview_text = comment_text
+        
+        recent_comments.append({
+            'answer_id': row.answer_id,
+            'text': preview_text,
+            'full_text': comment_text,
+            'likes_count': row.likes_count,
+            'created_at': _format_comment_date(row.created_at, '%d.%m.%Y')
+        })
+    
+    print(f"[PROFILE] Comments SQL: {time.time()-t0:.3f}s")
+    return {
+        'total_comments': total_comments,
+        'recent_comments': recent_comments,
+        'has_comments': total_comments > 0
+    }
+
+def encode_comments_cursor(comment: Dict) -> str:
+    """Курсор страницы комментариев: 'лайки,анкета,id' последнего показанного комментария"""
+    return f"{comment['likes_count']},{comment['response_id']},{comment['answer_id']}"
+
+def decode_comments_cursor(cursor: str):
+    """Разбирает курсор 'лайки,анкета,id'; ValueError — если курсор некорректный"""
+    likes, response_id, answer_id = cursor.split(',')
+    return int(likes), int(response_id), int(answer_id)
+
+def get_comments_page(after: str = None, limit: int = COMMENTS_PAGE_SIZE) -> Dict:
     """
-    Получает все комментарии для отдельной страницы
-    Сортирует по лайкам (популярности), затем по дате
+    Страница комментариев для /comments и /api/comments.
+    Сортирует по лайкам (популярности), затем по дате; after — курсор из предыдущей страницы.
+    Возвращает {'comments': [...], 'next_cursor': курсор следующей страницы или None}.
     """
     t0 = time.time()
-    db = SessionLocal()
+    limit = max(1, min(limit, COMMENTS_PAGE_MAX))
+    if after:
+        decode_comments_cursor(after)  # Некорректный курсор — ValueError до обращения к БД
+    db = ReadSessionLocal()
     try:
-        query = """
-        SELECT 
-            a.id as answer_id,
-            a.value as comment_text,
-            r.created_at as created_at,
-            COUNT(cl.id) as likes_count
-        FROM questions q
-        LEFT JOIN answers a ON q.id = a.question_id
-        LEFT JOIN responses r ON a.response_id = r.id
-        LEFT JOIN comment_likes cl ON a.id = cl.answer_id
-        WHERE r.status = 'complete' 
-        AND (LOWER(q.text) LIKE '%комментари%' OR LOWER(q.text) LIKE '%предложени%')
-        AND a.value IS NOT NULL 
-        AND TRIM(a.value) != ''
-        AND a.moderated = 1
-        GROUP BY a.id, a.value, r.created_at
-        ORDER BY likes_count DESC, r.created_at DESC
-        """
-        
-        df = pd.read_sql_query(query, db.bind)
-        t1 = time.time()
-        
-        if df.empty:
-            print(f"[PROFILE] AllComments SQL+Pandas: {t1-t0:.3f}s")
-            return []
-        
-        # Фильтруем пустые комментарии
-        df = df[df['comment_text'].str.len() > 10]
-        
-        comments = []
-        for _, row in df.iterrows():
-            comments.append({
-                'answer_id': int(row['answer_id']),
-                'text': row['comment_text'],
-                'likes_count': int(row['likes_count']),
-                'created_at': row['created_at'].strftime('%d.%m.%Y %H:%M') if pd.notna(row['created_at']) and hasattr(row['created_at'], 'strftime') else str(row['created_at']) if pd.notna(row['created_at']) else 'Дата неизвестна'
-            })
-        
-        print(f"[PROFILE] AllComments SQL+Pandas: {t1-t0:.3f}s")
-        return comments
-    
+        question_id = question_registry.get().qid(ROLE_COMMENT)
+        # Лишняя строка показывает, есть ли следующая страница
+        rows = _query_comments(db, question_id, after, limit + 1) if question_id is not None else []
     finally:
         db.close()
 
+    comments = [{
+        'answer_id': row.answer_id,
+        'text': row.comment_text,
+        'likes_count': row.likes_count,
+        'created_at': _format_comment_date(row.created_at),
+        'response_id': row.response_id
+    } for row in rows[:limit]]
+    next_cursor = encode_comments_cursor(comments[-1]) if len(rows) > limit else None
+    print(f"[PROFILE] Comments page SQL: {time.time()-t0:.3f}s")
+    return {'comments': comments, 'next_cursor': next_cursor}
+
+# Кэши, которые после сброса отдают последнее значение и пересчитываются в фоне
+def _survey_data_version() -> int:
+    return data_versions.get(SCOPE_SURVEY)
+
+def _comments_data_version() -> int:
+    return data_versions.get(SCOPE_COMMENTS)
+
+_statistics_cache = StaleWhileRevalidateCache('statistics', get_survey_statistics, _survey_data_version, CACHE_DEBOUNCE)
+_comments_data_cache = StaleWhileRevalidateCache('comments_data', get_comments_data, _comments_data_version, CACHE_DEBOUNCE)
+_comments_page_cache = StaleWhileRevalidateCache('comments_first_page', get_comments_page, _comments_data_version, CACHE_DEBOUNCE)
+
+# Графики: по одной записи на (версию данных статистики, тип устройства, график),
+# чтобы desktop/tablet/mobile не вытесняли друг друга (с запасом на предыдущую версию)
+_bokeh_charts_cache = LRUCache('bokeh_charts', maxsize=len(CHART_SIZES) * len(CHARTS) * 2)
+# Блокировка на каждый ключ кэша: разные графики строятся параллельно, один и тот же — один раз
+_bokeh_charts_locks: Dict[tuple, threading.Lock] = {}
+_bokeh_charts_locks_guard = threading.Lock()
+
 # Кэшированная генерация графиков
-def generate_bokeh_charts_cached(stats: Dict, device_type: str = 'desktop'):
-    global _bokeh_charts_cache, _bokeh_charts_cache_time
-    now = time.time()
-    cache_key = f'{device_type}-{hash(str(stats))}'
-    if (
-        _bokeh_charts_cache is not None and
-        _bokeh_charts_cache.get('key') == cache_key and
-        (now - _bokeh_charts_cache_time) < CACHE_TTL
-    ):
-        return _bokeh_charts_cache['script'], _bokeh_charts_cache['charts']
-    script, charts = generate_bokeh_charts(stats, device_type)
-    _bokeh_charts_cache = {'key': cache_key, 'script': script, 'charts': charts}
-    _bokeh_charts_cache_time = now
-    return script, charts
+def generate_chart_json_cached(name: str, stats: Dict, device_type: str = 'desktop', version: int = None):
+    """
+    Один график в формате json_item из LRU-кэша по ключу (версия данных статистики, тип устройства, имя).
+    Если версия не передана, ключом служит хэш самих данных.
+    """
+    if version is None:
+        version = hash(str(stats))
+    cache_key = (version, device_type, name)
+    cached = _bokeh_charts_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    with _bokeh_charts_locks_guard:
+        lock = _bokeh_charts_locks.setdefault(cache_key, threading.Lock())
+    try:
+        with lock:
+            cached = _bokeh_charts_cache.peek(cache_key)
+            if cached is not None:
+                return cached
+            # Пустой кортеж — «для графика нет данных» (тоже кэшируем)
+            result = generate_chart_json(name, stats, device_type) or ()
+            _bokeh_charts_cache.put(cache_key, result)
+            stats_info = _bokeh_charts_cache.stats()
+            print(f"[CACHE] bokeh_charts: hits={stats_info['hits']}, misses={stats_info['misses']}, size={stats_info['size']}")
+            return result
+    finally:
+        # График уже в кэше: опоздавшие потоки найдут его через peek, даже получив новую блокировку
+        with _bokeh_charts_locks_guard:
+            if _bokeh_charts_locks.get(cache_key) is lock:
+                del _bokeh_charts_locks[cache_key]
+
+def get_charts_cache_stats() -> Dict:
+    """Счётчики попаданий/промахов кэша графиков"""
+    return _bokeh_charts_cache.stats()
 
 # Кэшированные комментарии (dashboard)
 def get_comments_data_cached() -> Dict:
-    global _comments_data_cache, _comments_data_cache_time
-    now = time.time()
-    if _comments_data_cache is not None and (now - _comments_data_cache_time) < CACHE_TTL:
-        return _comments_data_cache
-    data = get_comments_data()
-    _comments_data_cache = data
-    _comments_data_cache_time = now
-    return data
-
-# Кэшированные все комментарии (страница /comments)
-def get_all_comments_cached() -> List[Dict]:
-    global _all_comments_cache, _all_comments_cache_time
-    now = time.time()
-    if _all_comments_cache is not None and (now - _all_comments_cache_time) < CACHE_TTL:
-        return _all_comments_cache
-    data = get_all_comments()
-    _all_comments_cache = data
-    _all_comments_cache_time = now
-    return data
+    return _comments_data_cache.get()
+
+# Кэшированная первая страница комментариев (страница /comments)
+def get_comments_first_page_cached() -> Dict:
+    return _comments_page_cache.get()
 
 def reset_stats_cache():
-    """Сбросить кэш статистики, графиков и комментариев"""
-    global _statistics_cache, _bokeh_charts_cache, _comments_data_cache, _all_comments_cache
-    _statistics_cache = None
-    _bokeh_charts_cache = None
-    _comments_data_cache = None
-    _all_comments_cache = None 
\ No newline at end of file
+    """
+    Сообщить кэшу, что этот процесс только что записал данные.
+    Сама запись уже увеличила общую версию данных (app/data_version.py); здесь мы лишь
+    перечитываем её сразу, не дожидаясь DATA_VERSION_CHECK_INTERVAL. Остальные воркеры
+    увидят новую версию при следующей проверке. Читатели получают последние значения,
+    пока в фоне идёт пересчёт.
+    """
+    data_versions.expire()
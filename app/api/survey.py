@@ -1,17 +1,32 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Body, Request
-from sqlalchemy.orm import Session
-from app.db import get_db
-from app import crud, schemas
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from app.db import get_async_db, get_async_read_db, SessionLocal
+from app import crud_async, schemas
 from app.email_service import send_verification_code
-from app.models import CommentLike, Answer
 from app.comment_filter import validate_comment, get_comment_toxicity
 import os
 import base64
 from datetime import datetime
 from pydantic import BaseModel
 from uuid import uuid4
-from sqlalchemy.exc import IntegrityError
 from app.api.stats import reset_stats_cache
+from app.likes import LikeBuffer
+from app.moderation_queue import ModerationQueue
+from app.question_registry import ROLE_COMMENT, ROLE_EMAIL, ROLE_FIO, ROLE_KADASTR, ROLE_PHONE, question_registry
+
+# Лайки принимаются в память и пишутся в БД пачками (см. app/likes.py)
+like_buffer = LikeBuffer(SessionLocal, on_flush=reset_stats_cache)
+# Комментарии модерируются в фоне, после записи шага (см. app/moderation_queue.py)
+moderation_queue = ModerationQueue(SessionLocal, validate_comment, on_moderated=reset_stats_cache)
+
+# Маршруты работают с БД через AsyncSession (app/crud_async.py) и не занимают потоки пула AnyIO.
+# Блокирующая отправка письма и чтение реестра вопросов (синхронный SELECT версии данных
+# под threading.Lock) уходят в run_in_threadpool.
+
+async def get_questions_snapshot():
+    """Снимок реестра вопросов, полученный вне event loop"""
+    return await run_in_threadpool(question_registry.get)
 
 router = APIRouter(
     prefix="/survey",
@@ -35,21 +50,21 @@ class UniqueCheckRequest(BaseModel):
     phone: str = None
 
 @router.get("/questions", response_model=list[schemas.QuestionSchema])
-def read_questions(db: Session = Depends(get_db)):
+async def read_questions(db: AsyncSession = Depends(get_async_read_db)):
     """
     Получить список всех вопросов для опроса.
     """
-    return crud.get_questions(db)
+    return await crud_async.get_questions(db)
 
 @router.post("/responses", status_code=status.HTTP_201_CREATED)
-def submit_response(response: schemas.ResponseCreateSchema, db: Session = Depends(get_db)):
+async def submit_response(response: schemas.ResponseCreateSchema, db: AsyncSession = Depends(get_async_db)):
     """
     Принять и сохранить ответы пользователя на опрос.
     """
     # Проверяем согласие на обработку персональных данных
     if not response.consent:
         raise HTTPException(status_code=400, detail="Необходимо согласие на обработку персональных данных")
-    crud.create_response(db, response)
+    await crud_async.create_response(db, response, await get_questions_snapshot())
     return {"message": "Ответ успешно сохранён"}
 
 @router.post('/consent')
@@ -63,22 +78,24 @@ async def save_consent(data: ConsentData):
     return {"status": "ok"}
 
 @router.post("/check_unique")
-def check_unique(data: UniqueCheckRequest = Body(...), db: Session = Depends(get_db)):
+async def check_unique(data: UniqueCheckRequest = Body(...), db: AsyncSession = Depends(get_async_read_db)):
+    # Все переданные поля проверяются одним запросом
+    existing = await crud_async.get_existing_identities(db, data.email, data.phone, data.kadastr)
     result = {}
     if data.email:
-        result['email_exists'] = crud.is_email_exists(db, data.email)
+        result['email_exists'] = ROLE_EMAIL in existing
     if data.kadastr:
-        result['kadastr_exists'] = crud.is_kadastr_exists(db, data.kadastr)
+        result['kadastr_exists'] = ROLE_KADASTR in existing
     if data.phone:
-        result['phone_exists'] = crud.is_phone_exists(db, data.phone)
+        result['phone_exists'] = ROLE_PHONE in existing
     return result
 
 @router.post("/check_unfinished")
-def check_unfinished(data: UniqueCheckRequest = Body(...), db: Session = Depends(get_db)):
+async def check_unfinished(data: UniqueCheckRequest = Body(...), db: AsyncSession = Depends(get_async_read_db)):
     """
     Проверяет есть ли незавершенная анкета с такими данными
     """
-    unfinished = crud.find_unfinished_survey(db, data.email, data.phone, data.kadastr)
+    unfinished = await crud_async.find_unfinished_survey(db, data.email, data.phone, data.kadastr)
     if unfinished:
         return {
             "has_unfinished": True,
@@ -88,12 +105,12 @@ def check_unfinished(data: UniqueCheckRequest = Body(...), db: Session = Depends
     return {"has_unfinished": False}
 
 @router.post("/send_code", response_model=schemas.CodeResponse)
-def send_verification_code_endpoint(data: schemas.SendCodeRequest, db: Session = Depends(get_db)):
+async def send_verification_code_endpoint(data: schemas.SendCodeRequest, db: AsyncSession = Depends(get_async_db)):
     """
     Отправляет код подтверждения на email
     """
     # Создаем код
-    code, can_send, seconds_remaining = crud.create_verification_code(db, data.email, data.session_id)
+    code, can_send, seconds_remaining = await crud_async.create_verification_code(db, data.email, data.session_id)
     
     if not can_send:
         return schemas.CodeResponse(
@@ -104,19 +121,19 @@ def send_verification_code_endpoint(data: schemas.SendCodeRequest, db: Session =
         )
     
     # Получаем имя пользователя для письма
-    response = crud.get_response_by_session(db, data.session_id)
+    response = await crud_async.get_response_by_session(db, data.session_id)
     name = ""
     if response:
-        # Ищем ответ с ФИО (question_id = 1)
-        fio_answer = db.query(crud.models.Answer).filter(
-            crud.models.Answer.response_id == response.id,
-            crud.models.Answer.question_id == 1
-        ).first()
-        if fio_answer:
-            name = fio_answer.value.split()[0] if fio_answer.value else ""
+        # Ищем ответ с ФИО
+        questions = await get_questions_snapshot()
+        fio = await crud_async.get_answer_value(db, response.id, questions.qid(ROLE_FIO))
+        if fio:
+            name = fio.split()[0] if fio.split() else ""
+    # Письмо отправляется по SMTP несколько секунд — соединение с БД на это время не держим
+    await db.close()
     
     # Отправляем email
-    email_sent = send_verification_code(data.email, code, name)
+    email_sent = await run_in_threadpool(send_verification_code, data.email, code, name)
     
     if email_sent:
         return schemas.CodeResponse(
@@ -130,13 +147,13 @@ def send_verification_code_endpoint(data: schemas.SendCodeRequest, db: Session =
         )
 
 @router.post("/verify_code", response_model=schemas.CodeResponse)
-def verify_verification_code(data: schemas.VerifyCodeRequest, db: Session = Depends(get_db)):
+async def verify_verification_code(data: schemas.VerifyCodeRequest, db: AsyncSession = Depends(get_async_db)):
     """
     Проверяет код подтверждения
     """
-    success, message = crud.verify_code(db, data.email, data.code, data.session_id)
+    success, message = await crud_async.verify_code(db, data.email, data.code, data.session_id)
     
-    can_request_new, seconds_remaining = crud.can_request_new_code(db, data.email, data.session_id)
+    can_request_new, seconds_remaining = await crud_async.can_request_new_code(db, data.email, data.session_id)
     
     return schemas.CodeResponse(
         success=success,
@@ -146,56 +163,48 @@ def verify_verification_code(data: schemas.VerifyCodeRequest, db: Session = Depe
     )
 
 @router.post("/base")
-def save_base(data: schemas.BaseStepSchema, db: Session = Depends(get_db)):
-    resp = crud.get_response_by_session(db, data.session_id)
-    if not resp:
-        resp = crud.create_response_base(db, data.session_id)
-    crud.upsert_answers(db, resp.id, [a.dict() for a in data.answers])
-    if data.consent:
-        crud.update_response_status(db, data.session_id, "consent")
+async def save_base(data: schemas.BaseStepSchema, db: AsyncSession = Depends(get_async_db)):
+    questions = await get_questions_snapshot()
+    # Анкета, ответы и статус записываются одной транзакцией
+    await crud_async.save_survey_step(db, data.session_id, [a.dict() for a in data.answers],
+                                      "consent" if data.consent else None, questions=questions)
     if data.screenshot:
         os.makedirs('consents', exist_ok=True)
         filename = f"consents/consent_{data.session_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
         with open(filename, 'wb') as f:
             f.write(base64.b64decode(data.screenshot.split(',')[1]))
     # --- Сброс кэша статистики, если есть кадастровый номер ---
-    if any(a.question_id == 2 and a.value for a in data.answers):
+    kadastr_qid = questions.qid(ROLE_KADASTR)
+    if any(a.question_id == kadastr_qid and a.value for a in data.answers):
         reset_stats_cache()
     return {"status": "ok", "session_id": data.session_id}
 
 @router.post("/details")
-def save_details(data: schemas.DetailsStepSchema, db: Session = Depends(get_db)):
+async def save_details(data: schemas.DetailsStepSchema, db: AsyncSession = Depends(get_async_db)):
     """Сохранить детальные ответы пользователя"""
-    resp = crud.get_response_by_session(db, data.session_id)
-    if not resp:
-        raise HTTPException(status_code=404, detail="Сессия не найдена")
-    
-    # Валидация и обработка комментариев
+    # Комментарий сохраняется сразу и ждёт фоновой модерации (app/moderation_queue.py),
+    # поэтому время ответа не зависит от DeepSeek
+    questions = await get_questions_snapshot()
+    comment_qid = questions.qid(ROLE_COMMENT)
     processed_answers = []
     for answer in data.answers:
         # Копируем данные ответа
         answer_dict = answer.dict()
         
-        # Проверяем только поле комментариев (question_id = 16)
-        if answer.question_id == 16 and answer.value and answer.value.strip():
-            is_valid, error_message = validate_comment(answer.value)
-            
-            if not is_valid:
-                # Не блокируем пользователя, но помечаем комментарий как не прошедший модерацию
-                print(f"⚠️  Комментарий НЕ прошёл модерацию: {error_message}")
-                print(f"   Текст: {answer.value[:100]}...")
-                answer_dict['moderated'] = False
-            else:
-                # Комментарий прошёл проверку
-                answer_dict['moderated'] = True
+        # Модерация нужна только полю комментариев
+        if answer.question_id == comment_qid and answer.value and answer.value.strip():
+            answer_dict['moderated'] = None  # Ждёт модерации
         else:
             # Для всех остальных полей - стандартная обработка
             answer_dict['moderated'] = True
             
         processed_answers.append(answer_dict)
     
-    crud.upsert_answers(db, resp.id, processed_answers)
-    crud.update_response_status(db, data.session_id, "complete")
+    # Ответы, статус complete и задача модерации записываются одной транзакцией
+    if not await crud_async.save_survey_step(db, data.session_id, processed_answers, "complete", create=False,
+                                             questions=questions):
+        raise HTTPException(status_code=404, detail="Сессия не найдена")
+    moderation_queue.notify()
     reset_stats_cache()
     return {"status": "ok", "session_id": data.session_id}
 
@@ -203,13 +212,13 @@ class LikeRequest(BaseModel):
     answer_id: int
 
 @router.post("/like")
-def like_comment(request: Request, data: LikeRequest, db: Session = Depends(get_db)):
+async def like_comment(request: Request, data: LikeRequest, db: AsyncSession = Depends(get_async_read_db)):
     """Лайкнуть комментарий (только один лайк с одного IP)"""
     # Получаем IP-адрес пользователя
     ip_address = request.client.host
     
     # Проверяем, существует ли такой ответ и прошёл ли он модерацию
-    answer = db.query(Answer).filter(Answer.id == data.answer_id).first()
+    answer = await crud_async.get_answer(db, data.answer_id)
     if not answer:
         raise HTTPException(status_code=404, detail="Комментарий не найден")
     
@@ -217,19 +226,8 @@ def like_comment(request: Request, data: LikeRequest, db: Session = Depends(get_
     if not answer.moderated:
         raise HTTPException(status_code=403, detail="Нельзя лайкать немодерированные комментарии")
     
-    try:
-        # Пытаемся создать лайк
-        like = CommentLike(answer_id=data.answer_id, ip_address=ip_address)
-        db.add(like)
-        db.commit()
-        
-        # Получаем общее количество лайков для этого комментария
-        likes_count = db.query(CommentLike).filter(CommentLike.answer_id == data.answer_id).count()
-        
-        return {"status": "liked", "likes_count": likes_count}
-    
-    except IntegrityError:
+    # Счётчик оптимистичный: записанные лайки плюс ещё ждущие записи в буфере
+    if await crud_async.has_like(db, data.answer_id, ip_address) or not like_buffer.add(data.answer_id, ip_address):
         # Пользователь уже лайкнул этот комментарий
-        db.rollback()
-        likes_count = db.query(CommentLike).filter(CommentLike.answer_id == data.answer_id).count()
-        return {"status": "already_liked", "likes_count": likes_count}
\ No newline at end of file
+        return {"status": "already_liked", "likes_count": answer.likes_count + like_buffer.pending_count(data.answer_id)}
+    return {"status": "liked", "likes_count": answer.likes_count + like_buffer.pending_count(data.answer_id)}
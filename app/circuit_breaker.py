@@ -0,0 +1,131 @@
+"""
+Автоматический выключатель (circuit breaker) для запросов к внешнему сервису.
+
+Когда DeepSeek тормозит или отвечает ошибками, каждый запрос к нему ждал полный
+таймаут, а комментарий всё равно пропускался без проверки. Выключатель считает
+последние BREAKER_WINDOW вызовов: ошибка или ответ дольше порога медленного вызова
+считаются неудачей. Если неудач в окне не меньше BREAKER_FAILURE_RATE (и вызовов
+не меньше BREAKER_MIN_CALLS), выключатель размыкается: следующие BREAKER_OPEN_SECONDS
+секунд вызовы не делаются совсем, allow() сразу возвращает False.
+
+Потом выключатель полуоткрыт: пропускается один пробный вызов. Удачный замыкает
+выключатель (окно очищается), неудачный снова размыкает его на BREAKER_OPEN_SECONDS.
+
+allow() выдаёт разрешение (Permit), которое вместе с итогом вызова передаётся в record().
+По нему выключатель отличает пробный вызов от запоздавших: вызов, разрешённый до
+размыкания, может завершиться уже в полуоткрытом состоянии, и его итог не должен
+замыкать или размыкать выключатель вместо пробного.
+"""
+import os
+import threading
+import time
+from collections import Counter, deque
+from typing import Dict, Optional
+
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+class Permit:
+    """Разрешение allow() на один вызов сервиса; передаётся в record() вместе с итогом"""
+    __slots__ = ('generation', 'probe')
+
+    def __init__(self, generation: int, probe: bool):
+        self.generation = generation  # Номер состояния выключателя, в котором вызов разрешён
+        self.probe = probe  # Пробный вызов полуоткрытого выключателя
+
+class CircuitBreaker:
+    def __init__(self, name: str, window: int = BREAKER_WINDOW, min_calls: int = BREAKER_MIN_CALLS,
+                 failure_rate: float = BREAKER_FAILURE_RATE, open_seconds: float = BREAKER_OPEN_SECONDS,
+                 clock=time.monotonic):
+        self.name = name  # Имя для логов
+        self._min_calls = min_calls
+        self._failure_rate = failure_rate
+        self._open_seconds = open_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._window = deque(maxlen=window)  # (удачно, длительность) последних вызовов
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._generation = 0  # Растёт при каждой смене состояния
+        self._probe_in_flight = False
+        self._transitions = Counter()  # 'closed->open': сколько раз
+        self._short_circuited = 0  # Вызовов, пропущенных без обращения к сервису
+
+    def allow(self) -> Optional[Permit]:
+        """
+        Разрешение на вызов сервиса или None, если обращаться к нему сейчас нельзя.
+        Итог разрешённого вызова нужно передать в record() вместе с разрешением.
+        """
+        with self._lock:
+            if self._state == OPEN and self._clock() - self._opened_at >= self._open_seconds:
+                self._move(HALF_OPEN)
+            if self._state == CLOSED:
+                return Permit(self._generation, probe=False)
+            if self._state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return Permit(self._generation, probe=True)
+            self._short_circuited += 1
+            return None
+
+    def record(self, permit: Permit, ok: bool, latency: float):
+        """Итог вызова по разрешению permit: ok=False — ошибка или вызов дольше допустимого"""
+        with self._lock:
+            if permit.generation != self._generation:
+                # Вызов разрешён до последней смены состояния: на выключатель он уже не влияет
+                return
+            if permit.probe:
+                self._probe_in_flight = False
+                if ok:
+                    self._window.clear()
+                    self._move(CLOSED)
+                else:
+                    self._open()
+                return
+            self._window.append((ok, latency))
+            if self._state == CLOSED and len(self._window) >= self._min_calls:
+                failures = sum(1 for success, _ in self._window if not success)
+                if failures / len(self._window) >= self._failure_rate:
+                    self._open()
+
+    def _open(self):
+        self._opened_at = self._clock()
+        self._move(OPEN)
+
+    def _move(self, state: str):
+        """Вызывается под self._lock"""
+        self._transitions[f"{self._state}->{state}"] += 1
+        failures = sum(1 for ok, _ in self._window if not ok)
+        print(f"[MODERATION] {self.name}: выключатель {self._state} -> {state} "
+              f"(неудач в окне {failures}/{len(self._window)}, пропущено вызовов {self._short_circuited})")
+        self._state = state
+        self._generation += 1
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def stats(self) -> Dict:
+        """Состояние, доля неудач и задержки в окне, переходы и пропущенные вызовы"""
+        with self._lock:
+            window = list(self._window)
+            latencies = sorted(latency for _, latency in window)
+            return {
+                'name': self.name,
+                'state': self._state,
+                'window': len(window),
+                'failure_rate': sum(1 for ok, _ in window if not ok) / len(window) if window else 0.0,
+                'p50_latency': _percentile(latencies, 0.5),
+                'p95_latency': _percentile(latencies, 0.95),
+                'transitions': dict(self._transitions),
+                'short_circuited': self._short_circuited,
+            }
+
+def _percentile(values, q: float) -> Optional[float]:
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(q * len(values)))]
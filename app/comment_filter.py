@@ -3,15 +3,30 @@
 
 import os
 import re
+import hashlib
+import json
+import time
 from openai import OpenAI
-from typing import Tuple, Optional
+from typing import Dict, List, Tuple, Optional
 import logging
 
+from app.circuit_breaker import CircuitBreaker, Permit
+from app.db import ReadSessionLocal, SessionLocal
+from app.lexicon_filter import LexiconFilter
+from app.moderation_cache import ModerationVerdictCache, verdict_key
+
 # Настройка логирования
 logger = logging.getLogger(__name__)
 
+# Бюджет на один запрос к DeepSeek, секунды. Запрос дольше половины бюджета
+# выключатель считает неудачным: сервис тормозит (см. app/circuit_breaker.py)
+MODERATION_TIMEOUT = float(os.getenv("MODERATION_TIMEOUT", "5"))
+
+class ModerationResponseError(Exception):
+    """Модель ответила, но вердикт из ответа не разобрать: комментарий нужно проверить ещё раз"""
+
 class AICommentFilter:
-    def __init__(self):
+    def __init__(self, verdict_cache: Optional[ModerationVerdictCache] = None):
         """Инициализация AI-фильтра комментариев на базе DeepSeek"""
         # Получаем API ключ из переменных окружения
         api_key = os.getenv('DEEPSEEK_API_KEY')
@@ -23,9 +38,16 @@ class AICommentFilter:
             # Инициализируем клиент DeepSeek (совместим с OpenAI API)
             self.client = OpenAI(
                 api_key=api_key,
-                base_url="https://api.deepseek.com"
+                # Другой адрес — например, локальная заглушка deepseek_stub.py для бенчмарков
+                base_url=os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com"),
+                max_retries=0  # Повторы клиента умножали бы таймаут; повторяет очередь модерации
             )
             self.use_ai = True
+        self.model = "deepseek-chat"
+        # Кэш вердиктов по тексту комментария (см. app/moderation_cache.py)
+        self.verdict_cache = verdict_cache
+        # Пока DeepSeek не отвечает, запросы к нему не делаются вовсе
+        self.breaker = CircuitBreaker("deepseek")
         
         # Минимальная длина осмысленного комментария
         self.min_length = 10
@@ -37,9 +59,16 @@ class AICommentFilter:
             r'^[0-9]+$',   # Только цифры
             r'^[a-zA-Z]+$', # Только латиница без русских букв
         ]
+
+        # Словарь явного мата и спама: такие комментарии отклоняются без запроса к AI
+        try:
+            self.lexicon = LexiconFilter.load()
+        except OSError as e:
+            logger.warning(f"Словарь модерации не загружен: {e}")
+            self.lexicon = None
         
-        # Системный промпт для AI модерации
-        self.moderation_prompt = """Ты модератор комментариев на сайте российского дачного поселка "Клеймёново-2". 
+        # Правила AI модерации (общие для проверки одного комментария и пакета)
+        self.moderation_rules = """Ты модератор комментариев на сайте российского дачного поселка "Клеймёново-2". 
 
 Отклоняй комментарии ТОЛЬКО если они содержат:
 1. Нецензурная лексика (мат, оскорбления)
@@ -52,13 +81,26 @@ class AICommentFilter:
 - Любые вежливые обращения
 - Краткие мнения и предложения
 
-Ответь ТОЛЬКО в формате JSON:
+"""
+        # Системный промпт для AI модерации
+        self.moderation_prompt = self.moderation_rules + """Ответь ТОЛЬКО в формате JSON:
 {
     "approved": true/false,
     "reason": "краткая причина отклонения или 'OK'"
 }
 
 Комментарий: """
+        # Промпт для пакетной проверки (python remoderate_comments.py): комментарии передаются
+        # JSON-массивом с номерами, вердикты возвращаются массивом с теми же номерами
+        self.batch_moderation_prompt = self.moderation_rules + """Проверь каждый комментарий из JSON-массива ниже.
+Ответь ТОЛЬКО JSON-массивом, по одному элементу на каждый комментарий:
+[
+    {"n": номер комментария, "approved": true/false, "reason": "краткая причина отклонения или 'OK'"}
+]
+
+Комментарии: """
+        # Версия фильтра входит в ключ кэша: после смены модели или промпта вердикты проверяются заново
+        self.cache_version = hashlib.sha256(f"{self.model}\n{self.moderation_prompt}".encode('utf-8')).hexdigest()[:16]
 
     def _basic_validation(self, text: str) -> Tuple[bool, str]:
         """Базовая валидация без AI"""
@@ -93,55 +135,112 @@ class AICommentFilter:
         if not re.search(r'[а-яёА-ЯЁ]', text):
             return False, "Комментарий должен содержать русские буквы"
         
+        # Проверка по словарю (app/moderation_lexicon.txt)
+        if self.lexicon is not None:
+            found = self.lexicon.find(text)
+            if found:
+                return False, found[0]
+        
         return True, "OK"
 
     def _ai_moderation(self, text: str) -> Tuple[bool, str]:
         """AI модерация через DeepSeek"""
+        verdict = self._ai_verdict(text)
+        if verdict is None:
+            # В случае ошибки или недоступности AI пропускаем комментарий
+            return True, "OK"
+        return verdict
+
+    def _ai_verdict(self, text: str) -> Optional[Tuple[bool, str]]:
+        """
+        Вердикт модели или None, если AI недоступен или ответил ошибкой (такой результат не кэшируется).
+        Если ответ пришёл, но это не JSON с булевым approved, — ModerationResponseError: угадывать
+        вердикт по словам ответа нельзя, очередь модерации повторит проверку позже.
+        """
         if not self.use_ai or not self.client:
             # Fallback на базовую проверку если AI недоступен
             logger.warning("AI модерация недоступна, используем базовую проверку")
-            return True, "OK"  # Пропускаем если AI недоступен
+            return None
+        permit = self.breaker.allow()
+        if permit is None:
+            # DeepSeek недавно не отвечал — не ждём таймаута, пропускаем сразу
+            return None
+        
+        try:
+            result_text = _strip_markdown(self._complete(
+                permit,
+                self.moderation_prompt + text,
+                max_tokens=100,
+                timeout=MODERATION_TIMEOUT
+            ))
+        except Exception as e:
+            logger.error(f"Ошибка AI модерации: {e}")
+            return None
+        logger.info(f"AI модерация ответ: {result_text}")
         
+        # Парсим JSON ответ
+        try:
+            result = json.loads(result_text)
+        except json.JSONDecodeError:
+            result = None
+        if not isinstance(result, dict) or not isinstance(result.get('approved'), bool):
+            logger.error(f"Ошибка парсинга JSON от AI: {result_text}")
+            raise ModerationResponseError(f"Ответ AI без вердикта: {result_text[:100]}")
+        return result['approved'], str(result.get('reason', 'OK'))
+
+    def moderate_batch(self, texts: List[str]) -> List[Optional[Tuple[bool, str]]]:
+        """
+        Проверяет несколько комментариев одним запросом к модели.
+        Возвращает вердикты в порядке texts; None — вердикта нет (AI недоступен,
+        ошибка или в ответе модели нет такого номера).
+        """
+        if not texts:
+            return []
+        if not self.use_ai or not self.client:
+            logger.warning("AI модерация недоступна")
+            return [None] * len(texts)
+        permit = self.breaker.allow()
+        if permit is None:
+            return [None] * len(texts)
+        numbered = json.dumps([{"n": n, "text": text} for n, text in enumerate(texts, 1)], ensure_ascii=False)
+        try:
+            result = json.loads(_strip_markdown(self._complete(
+                permit,
+                self.batch_moderation_prompt + numbered,
+                max_tokens=50 + 40 * len(texts),  # Около 40 токенов на вердикт
+                timeout=MODERATION_TIMEOUT + 2 * len(texts)
+            )))
+        except Exception as e:
+            logger.error(f"Ошибка пакетной AI модерации: {e}")
+            return [None] * len(texts)
+        verdicts: List[Optional[Tuple[bool, str]]] = [None] * len(texts)
+        for item in result if isinstance(result, list) else []:
+            if not isinstance(item, dict):
+                continue
+            n = item.get('n')
+            if isinstance(n, int) and 1 <= n <= len(texts) and isinstance(item.get('approved'), bool):
+                verdicts[n - 1] = (item['approved'], str(item.get('reason', 'OK')))
+        return verdicts
+
+    def _complete(self, permit: Permit, content: str, max_tokens: int, timeout: float) -> str:
+        """Запрос к модели по разрешению breaker.allow(); длительность и исход записываются в выключатель"""
+        t0 = time.monotonic()
         try:
             response = self.client.chat.completions.create(
-                model="deepseek-chat",
+                model=self.model,
                 messages=[
-                    {"role": "user", "content": self.moderation_prompt + text}
+                    {"role": "user", "content": content}
                 ],
                 temperature=0.1,  # Низкая температура для более предсказуемых результатов
-                max_tokens=100,
-                timeout=10  # Таймаут 10 секунд
+                max_tokens=max_tokens,
+                timeout=timeout
             )
-            
-            result_text = response.choices[0].message.content.strip()
-            logger.info(f"AI модерация ответ: {result_text}")
-            
-            # Убираем markdown блоки если есть
-            if result_text.startswith('```json'):
-                result_text = result_text.replace('```json', '').replace('```', '').strip()
-            elif result_text.startswith('```'):
-                result_text = result_text.replace('```', '').strip()
-            
-            # Парсим JSON ответ
-            import json
-            try:
-                result = json.loads(result_text)
-                approved = result.get('approved', True)
-                reason = result.get('reason', 'OK')
-                
-                return approved, reason
-                
-            except json.JSONDecodeError:
-                logger.error(f"Ошибка парсинга JSON от AI: {result_text}")
-                # Fallback: ищем ключевые слова в ответе
-                if 'false' in result_text.lower() or 'отклонен' in result_text.lower():
-                    return False, "Комментарий не прошёл AI модерацию"
-                return True, "OK"
-                
-        except Exception as e:
-            logger.error(f"Ошибка AI модерации: {e}")
-            # В случае ошибки пропускаем комментарий
-            return True, "OK"
+        except Exception:
+            self.breaker.record(permit, False, time.monotonic() - t0)
+            raise
+        latency = time.monotonic() - t0
+        self.breaker.record(permit, latency <= timeout / 2, latency)
+        return response.choices[0].message.content
 
     def is_valid_comment(self, text: str) -> Tuple[bool, str]:
         """
@@ -149,15 +248,52 @@ class AICommentFilter:
         
         Returns:
             (is_valid: bool, reason: str)
+        Raises:
+            ModerationResponseError: ответ модели не разобран, проверку нужно повторить
         """
         # Сначала базовая валидация
         is_valid, reason = self._basic_validation(text)
         if not is_valid:
             return is_valid, reason
         
-        # Затем AI модерация
-        return self._ai_moderation(text)
+        # Затем AI модерация — сначала ищем вердикт по тому же тексту в кэше
+        if self.verdict_cache is None:
+            return self._ai_moderation(text)
+        key = verdict_key(text, self.cache_version)
+        cached = self.verdict_cache.get(key)
+        if cached is not None:
+            return cached
+        verdict = self._ai_verdict(text)  # ModerationResponseError уходит вызывающему и тоже не кэшируется
+        if verdict is None:
+            return True, "OK"  # Пропускаем без кэширования: при следующей отправке спросим модель снова
+        self.verdict_cache.put(key, verdict)
+        stats = self.verdict_cache.stats()
+        print(f"[CACHE] moderation_verdicts: hit_rate={stats['hit_rate']:.2f}, misses={stats['misses']}, size={stats['size']}")
+        return verdict
     
+    def are_valid_comments(self, texts: List[str]) -> List[Optional[Tuple[bool, str]]]:
+        """
+        Проверка нескольких комментариев: базовая валидация и кэш вердиктов для каждого,
+        остальные — одним запросом moderate_batch. None — вердикта нет (AI недоступен или ошибка).
+        """
+        verdicts: List[Optional[Tuple[bool, str]]] = [None] * len(texts)
+        to_model, keys = [], {}
+        for i, text in enumerate(texts):
+            is_valid, reason = self._basic_validation(text)
+            if not is_valid:
+                verdicts[i] = (is_valid, reason)
+                continue
+            if self.verdict_cache is not None:
+                keys[i] = verdict_key(text, self.cache_version)
+                verdicts[i] = self.verdict_cache.get(keys[i])
+            if verdicts[i] is None:
+                to_model.append(i)
+        for i, verdict in zip(to_model, self.moderate_batch([texts[i] for i in to_model])):
+            verdicts[i] = verdict
+            if verdict is not None and self.verdict_cache is not None:
+                self.verdict_cache.put(keys[i], verdict)
+        return verdicts
+
     def get_toxicity_score(self, text: str) -> float:
         """
         Возвращает уровень токсичности от 0.0 до 1.0
@@ -186,8 +322,17 @@ class AICommentFilter:
         
         return min(score, 1.0)
 
+def _strip_markdown(result_text: str) -> str:
+    """Убирает markdown-блок ```json ... ```, в который модель иногда заворачивает ответ"""
+    result_text = result_text.strip()
+    if result_text.startswith('```json'):
+        result_text = result_text.replace('```json', '').replace('```', '').strip()
+    elif result_text.startswith('```'):
+        result_text = result_text.replace('```', '').strip()
+    return result_text
+
 # Глобальный экземпляр фильтра
-comment_filter = AICommentFilter()
+comment_filter = AICommentFilter(verdict_cache=ModerationVerdictCache(SessionLocal, ReadSessionLocal))
 
 def validate_comment(text: str) -> Tuple[bool, str]:
     """
@@ -198,6 +343,23 @@ def validate_comment(text: str) -> Tuple[bool, str]:
     """
     return comment_filter.is_valid_comment(text)
 
+def validate_comments(texts: List[str]) -> List[Optional[Tuple[bool, str]]]:
+    """
+    Пакетная валидация комментариев (для перепроверки уже сохранённых)
+    
+    Returns:
+        [(is_valid: bool, message: str) или None, если вердикта нет]
+    """
+    return comment_filter.are_valid_comments(texts)
+
+def get_moderation_cache_stats() -> Dict:
+    """Счётчики попаданий кэша вердиктов модерации"""
+    return comment_filter.verdict_cache.stats()
+
+def get_moderation_breaker_stats() -> Dict:
+    """Состояние выключателя запросов к DeepSeek: окно, задержки, переходы, пропущенные вызовы"""
+    return comment_filter.breaker.stats()
+
 def get_comment_toxicity(text: str) -> float:
     """
     Получить уровень токсичности комментария
@@ -1,9 +1,14 @@
+from sqlalchemy import text
 from sqlalchemy.orm import Session
-from app import models, schemas
+from app import identities, models, schemas, stats_counters
+from app.data_version import SCOPE_COMMENTS, SCOPE_SURVEY, bump_data_version
+from app.moderation_queue import enqueue_moderation
+from app.question_registry import QuestionSet
 from sqlalchemy.exc import IntegrityError
 import random
 import string
 from datetime import datetime, timedelta
+from uuid import uuid4
 
 # Получить все вопросы (для фронта)
 def get_questions(db: Session):
@@ -13,26 +18,11 @@ def get_questions(db: Session):
     return db.query(models.Question).order_by(models.Question.order).all()
 
 # Добавить новый ответ пользователя (response + answers)
-def create_response(db: Session, response_data: schemas.ResponseCreateSchema):
+def create_response(db: Session, response_data: schemas.ResponseCreateSchema, questions: QuestionSet = None):
     """
-    Сохраняет один проход опроса (response) и все ответы (answers) в базе данных.
+    Сохраняет один проход опроса (response) и все ответы (answers) в базе данных — одной транзакцией.
     """
-    # Создаём запись о новом респонденте (response)
-    db_response = models.Response()
-    db.add(db_response)
-    db.commit()
-    db.refresh(db_response)
-
-    # Для каждого ответа из формы создаём запись в answers
-    for answer in response_data.answers:
-        db_answer = models.Answer(
-            response_id=db_response.id,
-            question_id=answer.question_id,
-            value=answer.value
-        )
-        db.add(db_answer)
-    db.commit()
-    return db_response
+    return save_survey_step(db, str(uuid4()), [answer.dict() for answer in response_data.answers], questions=questions)
 
 # Получить все ответы (для аналитики)
 def get_all_responses(db: Session):
@@ -41,49 +31,14 @@ def get_all_responses(db: Session):
     """
     return db.query(models.Response).all()
 
-# Получить id вопроса по тексту
-def get_question_id_by_text(db: Session, text: str):
-    q = db.query(models.Question).filter(models.Question.text == text).first()
-    return q.id if q else None
-
-# Проверка уникальности email
-def is_email_exists(db: Session, email: str):
-    email_qid = get_question_id_by_text(db, 'Email')
-    if not email_qid:
-        return False
-    # Проверяем только завершенные анкеты
-    answer = db.query(models.Answer).join(models.Response).filter(
-        models.Answer.question_id == email_qid, 
-        models.Answer.value == email,
-        models.Response.status == 'complete'
-    ).first()
-    return answer is not None
-
-# Проверка уникальности кадастрового номера
-def is_kadastr_exists(db: Session, kadastr: str):
-    kadastr_qid = get_question_id_by_text(db, 'Кадастровый номер участка')
-    if not kadastr_qid:
-        return False
-    # Проверяем только завершенные анкеты
-    answer = db.query(models.Answer).join(models.Response).filter(
-        models.Answer.question_id == kadastr_qid, 
-        models.Answer.value == kadastr,
-        models.Response.status == 'complete'
-    ).first()
-    return answer is not None
-
-# Проверка уникальности телефона
-def is_phone_exists(db: Session, phone: str):
-    phone_qid = get_question_id_by_text(db, 'Телефон для связи')
-    if not phone_qid:
-        return False
-    # Проверяем только завершенные анкеты
-    answer = db.query(models.Answer).join(models.Response).filter(
-        models.Answer.question_id == phone_qid, 
-        models.Answer.value == phone,
-        models.Response.status == 'complete'
-    ).first()
-    return answer is not None
+# Проверка уникальности email, телефона и кадастрового номера
+def get_existing_identities(db: Session, email: str = None, phone: str = None, kadastr: str = None):
+    """
+    Какие из переданных данных уже есть в завершённых анкетах — один запрос по индексу
+    respondent_identities (см. app/identities.py). Возвращает множество видов: email / phone / kadastr.
+    """
+    rows = identities.find_identities(db, email, phone, kadastr, statuses=('complete',))
+    return {kind for kind, _, _ in rows}
 
 # Получить response по session_id
 def get_response_by_session(db: Session, session_id: str):
@@ -102,31 +57,88 @@ def create_response_base(db: Session, session_id: str, status: str = 'draft'):
     db.refresh(resp)
     return resp
 
+# Вставка ответа или обновление существующего (по уникальному индексу uq_answers_response_question).
+# Если moderated не передан, у нового ответа он True, а у существующего не меняется.
+# moderated = None — ответ ждёт фоновой модерации: записывается с False и ставится в очередь.
+_UPSERT_ANSWER_SQL = """
+INSERT INTO answers (response_id, question_id, value, moderated, likes_count)
+VALUES (:response_id, :question_id, :value, :moderated, 0)
+ON CONFLICT (response_id, question_id) DO UPDATE SET value = excluded.value{set_moderated}
+"""
+_UPSERT_ANSWER_WITH_MODERATION = text(_UPSERT_ANSWER_SQL.format(set_moderated=", moderated = excluded.moderated"))
+_UPSERT_ANSWER_KEEP_MODERATION = text(_UPSERT_ANSWER_SQL.format(set_moderated=""))
+
+def _write_answers(db: Session, response_id: int, answers: list):
+    """Записывает ответы одним INSERT ... ON CONFLICT DO UPDATE (executemany) вместо SELECT на каждый ответ"""
+    with_moderation, keep_moderation, pending = [], [], []
+    for ans in answers:
+        params = {
+            'response_id': response_id,
+            'question_id': ans['question_id'],
+            'value': ans['value'],
+            'moderated': ans.get('moderated', True)  # По умолчанию True
+        }
+        if 'moderated' in ans and ans['moderated'] is None:
+            params['moderated'] = False
+            pending.append(ans['question_id'])
+        (with_moderation if 'moderated' in ans else keep_moderation).append(params)
+    if with_moderation:
+        db.execute(_UPSERT_ANSWER_WITH_MODERATION, with_moderation)
+    if keep_moderation:
+        db.execute(_UPSERT_ANSWER_KEEP_MODERATION, keep_moderation)
+    enqueue_moderation(db, response_id, pending)
+
+# Сохранить шаг анкеты (ответы и, при необходимости, новый статус)
+def save_survey_step(db: Session, session_id: str, answers: list, status: str = None, create: bool = True,
+                     questions: QuestionSet = None):
+    """
+    Записывает шаг анкеты одной транзакцией с одним commit: создание анкеты (если create и её ещё нет),
+    ответы, смену статуса, счётчики статистики, контактные данные и версию данных.
+    Если шаг прервётся, в БД не останется его части.
+    questions — снимок реестра вопросов; асинхронные маршруты получают его заранее вне event loop.
+    Возвращает анкету или None, если её нет и create=False.
+    """
+    # Анкета читается один раз и дальше используется во всех частях шага
+    resp = get_response_by_session(db, session_id)
+    if resp is None:
+        if not create:
+            return None
+        resp = models.Response(session_id=session_id, status='draft')
+        db.add(resp)
+        db.flush()
+    # Снимок вклада анкеты в счётчики статистики до изменения
+    before = stats_counters.snapshot_response(db, resp.id, questions)
+    _write_answers(db, resp.id, answers)
+    if status is not None:
+        # Переход статуса переносит вклад анкеты между счётчиками статистики
+        resp.status = status
+    stats_counters.apply_response_change(db, resp.id, before, questions)
+    identities.sync_response_identities(db, resp.id, questions)
+    bump_data_version(db, SCOPE_SURVEY, SCOPE_COMMENTS)
+    db.commit()
+    return resp
+
 # Добавить или обновить answers для response
 def upsert_answers(db: Session, response_id: int, answers: list):
-    for ans in answers:
-        existing = db.query(models.Answer).filter_by(response_id=response_id, question_id=ans['question_id']).first()
-        if existing:
-            existing.value = ans['value']
-            # Обновляем поле модерации, если оно передано
-            if 'moderated' in ans:
-                existing.moderated = ans['moderated']
-        else:
-            # При создании нового ответа учитываем поле модерации
-            moderated = ans.get('moderated', True)  # По умолчанию True
-            db.add(models.Answer(
-                response_id=response_id, 
-                question_id=ans['question_id'], 
-                value=ans['value'],
-                moderated=moderated
-            ))
+    # Снимок вклада анкеты в счётчики статистики до изменения
+    before = stats_counters.snapshot_response(db, response_id)
+    _write_answers(db, response_id, answers)
+    stats_counters.apply_response_change(db, response_id, before)
+    identities.sync_response_identities(db, response_id)
+    bump_data_version(db, SCOPE_SURVEY, SCOPE_COMMENTS)
     db.commit()
 
 # Обновить статус анкеты
 def update_response_status(db: Session, session_id: str, status: str):
     resp = get_response_by_session(db, session_id)
     if resp:
-        resp.status = status
+        if resp.status != status:
+            # Переход статуса переносит вклад анкеты между счётчиками статистики
+            before = stats_counters.snapshot_response(db, resp.id)
+            resp.status = status
+            stats_counters.apply_response_change(db, resp.id, before)
+            identities.sync_response_identities(db, resp.id)
+            bump_data_version(db, SCOPE_SURVEY, SCOPE_COMMENTS)
         db.commit()
     return resp
 
@@ -135,53 +147,12 @@ def find_unfinished_survey(db: Session, email: str, phone: str, kadastr: str):
     """
     Ищет незавершенные анкеты (статус draft/consent) по email, телефону или кадастровому номеру
     """
-    email_qid = get_question_id_by_text(db, 'Email')
-    phone_qid = get_question_id_by_text(db, 'Телефон для связи')
-    kadastr_qid = get_question_id_by_text(db, 'Кадастровый номер участка')
-    
-    # Ищем незавершенные анкеты по email
-    if email_qid:
-        email_answer = db.query(models.Answer).filter(
-            models.Answer.question_id == email_qid, 
-            models.Answer.value == email
-        ).first()
-        if email_answer:
-            response = db.query(models.Response).filter(
-                models.Response.id == email_answer.response_id,
-                models.Response.status.in_(['draft', 'consent'])
-            ).first()
-            if response:
-                return response
-    
-    # Ищем незавершенные анкеты по телефону
-    if phone_qid:
-        phone_answer = db.query(models.Answer).filter(
-            models.Answer.question_id == phone_qid, 
-            models.Answer.value == phone
-        ).first()
-        if phone_answer:
-            response = db.query(models.Response).filter(
-                models.Response.id == phone_answer.response_id,
-                models.Response.status.in_(['draft', 'consent'])
-            ).first()
-            if response:
-                return response
-    
-    # Ищем незавершенные анкеты по кадастровому номеру
-    if kadastr_qid:
-        kadastr_answer = db.query(models.Answer).filter(
-            models.Answer.question_id == kadastr_qid, 
-            models.Answer.value == kadastr
-        ).first()
-        if kadastr_answer:
-            response = db.query(models.Response).filter(
-                models.Response.id == kadastr_answer.response_id,
-                models.Response.status.in_(['draft', 'consent'])
-            ).first()
-            if response:
-                return response
-    
-    return None
+    rows = identities.find_identities(db, email, phone, kadastr, statuses=identities.UNFINISHED_STATUSES)
+    if not rows:
+        return None
+    # Как и раньше, совпадение по email важнее телефона, телефон — кадастрового номера
+    kind, response_id, _ = min(rows, key=lambda row: (identities.IDENTITY_KINDS.index(row[0]), row[1]))
+    return db.get(models.Response, response_id)
 
 # ===== ФУНКЦИИ ДЛЯ РАБОТЫ С КОДАМИ ПОДТВЕРЖДЕНИЯ =====
 
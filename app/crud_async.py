@@ -0,0 +1,69 @@
+"""
+Асинхронные версии функций crud.py для маршрутов /survey/* (AsyncSession поверх aiosqlite).
+
+Простые чтения написаны заново через select(). Шаги с логикой счётчиков статистики,
+контактных данных и версий данных не дублируются: они выполняются синхронными функциями
+crud.py через AsyncSession.run_sync() — на том же соединении и в той же транзакции,
+но без отдельного потока, запросы по-прежнему ждут aiosqlite в event loop.
+Поэтому снимок реестра вопросов (questions) маршруты получают заранее через
+run_in_threadpool(question_registry.get) и передают сюда: question_registry.get()
+читает версию данных синхронно под threading.Lock и в event loop вызываться не должен.
+
+Синхронный crud.py остаётся для скриптов (add_questions.py, init_db.py и др.).
+"""
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import crud, models, schemas
+from app.likes import has_like as _has_like
+from app.question_registry import QuestionSet
+
+async def get_questions(db: AsyncSession):
+    """Список всех вопросов по порядку"""
+    result = await db.execute(select(models.Question).order_by(models.Question.order))
+    return result.scalars().all()
+
+async def get_response_by_session(db: AsyncSession, session_id: str):
+    result = await db.execute(select(models.Response).where(models.Response.session_id == session_id).limit(1))
+    return result.scalars().first()
+
+async def get_answer_value(db: AsyncSession, response_id: int, question_id: int):
+    """Значение ответа анкеты на вопрос (None — ответа нет)"""
+    result = await db.execute(
+        select(models.Answer.value).where(
+            models.Answer.response_id == response_id,
+            models.Answer.question_id == question_id
+        ).limit(1)
+    )
+    return result.scalar()
+
+async def get_answer(db: AsyncSession, answer_id: int):
+    return await db.get(models.Answer, answer_id)
+
+async def create_response(db: AsyncSession, response_data: schemas.ResponseCreateSchema, questions: QuestionSet = None):
+    return await db.run_sync(crud.create_response, response_data, questions)
+
+async def save_survey_step(db: AsyncSession, session_id: str, answers: list, status: str = None, create: bool = True,
+                           questions: QuestionSet = None):
+    """См. crud.save_survey_step: весь шаг анкеты одной транзакцией"""
+    return await db.run_sync(crud.save_survey_step, session_id, answers, status, create, questions)
+
+async def get_existing_identities(db: AsyncSession, email: str = None, phone: str = None, kadastr: str = None):
+    return await db.run_sync(crud.get_existing_identities, email, phone, kadastr)
+
+async def find_unfinished_survey(db: AsyncSession, email: str, phone: str, kadastr: str):
+    return await db.run_sync(crud.find_unfinished_survey, email, phone, kadastr)
+
+async def has_like(db: AsyncSession, answer_id: int, ip_address: str) -> bool:
+    return await db.run_sync(_has_like, answer_id, ip_address)
+
+# ===== КОДЫ ПОДТВЕРЖДЕНИЯ =====
+
+async def create_verification_code(db: AsyncSession, email: str, session_id: str):
+    return await db.run_sync(crud.create_verification_code, email, session_id)
+
+async def verify_code(db: AsyncSession, email: str, code: str, session_id: str):
+    return await db.run_sync(crud.verify_code, email, code, session_id)
+
+async def can_request_new_code(db: AsyncSession, email: str, session_id: str):
+    return await db.run_sync(crud.can_request_new_code, email, session_id)
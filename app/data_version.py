@@ -0,0 +1,67 @@
+"""
+Общая для всех воркеров версия данных.
+
+Кэши статистики и комментариев живут в памяти каждого процесса uvicorn.
+Чтобы запись в одном воркере сразу делала устаревшими кэши во всех остальных,
+каждая запись увеличивает счётчик в таблице data_versions (в той же транзакции),
+а воркер перед тем, как отдать значение из кэша, сверяет его версию с текущей.
+Чтение версии — один SELECT по таблице из нескольких строк; результат
+переиспользуется не дольше DATA_VERSION_CHECK_INTERVAL секунд.
+"""
+import os
+import threading
+import time
+from typing import Dict
+
+from sqlalchemy import inspect, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from app import models
+
+# Области данных: анкеты (статистика), комментарии (тексты, модерация, лайки) и сами вопросы
+SCOPE_SURVEY = 'survey'
+SCOPE_COMMENTS = 'comments'
+SCOPE_QUESTIONS = 'questions'
+SCOPES = (SCOPE_SURVEY, SCOPE_COMMENTS, SCOPE_QUESTIONS)
+
+# Как долго (в секундах) воркер может не перечитывать версию из БД
+DATA_VERSION_CHECK_INTERVAL = float(os.getenv("DATA_VERSION_CHECK_INTERVAL", "0.2"))
+
+def bump_data_version(db: Session, *scopes: str):
+    """Увеличивает версию данных в текущей транзакции (фиксируется вместе с записью)"""
+    table = models.DataVersion.__table__
+    for scope in scopes:
+        stmt = sqlite_insert(table).values(scope=scope, version=1)
+        stmt = stmt.on_conflict_do_update(index_elements=['scope'], set_={'version': table.c.version + 1})
+        db.execute(stmt)
+
+class DataVersionReader:
+    """Читает версии данных из БД, не чаще чем раз в check_interval секунд"""
+
+    def __init__(self, engine, check_interval: float = DATA_VERSION_CHECK_INTERVAL):
+        self._engine = engine
+        self._check_interval = check_interval
+        self._lock = threading.Lock()
+        self._versions: Dict[str, int] = {}
+        self._checked_at = 0.0
+
+    def get(self, scope: str) -> int:
+        """Текущая версия данных области scope"""
+        with self._lock:
+            if time.time() - self._checked_at >= self._check_interval:
+                table = models.DataVersion.__table__
+                with self._engine.connect() as conn:
+                    self._versions = dict(conn.execute(select(table.c.scope, table.c.version)).all())
+                self._checked_at = time.time()
+            return self._versions.get(scope, 0)
+
+    def expire(self):
+        """Следующий get() перечитает версии из БД (после записи в этом же процессе)"""
+        with self._lock:
+            self._checked_at = 0.0
+
+def ensure_data_versions(engine):
+    """Создаёт таблицу версий данных, если её нет (вызывается при старте приложения)"""
+    if models.DataVersion.__tablename__ not in inspect(engine).get_table_names():
+        models.Base.metadata.create_all(engine, tables=[models.DataVersion.__table__])
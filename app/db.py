@@ -1,7 +1,15 @@
+import contextvars
 import os
-from sqlalchemy import create_engine
+import sqlite3
+import time
+from contextlib import contextmanager
+from urllib.parse import quote
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
 # Корректный путь к базе данных (data/db.sqlite3 в корне проекта)
 DATABASE_PATH = os.getenv("DATABASE_PATH", os.path.join("data", "db.sqlite3"))
@@ -12,22 +20,195 @@ if dirname and not os.path.exists(dirname):
     os.makedirs(dirname, exist_ok=True)
 
 SQLALCHEMY_DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
+# Тот же файл через aiosqlite — для асинхронных маршрутов /survey/*
+ASYNC_DATABASE_URL = f"sqlite+aiosqlite:///{DATABASE_PATH}"
+
+# Настройки SQLite (применяются к каждому новому соединению)
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))  # Сколько ждать блокировку другого процесса
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")  # В режиме WAL NORMAL не теряет согласованность при сбое
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))  # Байт файла БД, читаемых через mmap
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-20000"))  # Отрицательное значение — размер кэша страниц в КБ
+# Пул соединений только для чтения (статистика, комментарии, версии данных)
+SQLITE_READ_POOL_SIZE = int(os.getenv("SQLITE_READ_POOL_SIZE", "4"))
+# Пул синхронных пишущих соединений (буфер лайков, очередь модерации, скрипты)
+SQLITE_WRITE_POOL_SIZE = int(os.getenv("SQLITE_WRITE_POOL_SIZE", "4"))
+# Сколько секунд запрос может ждать свободное пишущее соединение
+SQLITE_WRITE_POOL_TIMEOUT = float(os.getenv("SQLITE_WRITE_POOL_TIMEOUT", "30"))
+
+def _apply_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in pragmas:
+            cursor.execute(f"PRAGMA {pragma}")
+    finally:
+        cursor.close()
+
+# === ОЖИДАНИЕ БЛОКИРОВОК ===
+# Время, которое запрос провёл в ожидании пишущего соединения и блокировки записи SQLite.
+# Копится в объекте, который middleware кладёт в контекст запроса (см. track_lock_wait).
+_lock_wait = contextvars.ContextVar("db_lock_wait", default=None)
+
+class LockWait:
+    def __init__(self):
+        self.total = 0.0  # Суммарное ожидание, секунды
+        self.count = 0  # Сколько раз пришлось получать блокировку
+
+@contextmanager
+def track_lock_wait():
+    """Считает ожидание блокировок БД внутри блока (для текущего запроса и его потоков)"""
+    waits = LockWait()
+    token = _lock_wait.set(waits)
+    try:
+        yield waits
+    finally:
+        _lock_wait.reset(token)
 
-# Создаём движок SQLAlchemy (engine) — объект, который управляет соединением с БД
+def _record_lock_wait(seconds: float):
+    waits = _lock_wait.get()
+    if waits is not None:
+        waits.total += seconds
+        waits.count += 1
+
+class _LockWaitPoolMixin:
+    """Пул, который учитывает время ожидания свободного соединения"""
+
+    def _do_get(self):
+        t0 = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            _record_lock_wait(time.perf_counter() - t0)
+
+class _LockWaitQueuePool(_LockWaitPoolMixin, QueuePool):
+    pass
+
+class _LockWaitAsyncQueuePool(_LockWaitPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+_WRITE_PRAGMAS = (
+    "journal_mode=WAL",  # Читатели не блокируют запись и наоборот
+    f"synchronous={SQLITE_SYNCHRONOUS}",
+    f"busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+    f"mmap_size={SQLITE_MMAP_SIZE}",
+    f"cache_size={SQLITE_CACHE_SIZE}",
+)
+
+# === ПИШУЩИЙ ДВИЖОК ===
+# Обычный пул: соединение не становится глобальной блокировкой процесса. Записи ждут
+# друг друга на блокировке SQLite (до busy_timeout), а не в очереди пула, поэтому
+# сессия, которая только читает или ещё не закрыта, не задерживает остальных.
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
-    connect_args={"check_same_thread": False}  # Для SQLite обязательно!
+    connect_args={"check_same_thread": False},  # Для SQLite обязательно!
+    poolclass=_LockWaitQueuePool,
+    pool_size=SQLITE_WRITE_POOL_SIZE,
+    max_overflow=SQLITE_WRITE_POOL_SIZE,
+    pool_timeout=SQLITE_WRITE_POOL_TIMEOUT
 )
 
-# Создаём фабрику сессий — через неё будем работать с БД в каждом запросе
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def _configure_write_connection(dbapi_connection, connection_record):
+    # Транзакции открываем сами (_begin ниже), поэтому отключаем автоматический BEGIN драйвера
+    dbapi_connection.isolation_level = None
+    _apply_pragmas(dbapi_connection, _WRITE_PRAGMAS)
+
+def _begin(conn):
+    # Пишущие сессии (execution_options(sqlite_begin="IMMEDIATE")) берут блокировку записи
+    # сразу в начале транзакции: ожидание (до busy_timeout) происходит здесь, а не посреди
+    # транзакции после чтения, где SQLite вернул бы "database is locked" без ожидания.
+    # Остальные транзакции (миграции, служебные запросы) начинаются обычным BEGIN.
+    if conn.get_execution_options().get("sqlite_begin") != "IMMEDIATE":
+        conn.exec_driver_sql("BEGIN")
+        return
+    t0 = time.perf_counter()
+    conn.exec_driver_sql("BEGIN IMMEDIATE")
+    _record_lock_wait(time.perf_counter() - t0)
+
+event.listen(engine, "connect", _configure_write_connection)
+event.listen(engine, "begin", _begin)
+
+# === АСИНХРОННЫЙ ПИШУЩИЙ ДВИЖОК ===
+# Маршруты /survey/* работают в event loop через aiosqlite и не занимают потоки
+# пула AnyIO (по умолчанию их 40). Одно соединение: записи анкет идут по очереди
+# в пуле, а читающие маршруты используют async_read_engine. С синхронным движком
+# (буфер лайков, очередь модерации) он делит блокировку записи SQLite и ждёт её до busy_timeout.
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    poolclass=_LockWaitAsyncQueuePool,
+    pool_size=1,
+    max_overflow=0,
+    pool_timeout=SQLITE_WRITE_POOL_TIMEOUT
+)
+event.listen(async_engine.sync_engine, "connect", _configure_write_connection)
+event.listen(async_engine.sync_engine, "begin", _begin)
+
+# === ЧИТАЮЩИЙ ДВИЖОК ===
+# Соединения только для чтения (mode=ro): в режиме WAL они видят последние
+# зафиксированные данные и не мешают записи анкет.
+def _connect_read_only():
+    path = quote(os.path.abspath(DATABASE_PATH))
+    return sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+
+read_engine = create_engine(
+    "sqlite://",
+    creator=_connect_read_only,
+    poolclass=QueuePool,
+    pool_size=SQLITE_READ_POOL_SIZE,
+    max_overflow=SQLITE_READ_POOL_SIZE
+)
+
+def _configure_read_connection(dbapi_connection, connection_record):
+    _apply_pragmas(dbapi_connection, (
+        f"busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+        f"mmap_size={SQLITE_MMAP_SIZE}",
+        f"cache_size={SQLITE_CACHE_SIZE}",
+    ))
+
+event.listen(read_engine, "connect", _configure_read_connection)
+
+# Асинхронный вариант для маршрутов /survey/*, которые только читают (вопросы, проверки
+# уникальности и незавершённых анкет, лайки): они не ждут единственное пишущее соединение
+async_read_engine = create_async_engine(
+    f"sqlite+aiosqlite:///file:{quote(os.path.abspath(DATABASE_PATH))}?mode=ro&uri=true",
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=SQLITE_READ_POOL_SIZE,
+    max_overflow=SQLITE_READ_POOL_SIZE
+)
+event.listen(async_read_engine.sync_engine, "connect", _configure_read_connection)
+
+# Фабрика пишущих сессий: каждая транзакция начинается с BEGIN IMMEDIATE.
+# Сессии, которые только читают, открываются через ReadSessionLocal.
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine.execution_options(sqlite_begin="IMMEDIATE"))
+# Сессии только для чтения (страницы статистики и комментариев)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+# Асинхронные сессии для /survey/*. expire_on_commit=False: после commit атрибуты
+# объектов читаются без нового запроса (ленивой загрузки в async-коде быть не должно)
+AsyncSessionLocal = async_sessionmaker(async_engine.execution_options(sqlite_begin="IMMEDIATE"), class_=AsyncSession, autoflush=False, expire_on_commit=False)
+AsyncReadSessionLocal = async_sessionmaker(async_read_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
-# Функция для получения сессии (используется в зависимостях FastAPI)
+# Функция для получения пишущей сессии (используется в зависимостях FastAPI)
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+# Сессия только для чтения: не открывает пишущую транзакцию
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+# Асинхронная сессия для маршрутов /survey/*
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# Асинхронная сессия только для чтения
+async def get_async_read_db():
+    async with AsyncReadSessionLocal() as db:
+        yield db
@@ -0,0 +1,127 @@
+"""
+Индекс контактных данных анкет для проверок уникальности и поиска незавершённой анкеты.
+
+Раньше каждая проверка email, телефона и кадастрового номера шла по answers.value
+(без индекса) с JOIN на responses, а поиск незавершённой анкеты делал до девяти запросов.
+Теперь при каждой записи анкеты её email, телефон и кадастровый номер в каноническом виде
+копируются в таблицу respondent_identities вместе со статусом анкеты, и обе проверки
+выполняются одним запросом по индексу ix_respondent_identities_lookup для всех полей сразу.
+"""
+import re
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+from app import models
+from app.question_registry import ROLE_EMAIL, ROLE_KADASTR, ROLE_PHONE, QuestionSet, question_registry
+
+# Виды контактных данных совпадают с ролями вопросов; порядок — приоритет при поиске незавершённой анкеты
+IDENTITY_KINDS = (ROLE_EMAIL, ROLE_PHONE, ROLE_KADASTR)
+# Статусы незавершённой анкеты
+UNFINISHED_STATUSES = ('draft', 'consent')
+
+def normalize_email(value: str) -> str:
+    """Email без пробелов по краям, в нижнем регистре"""
+    return value.strip().lower()
+
+def normalize_phone(value: str) -> str:
+    """
+    Телефон — только цифры в формате 7XXXXXXXXXX:
+    '+7 (999) 123-45-67', '8 999 123 45 67' и '9991234567' дают одно и то же значение.
+    """
+    digits = re.sub(r'\D', '', value)
+    if len(digits) == 11 and digits[0] == '8':
+        digits = '7' + digits[1:]
+    elif len(digits) == 10:
+        digits = '7' + digits
+    return digits
+
+def normalize_kadastr(value: str) -> str:
+    """Кадастровый номер — только цифры и двоеточия ('50 : 12:0010203:456' -> '50:12:0010203:456')"""
+    return re.sub(r'[^0-9:]', '', value)
+
+NORMALIZERS = {
+    ROLE_EMAIL: normalize_email,
+    ROLE_PHONE: normalize_phone,
+    ROLE_KADASTR: normalize_kadastr,
+}
+
+def normalize_identity(kind: str, value: Optional[str]) -> str:
+    """Канонический вид значения; пустая строка — значения нет"""
+    if not value:
+        return ''
+    return NORMALIZERS[kind](value)
+
+def response_identities(answers: List[Tuple[int, str]], questions: QuestionSet) -> Dict[str, str]:
+    """Контактные данные анкеты: вид -> нормализованное значение (по парам (question_id, value))"""
+    kind_by_qid = {questions.qid(kind): kind for kind in IDENTITY_KINDS if questions.qid(kind) is not None}
+    identities = {}
+    for qid, value in answers:
+        kind = kind_by_qid.get(qid)
+        normalized = normalize_identity(kind, value) if kind else ''
+        if normalized:
+            identities[kind] = normalized
+    return identities
+
+def sync_response_identities(db: Session, response_id: int, questions: QuestionSet = None):
+    """
+    Переписывает контактные данные анкеты по её текущим ответам и статусу.
+    Вызывается в той же транзакции, что и запись анкеты (до commit).
+    """
+    if questions is None:
+        questions = question_registry.get()
+    db.flush()
+    status = db.query(models.Response.status).filter(models.Response.id == response_id).scalar()
+    qids = [questions.qid(kind) for kind in IDENTITY_KINDS if questions.qid(kind) is not None]
+    answers = db.query(models.Answer.question_id, models.Answer.value).filter(
+        models.Answer.response_id == response_id,
+        models.Answer.question_id.in_(qids)
+    ).all()
+    db.query(models.RespondentIdentity).filter(
+        models.RespondentIdentity.response_id == response_id
+    ).delete(synchronize_session=False)
+    if status is None:
+        return
+    for kind, normalized in response_identities(answers, questions).items():
+        db.add(models.RespondentIdentity(kind=kind, normalized_value=normalized, response_id=response_id, status=status))
+    db.flush()
+
+def find_identities(db: Session, email: str = None, phone: str = None, kadastr: str = None, statuses=None) -> List:
+    """
+    Анкеты с такими же email, телефоном или кадастровым номером — один запрос по индексу.
+    Возвращает строки (kind, response_id, status); statuses ограничивает статусы анкет.
+    """
+    values = {
+        ROLE_EMAIL: normalize_identity(ROLE_EMAIL, email),
+        ROLE_PHONE: normalize_identity(ROLE_PHONE, phone),
+        ROLE_KADASTR: normalize_identity(ROLE_KADASTR, kadastr),
+    }
+    conditions = [
+        and_(models.RespondentIdentity.kind == kind, models.RespondentIdentity.normalized_value == value)
+        for kind, value in values.items() if value
+    ]
+    if not conditions:
+        return []
+    identity = models.RespondentIdentity
+    query = db.query(identity.kind, identity.response_id, identity.status).filter(or_(*conditions))
+    if statuses is not None:
+        query = query.filter(identity.status.in_(statuses))
+    return query.all()
+
+def build_identities(db: Session):
+    """Заполняет respondent_identities заново по всем анкетам в текущей транзакции (commit — за вызывающим)"""
+    questions = question_registry.get()
+    qids = [questions.qid(kind) for kind in IDENTITY_KINDS if questions.qid(kind) is not None]
+    rows = db.query(models.Answer.response_id, models.Answer.question_id, models.Answer.value, models.Response.status).join(
+        models.Response, models.Response.id == models.Answer.response_id
+    ).filter(models.Answer.question_id.in_(qids)).order_by(models.Answer.response_id).all()
+    answers_by_response = {}
+    for response_id, qid, value, status in rows:
+        answers_by_response.setdefault((response_id, status), []).append((qid, value))
+    db.query(models.RespondentIdentity).delete(synchronize_session=False)
+    db.bulk_insert_mappings(models.RespondentIdentity, [
+        {'kind': kind, 'normalized_value': normalized, 'response_id': response_id, 'status': status}
+        for (response_id, status), answers in answers_by_response.items()
+        for kind, normalized in response_identities(answers, questions).items()
+    ])
@@ -0,0 +1,138 @@
+"""
+Локальная проверка комментариев по словарю (app/moderation_lexicon.txt).
+
+Явный мат и спам отклоняются без запроса к DeepSeek: в модель уходят только
+комментарии, по которым словарь ничего не нашёл. Все шаблоны словаря собраны
+в один автомат Ахо — Корасик, поэтому комментарий проверяется за один проход
+по тексту независимо от размера словаря.
+
+Перед поиском текст и шаблоны одинаково «сворачиваются» (fold_text): регистр,
+ё -> е, латинские и цифровые двойники русских букв (x -> х, 0 -> о, 3 -> з ...),
+разделители внутри слова (х.у.й, х-у-й), слова по одной букве через пробел
+(х у й) и повторы букв (хууууй). Граница слова учитывается по разметке шаблона
+(см. заголовок словаря), чтобы «корабля» не совпадало с «бля».
+"""
+import os
+import re
+import unicodedata
+from collections import deque
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Путь к словарю; можно подменить, не трогая код
+MODERATION_LEXICON_PATH = os.getenv(
+    "MODERATION_LEXICON_PATH", os.path.join(os.path.dirname(__file__), "moderation_lexicon.txt")
+)
+
+# Латинские буквы и цифры, которыми подменяют похожие русские
+_LOOKALIKES = str.maketrans({
+    'a': 'а', 'b': 'в', 'c': 'с', 'e': 'е', 'h': 'н', 'k': 'к', 'm': 'м', 'n': 'п',
+    'o': 'о', 'p': 'р', 'r': 'г', 't': 'т', 'u': 'и', 'x': 'х', 'y': 'у',
+    '0': 'о', '3': 'з', '4': 'ч', '6': 'б', '@': 'а', 'ё': 'е',
+})
+_IN_WORD_SEPARATORS = re.compile(r"(?<=\w)[.\-_*'\"`|~+]+(?=\w)")
+_NON_LETTERS = re.compile(r"[\W\d_]+")
+_REPEATS = re.compile(r"(\w)\1+")
+
+def fold_text(text: str) -> str:
+    """
+    Текст для поиска по словарю: только буквы, слова через один пробел,
+    пробел в начале и в конце (чтобы проверять границы слов без особых случаев)
+    """
+    text = unicodedata.normalize('NFKC', text).casefold().translate(_LOOKALIKES)
+    text = _IN_WORD_SEPARATORS.sub('', text)
+    words = _NON_LETTERS.sub(' ', text).split()
+    # Три и больше однобуквенных слова подряд склеиваем: «х у й» -> «хуй»
+    merged, run = [], []
+    for word in words + ['']:
+        if len(word) == 1:
+            run.append(word)
+            continue
+        merged.extend([''.join(run)] if len(run) >= 3 else run)
+        run = []
+        if word:
+            merged.append(word)
+    return ' ' + _REPEATS.sub(r'\1', ' '.join(merged)) + ' '
+
+class AhoCorasick:
+    """Автомат Ахо — Корасик: все вхождения набора строк за один проход по тексту"""
+
+    def __init__(self, patterns: List[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Tuple[int, ...]] = [()]
+        for index, pattern in enumerate(patterns):
+            node = 0
+            for ch in pattern:
+                if ch not in self._goto[node]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                    self._goto[node][ch] = len(self._goto) - 1
+                node = self._goto[node][ch]
+            self._out[node] += (index,)
+        # Суффиксные ссылки и полная таблица переходов обходом в ширину: суффикс узла короче
+        # и уже обработан. При поиске — один dict.get на символ, без возвратов по ссылкам.
+        self._delta: List[Dict[str, int]] = [dict(self._goto[0])] + [{} for _ in self._goto[1:]]
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            self._delta[node] = {**self._delta[self._fail[node]], **self._goto[node]}
+            for ch, child in self._goto[node].items():
+                self._fail[child] = self._delta[self._fail[node]].get(ch, 0)
+                self._out[child] += self._out[self._fail[child]]
+                queue.append(child)
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int]]:
+        """(индекс последнего символа вхождения, номер шаблона)"""
+        delta, out = self._delta, self._out
+        node = 0
+        for i, ch in enumerate(text):
+            node = delta[node].get(ch, 0)
+            if out[node]:
+                for index in out[node]:
+                    yield i, index
+
+class LexiconFilter:
+    """Словарь запрещённых слов и фраз, собранный в один автомат"""
+
+    def __init__(self, entries: List[Tuple[str, bool, bool, str]]):
+        # (свёрнутый шаблон, нужна граница слова в начале, нужна граница в конце, причина)
+        self._entries = entries
+        self._automaton = AhoCorasick([pattern for pattern, _, _, _ in entries])
+
+    @classmethod
+    def load(cls, path: str = MODERATION_LEXICON_PATH) -> "LexiconFilter":
+        """
+        Читает словарь: «[Причина]» начинает раздел, дальше по шаблону в строке.
+        «слово» — целое слово, «корень*» — начало слова, «*корень*» — где угодно в слове.
+        """
+        entries, reason = [], "Запрещённые слова"
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.split('#', 1)[0].strip()
+                if not line:
+                    continue
+                if line.startswith('[') and line.endswith(']'):
+                    reason = line[1:-1].strip()
+                    continue
+                pattern = fold_text(line.strip('*')).strip()
+                if pattern:
+                    entries.append((pattern, not line.startswith('*'), not line.endswith('*'), reason))
+        print(f"[MODERATION] Словарь: {len(entries)} шаблонов из {path}")
+        return cls(entries)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def find(self, text: str) -> Optional[Tuple[str, str]]:
+        """Первое совпадение со словарём: (причина, шаблон) или None"""
+        folded = fold_text(text)
+        for end, index in self._automaton.iter_matches(folded):
+            pattern, word_start, word_end, reason = self._entries[index]
+            start = end - len(pattern) + 1
+            if word_start and folded[start - 1] != ' ':
+                continue
+            if word_end and folded[end + 1] != ' ':
+                continue
+            return reason, pattern
+        return None
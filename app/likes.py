@@ -0,0 +1,191 @@
+"""
+Лайки комментариев со счётчиком, хранящимся прямо в answers.likes_count.
+
+Раньше число лайков считалось через COUNT по comment_likes при каждом показе
+комментариев и после каждого лайка. Теперь счётчик хранится в answers.likes_count,
+а топ комментариев читается по индексу ix_answers_top_comments.
+
+Каждый клик больше не открывает собственную пишущую транзакцию SQLite: LikeBuffer
+принимает лайки в память (с проверкой повторов по паре (answer_id, ip)) и раз в
+LIKES_FLUSH_INTERVAL_MS миллисекунд или по накоплении LIKES_FLUSH_BATCH лайков
+записывает их одной транзакцией. При остановке приложения буфер сбрасывается в БД.
+
+reconcile_likes() пересчитывает счётчики по comment_likes и сообщает о расхождениях
+(python reconcile_likes.py).
+"""
+import os
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional, Set, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app import models
+from app.data_version import SCOPE_COMMENTS, bump_data_version
+
+# Как часто (в миллисекундах) и по накоплении скольких лайков буфер пишется в БД
+LIKES_FLUSH_INTERVAL_MS = int(os.getenv("LIKES_FLUSH_INTERVAL_MS", "500"))
+LIKES_FLUSH_BATCH = int(os.getenv("LIKES_FLUSH_BATCH", "100"))
+
+class LikeBuffer:
+    """Буфер лайков: приём в память с дедупликацией и пакетная запись в comment_likes"""
+
+    def __init__(self, session_factory, flush_interval_ms: int = LIKES_FLUSH_INTERVAL_MS,
+                 flush_batch: int = LIKES_FLUSH_BATCH, on_flush=None):
+        self._session_factory = session_factory
+        self._flush_interval = flush_interval_ms / 1000
+        self._flush_batch = flush_batch
+        self._on_flush = on_flush  # Вызывается после каждой успешной записи (например, сброс кэша)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # Записи в БД идут по одной
+        self._pending: Set[Tuple[int, str]] = set()  # (answer_id, ip), ещё не записанные в БД
+        self._pending_by_answer = Counter()  # answer_id -> число незаписанных лайков
+        self._flushing: Set[Tuple[int, str]] = set()  # (answer_id, ip) пачки, которая сейчас фиксируется
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, answer_id: int, ip_address: str) -> bool:
+        """Принимает лайк в буфер; False — такой лайк уже ждёт записи"""
+        key = (answer_id, ip_address)
+        with self._lock:
+            if key in self._pending or key in self._flushing:
+                return False
+            self._pending.add(key)
+            self._pending_by_answer[answer_id] += 1
+            pending = len(self._pending)
+            self._ensure_thread()
+        if pending >= self._flush_batch:
+            self._wakeup.set()
+        return True
+
+    def pending_count(self, answer_id: int) -> int:
+        """
+        Сколько лайков комментария ещё не записано в БД (для оптимистичного счётчика).
+        Лайки пачки, которая сейчас фиксируется, сюда не входят: их уже учитывает likes_count.
+        """
+        with self._lock:
+            return self._pending_by_answer[answer_id]
+
+    def flush(self) -> int:
+        """
+        Записывает накопленные лайки одной транзакцией (INSERT OR IGNORE пачкой),
+        пересчитывает answers.likes_count у затронутых комментариев и увеличивает версию данных.
+        Возвращает число записанных лайков.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._pending)
+            if not batch:
+                return 0
+            db = self._session_factory()
+            try:
+                db.execute(
+                    text("INSERT OR IGNORE INTO comment_likes (answer_id, ip_address) VALUES (:answer_id, :ip_address)"),
+                    [{'answer_id': answer_id, 'ip_address': ip} for answer_id, ip in batch]
+                )
+                # Счётчик пересчитываем по comment_likes: лайки, уже записанные другим воркером, не удвоятся
+                db.execute(
+                    text("UPDATE answers SET likes_count = "
+                         "(SELECT COUNT(*) FROM comment_likes cl WHERE cl.answer_id = answers.id) "
+                         "WHERE id = :answer_id"),
+                    [{'answer_id': answer_id} for answer_id in {answer_id for answer_id, _ in batch}]
+                )
+                bump_data_version(db, SCOPE_COMMENTS)
+                # Пачка уходит из pending_count до фиксации, иначе запрос, прочитавший уже
+                # пересчитанный likes_count, прибавил бы её второй раз
+                self._move_to_flushing(batch)
+                try:
+                    db.commit()
+                except Exception:
+                    self._restore_pending(batch)
+                    raise
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+            with self._lock:
+                self._flushing.difference_update(batch)
+        if self._on_flush:
+            self._on_flush()
+        return len(batch)
+
+    def _move_to_flushing(self, batch):
+        with self._lock:
+            for key in batch:
+                self._pending.discard(key)
+                self._flushing.add(key)
+                self._pending_by_answer[key[0]] -= 1
+                if self._pending_by_answer[key[0]] <= 0:
+                    del self._pending_by_answer[key[0]]
+
+    def _restore_pending(self, batch):
+        """Пачка не записана: возвращаем её в буфер до следующей попытки"""
+        with self._lock:
+            for key in batch:
+                self._flushing.discard(key)
+                self._pending.add(key)
+                self._pending_by_answer[key[0]] += 1
+
+    def stop(self):
+        """Останавливает фоновый поток и записывает всё, что осталось в буфере"""
+        with self._lock:
+            self._stopped = True
+            thread = self._thread
+        self._wakeup.set()
+        if thread is not None:
+            thread.join()
+        self.flush()
+
+    def _ensure_thread(self):
+        """Запускает фоновый поток записи при первом лайке (вызывать под self._lock)"""
+        if self._thread is None and not self._stopped:
+            self._thread = threading.Thread(target=self._run, name="like-buffer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self._flush_interval)
+            self._wakeup.clear()
+            with self._lock:
+                if self._stopped:
+                    return
+            try:
+                t0 = time.time()
+                written = self.flush()
+                if written:
+                    print(f"[PROFILE] Likes flush: {written} за {time.time()-t0:.3f}s")
+            except Exception as e:
+                # Лайки остаются в буфере и будут записаны при следующей попытке
+                print(f"[LIKES] Ошибка записи лайков: {e}")
+
+def has_like(db: Session, answer_id: int, ip_address: str) -> bool:
+    """Есть ли уже записанный в БД лайк с этого IP (чтение по уникальному индексу, без записи)"""
+    return db.query(models.CommentLike.id).filter(
+        models.CommentLike.answer_id == answer_id,
+        models.CommentLike.ip_address == ip_address
+    ).first() is not None
+
+def reconcile_likes(db: Session) -> Dict[int, Tuple[int, int]]:
+    """
+    Пересчитывает answers.likes_count по таблице comment_likes в текущей транзакции
+    (commit — за вызывающим). Возвращает расхождения: answer_id -> (было в счётчике, стало по comment_likes).
+    """
+    rows = db.execute(text("""
+        SELECT a.id, a.likes_count, COUNT(cl.id)
+        FROM answers a
+        LEFT JOIN comment_likes cl ON cl.answer_id = a.id
+        GROUP BY a.id, a.likes_count
+        HAVING a.likes_count != COUNT(cl.id)
+    """)).all()
+    drift = {answer_id: (was, now) for answer_id, was, now in rows}
+    for answer_id, (_, now) in drift.items():
+        db.query(models.Answer).filter(models.Answer.id == answer_id).update(
+            {models.Answer.likes_count: now}, synchronize_session=False
+        )
+    if drift:
+        bump_data_version(db, SCOPE_COMMENTS)
+    return drift
@@ -7,9 +7,19 @@ load_dotenv()
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from starlette.concurrency import run_in_threadpool
 from app.api import survey
 from app.api.stats import get_survey_statistics, generate_bokeh_charts, detect_device_type
-from app.api.stats import get_survey_statistics_cached, generate_bokeh_charts_cached, get_comments_data_cached, get_all_comments_cached
+from app.api.stats import get_survey_statistics_versioned, generate_chart_json_cached
+from app.api.stats import get_stats_page_data, get_comments_page_data, peek_page_data_version
+from app.api.stats import COMMENTS_PAGE_SIZE, get_comments_page
+from app.api.stats import CHARTS, CHART_SIZES
+from app.db import engine, async_engine, async_read_engine, SessionLocal, track_lock_wait
+from app.data_version import ensure_data_versions
+from app.migrations import apply_migrations
+from app.question_registry import question_registry
+from app.stats_cache import LRUCache
+from app.stats_executor import StatsBusyError, run_stats_job, shutdown_stats_executor
 
 app = FastAPI(
     title="Опрос жителей Клеймёново-2",
@@ -17,6 +27,56 @@ app = FastAPI(
     version="1.0.0"
 )
 
+@app.on_event("startup")
+def prepare_database():
+    """
+    Создаём таблицу версий данных, загружаем реестр вопросов и применяем миграции схемы
+    (в том числе создание и заполнение счётчиков статистики, лайков и индекса контактных данных анкет)
+    """
+    ensure_data_versions(engine)
+    question_registry.get()
+    apply_migrations(engine, SessionLocal)
+
+@app.on_event("startup")
+def start_moderation_queue():
+    """Комментарии, не проверенные до остановки, модерируются сразу после старта (после миграций)"""
+    survey.moderation_queue.start()
+
+@app.on_event("shutdown")
+def flush_like_buffer():
+    """Записываем в БД лайки из буфера"""
+    survey.like_buffer.stop()
+
+@app.on_event("shutdown")
+def stop_moderation_queue():
+    """Останавливаем фоновую модерацию комментариев"""
+    survey.moderation_queue.stop()
+
+@app.on_event("shutdown")
+def stop_stats_executor():
+    """Останавливаем пул потоков статистики"""
+    shutdown_stats_executor()
+
+@app.on_event("shutdown")
+async def close_async_engine():
+    """Закрываем соединения aiosqlite маршрутов /survey/*"""
+    await async_engine.dispose()
+    await async_read_engine.dispose()
+
+# Ожидание блокировок БД дольше этого порога (в секундах) пишется в лог
+DB_LOCK_WAIT_LOG_THRESHOLD = float(os.getenv("DB_LOCK_WAIT_LOG_THRESHOLD", "0.05"))
+
+@app.middleware("http")
+async def report_db_lock_wait(request, call_next):
+    """Сообщает, сколько запрос ждал пишущее соединение и блокировку записи SQLite"""
+    with track_lock_wait() as waits:
+        response = await call_next(request)
+    if waits.count:
+        response.headers["Server-Timing"] = f"db-lock;dur={waits.total * 1000:.1f}"
+    if waits.total >= DB_LOCK_WAIT_LOG_THRESHOLD:
+        print(f"[PROFILE] DB lock wait {request.method} {request.url.path}: {waits.total:.3f}s ({waits.count} раз)")
+    return response
+
 # Подключаем роуты опроса
 app.include_router(survey.router)
 
@@ -27,9 +87,10 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
 # Пример главной страницы (можно расширить)
-from fastapi import Request
-from fastapi.responses import HTMLResponse
+from fastapi import Request, HTTPException
+from fastapi.responses import HTMLResponse, Response
 import time
+from email.utils import formatdate
 
 @app.get("/", response_class=HTMLResponse)
 def index(request: Request):
@@ -39,40 +100,154 @@ def index(request: Request):
 def thanks(request: Request):
     return templates.TemplateResponse("thanks.html", {"request": request})
 
-# Статистика с реальными данными и графиками Bokeh
-@app.get("/stats", response_class=HTMLResponse)
-async def stats(request: Request):
-    """Страница статистики с графиками"""
-    user_agent = request.headers.get("user-agent", "")
-    device_type = detect_device_type(user_agent)
-    statistics = get_survey_statistics_cached()
-    comments_data = get_comments_data_cached()
-    bokeh_script, charts = generate_bokeh_charts_cached(statistics, device_type)
+# Отрендеренные страницы /stats и /comments по ETag (версия данных + тип устройства):
+# повторный запрос той же версии отдаёт готовые байты без рендера шаблона
+_rendered_pages = LRUCache('rendered_pages', maxsize=len(CHART_SIZES) * 2 + 2)
+
+def page_etag(page: str, version: str, device_type: str = '') -> str:
+    return '"' + '-'.join(part for part in (page, device_type, version) if part) + '"'
+
+def page_response(request: Request, etag: str, body: bytes, updated_at: float) -> Response:
+    """HTML-страница с ETag/Last-Modified; если у браузера та же версия — 304 без тела"""
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(updated_at, usegmt=True),
+        # Браузер хранит страницу, но перед показом перепроверяет её условным запросом
+        "Cache-Control": "no-cache"
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(content=body, headers=headers)
+
+async def cached_page_response(request: Request, page: str, device_type: str = ''):
+    """Ответ без обращения к пулу, если данные уже загружены и страница этой версии уже отрендерена"""
+    # Версия данных читается синхронно (SELECT под threading.Lock) — не в event loop
+    current = await run_in_threadpool(peek_page_data_version, page)
+    if current is None:
+        return None
+    version, updated_at = current
+    etag = page_etag(page, version, device_type)
+    if request.headers.get("if-none-match") == etag:
+        return page_response(request, etag, b'', updated_at)
+    cached = _rendered_pages.get(etag)
+    if cached is None:
+        return None
+    return page_response(request, etag, *cached)
+
+# Статистика с реальными данными и графиками Bokeh.
+# Вся синхронная работа (чтение статистики, графики, рендер шаблонов) выполняется
+# в пуле app/stats_executor.py, чтобы не блокировать event loop.
+def render_stats_page(request: Request, device_type: str):
+    statistics, comments_data, version, updated_at = get_stats_page_data()
+    etag = page_etag('stats', version, device_type)
+    cached = _rendered_pages.peek(etag)
+    if cached is not None:
+        return etag, *cached
+    # Графики не встраиваются в страницу: браузер загружает их по одному через /stats/charts/{name}
     t0 = time.time()
     resp = templates.TemplateResponse("stats.html", {
         "request": request,
         "statistics": statistics,
-        "bokeh_script": bokeh_script,
-        "charts": charts,
+        "device_type": device_type,
         "comments_data": comments_data
     })
     t1 = time.time()
     print(f"[PROFILE] Jinja2 stats.html render: {t1-t0:.3f}s")
-    return resp
+    _rendered_pages.put(etag, (resp.body, updated_at))
+    return etag, resp.body, updated_at
 
-@app.get("/comments", response_class=HTMLResponse)
-async def comments_page(request: Request):
-    """Страница всех комментариев жителей"""
-    all_comments = get_all_comments_cached()
+@app.get("/stats", response_class=HTMLResponse)
+async def stats(request: Request):
+    """Страница статистики с графиками"""
+    user_agent = request.headers.get("user-agent", "")
+    device_type = detect_device_type(user_agent)
+    cached = await cached_page_response(request, 'stats', device_type)
+    if cached is not None:
+        return cached
+    try:
+        etag, body, updated_at = await run_stats_job(('stats', device_type), render_stats_page, request, device_type)
+    except StatsBusyError:
+        raise HTTPException(status_code=503, detail="Статистика пересчитывается, попробуйте позже")
+    return page_response(request, etag, body, updated_at)
+
+# Сколько секунд браузер может не перепроверять график (дальше — условный запрос с ETag)
+CHART_CACHE_MAX_AGE = 60
+
+def render_chart(name: str, device_type: str):
+    statistics, stats_version = get_survey_statistics_versioned()
+    return generate_chart_json_cached(name, statistics, device_type, stats_version)
+
+@app.get("/stats/charts/{name}")
+async def stats_chart(name: str, request: Request, device: str = None):
+    """Один график в формате bokeh.embed.json_item (страница статистики загружает их лениво)"""
+    if name not in CHARTS:
+        raise HTTPException(status_code=404, detail="График не найден")
+    if device not in CHART_SIZES:
+        device = detect_device_type(request.headers.get("user-agent", ""))
+    try:
+        chart = await run_stats_job(('chart', name, device), render_chart, name, device)
+    except StatsBusyError:
+        raise HTTPException(status_code=503, detail="Статистика пересчитывается, попробуйте позже")
+    if not chart:
+        raise HTTPException(status_code=404, detail="Нет данных для графика")
+    body, etag = chart
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={CHART_CACHE_MAX_AGE}",
+        "Vary": "User-Agent"
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def render_comments_page(request: Request):
+    first_page, total_count, version, updated_at = get_comments_page_data()
+    etag = page_etag('comments', version)
+    cached = _rendered_pages.peek(etag)
+    if cached is not None:
+        return etag, *cached
+    # Рендерим только первую страницу, остальные браузер подгружает через /api/comments
     t0 = time.time()
     resp = templates.TemplateResponse("comments.html", {
         "request": request,
-        "comments": all_comments,
-        "total_count": len(all_comments)
+        "comments": first_page['comments'],
+        "next_cursor": first_page['next_cursor'],
+        "total_count": total_count
     })
     t1 = time.time()
     print(f"[PROFILE] Jinja2 comments.html render: {t1-t0:.3f}s")
-    return resp
+    _rendered_pages.put(etag, (resp.body, updated_at))
+    return etag, resp.body, updated_at
+
+@app.get("/comments", response_class=HTMLResponse)
+async def comments_page(request: Request):
+    """Страница всех комментариев жителей"""
+    cached = await cached_page_response(request, 'comments')
+    if cached is not None:
+        return cached
+    try:
+        etag, body, updated_at = await run_stats_job(('comments',), render_comments_page, request)
+    except StatsBusyError:
+        raise HTTPException(status_code=503, detail="Комментарии загружаются, попробуйте позже")
+    return page_response(request, etag, body, updated_at)
+
+@app.get("/api/comments")
+def comments_api(after: str = None, limit: int = COMMENTS_PAGE_SIZE):
+    """
+    Следующая страница комментариев (keyset-пагинация по лайкам, дате и id).
+    after — курсор next_cursor из предыдущего ответа.
+    """
+    try:
+        page = get_comments_page(after, limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
+    return {
+        'comments': [
+            {key: comment[key] for key in ('answer_id', 'text', 'likes_count', 'created_at')}
+            for comment in page['comments']
+        ],
+        'next_cursor': page['next_cursor']
+    }
 
 @app.get("/consent", response_class=HTMLResponse)
 def consent(request: Request):
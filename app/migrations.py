@@ -0,0 +1,170 @@
+"""
+Версионные миграции схемы БД, которые применяются при старте приложения.
+
+init_db.py создаёт только недостающие таблицы (create_all), поэтому существующая
+БД никогда не получала новые индексы. Здесь каждая миграция — функция с номером;
+номер записывается в таблицу schema_migrations сразу после успешного выполнения
+миграции. Миграция выполняется в одной транзакции вместе с записью номера: функции,
+которые она вызывает (rebuild_counters, reconcile_likes, build_identities), сами не делают commit.
+Миграции идемпотентны (CREATE INDEX IF NOT EXISTS и т.п.), поэтому на новой БД,
+где create_all уже создал таблицы и индексы, они просто отмечаются применёнными.
+
+Проверка, что горячие запросы идут по индексам: python check_indexes.py
+"""
+import time
+from typing import Callable, List, Tuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import Session
+
+from app import models
+
+# Сколько строк индекса ANALYZE просматривает после миграций (0 — все)
+ANALYSIS_LIMIT = 1000
+
+def _columns(db: Session, table: str) -> set:
+    return {column['name'] for column in inspect(db.connection()).get_columns(table)}
+
+def _drop_duplicate_answers(db: Session):
+    """
+    Оставляет по одному ответу на вопрос в каждой анкете — тот, который обновляет
+    crud.upsert_answers (с наименьшим id), — и создаёт уникальный индекс (response_id, question_id).
+    """
+    duplicates = db.execute(text("""
+        SELECT a.id FROM answers a
+        WHERE EXISTS (
+            SELECT 1 FROM answers b
+            WHERE b.response_id = a.response_id AND b.question_id = a.question_id AND b.id < a.id
+        )
+    """)).scalars().all()
+    if duplicates:
+        print(f"[MIGRATIONS] Удаляем повторяющиеся ответы: {len(duplicates)}")
+        for start in range(0, len(duplicates), 500):
+            batch = duplicates[start:start + 500]
+            db.query(models.CommentLike).filter(models.CommentLike.answer_id.in_(batch)).delete(synchronize_session=False)
+            db.query(models.Answer).filter(models.Answer.id.in_(batch)).delete(synchronize_session=False)
+        # Производные данные пересчитываем по оставшимся ответам. В старой БД их таблиц
+        # может ещё не быть — тогда их создадут и заполнят миграции 5–7
+        from app.identities import build_identities
+        from app.likes import reconcile_likes
+        from app.stats_counters import rebuild_counters
+        existing = set(inspect(db.connection()).get_table_names())
+        if models.StatResponseCounter.__tablename__ in existing:
+            rebuild_counters(db)
+        if 'likes_count' in _columns(db, 'answers'):
+            reconcile_likes(db)
+        if models.RespondentIdentity.__tablename__ in existing:
+            build_identities(db)
+    db.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_answers_response_question ON answers (response_id, question_id)"
+    ))
+
+def _add_hot_query_indexes(db: Session):
+    """Индексы для частых запросов crud.py и stats.py"""
+    db.execute(text("CREATE INDEX IF NOT EXISTS ix_answers_question_value ON answers (question_id, value)"))
+    db.execute(text("CREATE INDEX IF NOT EXISTS ix_responses_status ON responses (status)"))
+    db.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_verification_codes_lookup ON verification_codes (email, session_id, created_at)"
+    ))
+    # comment_likes(answer_id) отдельно не нужен: его покрывает уникальный индекс (answer_id, ip_address)
+
+def _add_comment_moderation_queue(db: Session):
+    """Очередь фоновой модерации комментариев (см. app/moderation_queue.py)"""
+    models.CommentModerationTask.__table__.create(db.connection(), checkfirst=True)
+
+def _add_moderation_verdicts(db: Session):
+    """Постоянный кэш вердиктов модерации (см. app/moderation_cache.py)"""
+    models.ModerationVerdict.__table__.create(db.connection(), checkfirst=True)
+
+def _add_stat_counters(db: Session):
+    """Таблицы счётчиков статистики (см. app/stats_counters.py), заполненные по сырым данным"""
+    from app.stats_counters import rebuild_counters
+    for model in (models.StatAnswerCounter, models.StatQuestionCounter, models.StatResponseCounter):
+        model.__table__.create(db.connection(), checkfirst=True)
+    if db.query(models.StatResponseCounter).first() is None:
+        rebuild_counters(db)
+
+def _add_answers_likes_count(db: Session):
+    """Колонка answers.likes_count (см. app/likes.py), её индекс и счётчики по comment_likes"""
+    from app.likes import reconcile_likes
+    if 'likes_count' not in _columns(db, 'answers'):
+        db.execute(text("ALTER TABLE answers ADD COLUMN likes_count INTEGER NOT NULL DEFAULT 0"))
+        reconcile_likes(db)
+    db.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_answers_top_comments ON answers (question_id, likes_count, response_id, id)"
+    ))
+
+def _add_respondent_identities(db: Session):
+    """Контактные данные анкет в каноническом виде (см. app/identities.py)"""
+    from app.identities import build_identities
+    if models.RespondentIdentity.__tablename__ not in inspect(db.connection()).get_table_names():
+        models.RespondentIdentity.__table__.create(db.connection())
+        build_identities(db)
+
+def _add_moderation_queue_claims(db: Session):
+    """Захват задач очереди модерации, отложенные повторы и состояние failed (см. app/moderation_queue.py)"""
+    columns = _columns(db, 'comment_moderation_queue')
+    if 'next_attempt_at' not in columns:
+        db.execute(text("ALTER TABLE comment_moderation_queue ADD COLUMN next_attempt_at FLOAT NOT NULL DEFAULT 0"))
+    if 'claimed_until' not in columns:
+        db.execute(text("ALTER TABLE comment_moderation_queue ADD COLUMN claimed_until FLOAT"))
+    if 'failed' not in columns:
+        db.execute(text("ALTER TABLE comment_moderation_queue ADD COLUMN failed BOOLEAN NOT NULL DEFAULT 0"))
+    db.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_moderation_queue_next_attempt ON comment_moderation_queue (failed, next_attempt_at)"
+    ))
+
+# Номер, название, функция. Номера только растут; уже выпущенные миграции не меняются.
+MIGRATIONS: List[Tuple[int, str, Callable[[Session], None]]] = [
+    (1, 'answers_unique_response_question', _drop_duplicate_answers),
+    (2, 'hot_query_indexes', _add_hot_query_indexes),
+    (3, 'comment_moderation_queue', _add_comment_moderation_queue),
+    (4, 'moderation_verdicts', _add_moderation_verdicts),
+    (5, 'stat_counters', _add_stat_counters),
+    (6, 'answers_likes_count', _add_answers_likes_count),
+    (7, 'respondent_identities', _add_respondent_identities),
+    (8, 'moderation_queue_claims', _add_moderation_queue_claims),
+]
+
+def get_applied_migrations(db: Session) -> set:
+    return {version for version, in db.query(models.SchemaMigration.version).all()}
+
+def apply_migrations(engine, session_factory) -> List[int]:
+    """
+    Применяет все ещё не применённые миграции по порядку, каждую в своей транзакции.
+    Возвращает номера применённых миграций.
+    """
+    existing = set(inspect(engine).get_table_names())
+    if models.SchemaMigration.__tablename__ not in existing:
+        models.Base.metadata.create_all(engine, tables=[models.SchemaMigration.__table__])
+    if 'answers' not in existing:
+        # Пустая БД: таблиц ещё нет, миграции применятся после init_db.py
+        return []
+    applied = []
+    db = session_factory()
+    try:
+        done = get_applied_migrations(db)
+        for version, name, migrate in MIGRATIONS:
+            if version in done:
+                continue
+            t0 = time.time()
+            try:
+                migrate(db)
+                db.add(models.SchemaMigration(version=version, name=name))
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            applied.append(version)
+            print(f"[MIGRATIONS] {version} {name}: {time.time() - t0:.3f}s")
+        if applied:
+            # Обновляем статистику планировщика под новые индексы — по всем таблицам сразу.
+            # PRAGMA optimize анализирует только таблицы, к которым обращалось это соединение:
+            # без статистики responses планировщик читал топ комментариев через ix_responses_status
+            # и сортировал все строки. analysis_limit ограничивает ANALYZE на больших таблицах
+            db.execute(text(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}"))
+            db.execute(text("ANALYZE"))
+            db.commit()
+    finally:
+        db.close()
+    return applied
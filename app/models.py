@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Boolean, UniqueConstraint
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Boolean, Float, UniqueConstraint, Index
 from sqlalchemy.orm import declarative_base, relationship
 from sqlalchemy.sql import func
 from datetime import datetime
@@ -37,6 +37,8 @@ class Response(Base):
     # Связь: один ответ (response) содержит много отдельных ответов на вопросы (answers)
     answers = relationship("Answer", back_populates="response")
 
+    __table_args__ = (Index('ix_responses_status', 'status'),)
+
     def __repr__(self):
         return f"<Response id={self.id} session_id={self.session_id} status={self.status} created_at={self.created_at}>"
 
@@ -51,6 +53,7 @@ class Answer(Base):
     question_id = Column(Integer, ForeignKey("questions.id"), nullable=False)  # Связь с вопросом
     value = Column(Text, nullable=False)  # Значение ответа (текст или выбранный вариант)
     moderated = Column(Boolean, default=True, nullable=False)  # Прошёл ли ответ модерацию (False для мата/спама)
+    likes_count = Column(Integer, default=0, server_default='0', nullable=False)  # Число лайков (денормализовано из comment_likes, см. app/likes.py)
 
     # Связи
     response = relationship("Response", back_populates="answers")
@@ -59,6 +62,15 @@ class Answer(Base):
     # Связь с лайками для этого ответа (если это комментарий)
     likes = relationship("CommentLike", back_populates="answer")
 
+    __table_args__ = (
+        # Один ответ на вопрос в анкете; по этому же индексу ищутся все ответы анкеты
+        Index('uq_answers_response_question', 'response_id', 'question_id', unique=True),
+        # Подсчёт значений ответов по вопросу
+        Index('ix_answers_question_value', 'question_id', 'value'),
+        # Топ комментариев по лайкам, затем по дате анкеты (id анкеты растёт вместе с датой)
+        Index('ix_answers_top_comments', 'question_id', 'likes_count', 'response_id', 'id'),
+    )
+
     def __repr__(self):
         return f"<Answer id={self.id} response_id={self.response_id} question_id={self.question_id} value='{self.value[:50]}...' moderated={self.moderated}>"
 
@@ -77,6 +89,9 @@ class VerificationCode(Base):
     used = Column(Boolean, default=False)  # использован ли код
     last_request_at = Column(DateTime, default=datetime.utcnow)  # когда последний раз запрашивали код
 
+    # Последний код для email и анкеты
+    __table_args__ = (Index('ix_verification_codes_lookup', 'email', 'session_id', 'created_at'),)
+
 class CommentLike(Base):
     """
     Таблица лайков для комментариев.
@@ -96,3 +111,133 @@ class CommentLike(Base):
 
     def __repr__(self):
         return f"<CommentLike id={self.id} answer_id={self.answer_id} ip={self.ip_address}>"
+
+class StatAnswerCounter(Base):
+    """
+    Счётчики значений ответов для страницы статистики.
+    Обновляются инкрементально при каждой записи анкеты (см. app/stats_counters.py).
+    Для checkbox-вопросов value — отдельный выбранный вариант, для остальных — значение целиком.
+    """
+    __tablename__ = "stat_answer_counters"
+    question_id = Column(Integer, primary_key=True)
+    value = Column(Text, primary_key=True)
+    status = Column(String, primary_key=True)  # Статус анкеты: draft/consent/complete
+    has_kadastr = Column(Boolean, primary_key=True)  # Указан ли в анкете кадастровый номер
+    count = Column(Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return f"<StatAnswerCounter q={self.question_id} value='{self.value[:30]}' status={self.status} kadastr={self.has_kadastr} count={self.count}>"
+
+class StatQuestionCounter(Base):
+    """
+    Количество ответов на каждый вопрос (нужно для поля total у checkbox-вопросов).
+    """
+    __tablename__ = "stat_question_counters"
+    question_id = Column(Integer, primary_key=True)
+    status = Column(String, primary_key=True)
+    has_kadastr = Column(Boolean, primary_key=True)
+    count = Column(Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return f"<StatQuestionCounter q={self.question_id} status={self.status} kadastr={self.has_kadastr} count={self.count}>"
+
+class StatResponseCounter(Base):
+    """
+    Количество анкет по признакам: статус, кадастровый номер, ответы на базовые вопросы и на вторую часть.
+    Учитываются только анкеты, в которых есть хотя бы один ответ.
+    """
+    __tablename__ = "stat_response_counters"
+    status = Column(String, primary_key=True)
+    has_kadastr = Column(Boolean, primary_key=True)
+    has_basic = Column(Boolean, primary_key=True)  # Есть ответ на вопросы 4/5
+    has_second = Column(Boolean, primary_key=True)  # Есть непустые ответы второй части
+    count = Column(Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return f"<StatResponseCounter status={self.status} kadastr={self.has_kadastr} basic={self.has_basic} second={self.has_second} count={self.count}>"
+
+class DataVersion(Base):
+    """
+    Общий для всех процессов номер версии данных (см. app/data_version.py).
+    Увеличивается в той же транзакции, что и запись анкеты или лайка;
+    по нему воркеры понимают, что их кэши статистики и комментариев устарели.
+    """
+    __tablename__ = "data_versions"
+    scope = Column(String, primary_key=True)  # Область данных: survey (анкеты) или comments (комментарии и лайки)
+    version = Column(Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return f"<DataVersion scope={self.scope} version={self.version}>"
+
+class RespondentIdentity(Base):
+    """
+    Нормализованные контактные данные анкеты (email, телефон, кадастровый номер).
+    Заполняется при каждой записи анкеты (см. app/identities.py), чтобы проверки
+    уникальности и поиск незавершённой анкеты шли по индексу, а не по answers.value.
+    """
+    __tablename__ = "respondent_identities"
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)  # Вид данных: email / phone / kadastr
+    normalized_value = Column(String, nullable=False)  # Значение в каноническом виде
+    response_id = Column(Integer, ForeignKey("responses.id"), nullable=False)
+    status = Column(String, nullable=False)  # Статус анкеты (копия responses.status)
+
+    __table_args__ = (
+        # В анкете не больше одного значения каждого вида
+        UniqueConstraint('response_id', 'kind', name='uq_respondent_identities_response_kind'),
+        # Поиск по всем видам данных сразу; статус и анкета читаются прямо из индекса
+        Index('ix_respondent_identities_lookup', 'kind', 'normalized_value', 'status', 'response_id'),
+    )
+
+    def __repr__(self):
+        return f"<RespondentIdentity {self.kind}={self.normalized_value} response_id={self.response_id} status={self.status}>"
+
+class SchemaMigration(Base):
+    """
+    Применённые миграции схемы БД (см. app/migrations.py).
+    """
+    __tablename__ = "schema_migrations"
+    version = Column(Integer, primary_key=True)  # Номер миграции
+    name = Column(String, nullable=False)
+    applied_at = Column(DateTime, server_default=func.now())
+
+    def __repr__(self):
+        return f"<SchemaMigration version={self.version} name={self.name}>"
+
+class CommentModerationTask(Base):
+    """
+    Комментарий, который ждёт модерации (см. app/moderation_queue.py).
+    Пока строка есть в очереди, у ответа moderated = False и он не показывается.
+    """
+    __tablename__ = "comment_moderation_queue"
+    answer_id = Column(Integer, ForeignKey("answers.id"), primary_key=True)
+    revision = Column(Integer, default=1, nullable=False)  # Растёт при каждой новой отправке текста
+    attempts = Column(Integer, default=0, nullable=False)  # Неудачные попытки модерации
+    enqueued_at = Column(DateTime, server_default=func.now())
+    # Время в секундах Unix: когда задачу можно проверять и до какого момента её держит воркер
+    next_attempt_at = Column(Float, default=0, server_default='0', nullable=False)
+    claimed_until = Column(Float, nullable=True)
+    failed = Column(Boolean, default=False, server_default='0', nullable=False)  # Попытки исчерпаны, повторов не будет
+
+    __table_args__ = (
+        # Выбор задач диспетчером: ещё не failed, по времени следующей попытки
+        Index('ix_moderation_queue_next_attempt', 'failed', 'next_attempt_at'),
+    )
+
+    def __repr__(self):
+        return (f"<CommentModerationTask answer_id={self.answer_id} revision={self.revision} "
+                f"attempts={self.attempts} failed={self.failed}>")
+
+class ModerationVerdict(Base):
+    """
+    Вердикты AI-модерации по хэшу нормализованного текста комментария (см. app/moderation_cache.py).
+    Повторно отправленный или скопированный текст проверяется без запроса к DeepSeek.
+    """
+    __tablename__ = "moderation_verdicts"
+    text_hash = Column(String(64), primary_key=True)  # sha256 версии фильтра и нормализованного текста
+    approved = Column(Boolean, nullable=False)
+    reason = Column(Text, nullable=False)
+    created_at = Column(DateTime, server_default=func.now())
+
+    def __repr__(self):
+        return f"<ModerationVerdict {self.text_hash[:12]} approved={self.approved} reason={self.reason}>"
@@ -0,0 +1,103 @@
+"""
+Кэш вердиктов AI-модерации по содержимому комментария.
+
+Ключ — sha256 от версии фильтра (модель и промпт) и нормализованного текста
+(Unicode NFKC, без учёта регистра и лишних пробелов). Поэтому повторная отправка
+шага /survey/details и одинаковые комментарии соседей проверяются без запроса
+к DeepSeek, а после изменения промпта старые вердикты просто перестают совпадать.
+
+Два уровня: LRUCache в памяти процесса (MODERATION_CACHE_SIZE записей) и таблица
+moderation_verdicts, общая для всех воркеров и переживающая перезапуск.
+Ошибки таблицы не мешают модерации: запрос считается промахом.
+"""
+import hashlib
+import os
+import threading
+import unicodedata
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import text
+
+from app.stats_cache import LRUCache
+
+# Сколько вердиктов хранить в памяти процесса
+MODERATION_CACHE_SIZE = int(os.getenv("MODERATION_CACHE_SIZE", "10000"))
+
+Verdict = Tuple[bool, str]
+
+def normalize_comment(comment: str) -> str:
+    """Текст, по которому сравниваются комментарии: NFKC, без регистра, пробелы схлопнуты"""
+    return ' '.join(unicodedata.normalize('NFKC', comment).casefold().split())
+
+def verdict_key(comment: str, filter_version: str) -> str:
+    return hashlib.sha256(f"{filter_version}\n{normalize_comment(comment)}".encode('utf-8')).hexdigest()
+
+class ModerationVerdictCache:
+    """LRU в памяти поверх таблицы moderation_verdicts, со счётчиками попаданий"""
+
+    def __init__(self, session_factory, read_session_factory, maxsize: int = MODERATION_CACHE_SIZE):
+        self._session_factory = session_factory
+        self._read_session_factory = read_session_factory
+        self._memory = LRUCache('moderation_verdicts', maxsize)
+        self._lock = threading.Lock()
+        self.db_hits = 0  # Не было в памяти, нашлось в таблице
+        self.misses = 0  # Нужен запрос к модели
+
+    def get(self, key: str) -> Optional[Verdict]:
+        verdict = self._memory.get(key)
+        if verdict is not None:
+            return verdict
+        verdict = self._load(key)
+        with self._lock:
+            if verdict is None:
+                self.misses += 1
+            else:
+                self.db_hits += 1
+        if verdict is not None:
+            self._memory.put(key, verdict)
+        return verdict
+
+    def put(self, key: str, verdict: Verdict):
+        self._memory.put(key, verdict)
+        db = self._session_factory()
+        try:
+            db.execute(
+                text("INSERT OR REPLACE INTO moderation_verdicts (text_hash, approved, reason) VALUES (:key, :approved, :reason)"),
+                {'key': key, 'approved': bool(verdict[0]), 'reason': verdict[1]}
+            )
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"[CACHE] moderation_verdicts: ошибка записи: {e}")
+        finally:
+            db.close()
+
+    def _load(self, key: str) -> Optional[Verdict]:
+        db = self._read_session_factory()
+        try:
+            row = db.execute(
+                text("SELECT approved, reason FROM moderation_verdicts WHERE text_hash = :key"), {'key': key}
+            ).first()
+        except Exception as e:
+            print(f"[CACHE] moderation_verdicts: ошибка чтения: {e}")
+            return None
+        finally:
+            db.close()
+        return (bool(row[0]), row[1]) if row else None
+
+    def stats(self) -> Dict:
+        """Попадания в память и в таблицу, промахи и доля запросов без обращения к модели"""
+        memory = self._memory.stats()
+        with self._lock:
+            db_hits, misses = self.db_hits, self.misses
+        hits = memory['hits'] + db_hits
+        total = hits + misses
+        return {
+            'name': memory['name'],
+            'size': memory['size'],
+            'maxsize': memory['maxsize'],
+            'memory_hits': memory['hits'],
+            'db_hits': db_hits,
+            'misses': misses,
+            'hit_rate': hits / total if total else 0.0,
+        }
@@ -0,0 +1,281 @@
+"""
+Фоновая модерация комментариев.
+
+Раньше /survey/details вызывал validate_comment() прямо в запросе: ответы
+сохранялись только после ответа DeepSeek (до 10 секунд таймаута). Теперь шаг
+сохраняется сразу, а комментарий получает состояние «ждёт модерации»: moderated = False
+(на страницах он не показывается) и строка в таблице comment_moderation_queue —
+в той же транзакции, что и сами ответы (enqueue_moderation).
+
+ModerationQueue — поток-диспетчер и пул из MODERATION_WORKERS потоков. Диспетчер
+берёт задачи из таблицы (после notify() или раз в MODERATION_POLL_INTERVAL секунд),
+потоки пула проверяют текст и записывают вердикт в answers.moderated. Версия данных
+увеличивается только для комментариев (SCOPE_COMMENTS), кэш статистики анкет не сбрасывается.
+
+Очередь хранится в БД, поэтому задачи, не завершённые до остановки приложения,
+продолжаются при следующем старте. Если комментарий отправили заново, пока шла проверка,
+revision задачи меняется, и вердикт по старому тексту не записывается.
+
+Очередь общая для всех воркеров uvicorn: диспетчер не просто читает задачи, а захватывает
+их одним UPDATE ... RETURNING (claimed_until — до какого момента задача занята). Задачу,
+которую уже взял другой процесс, никто не возьмёт, пока не истечёт MODERATION_CLAIM_SECONDS
+(например, если процесс упал посреди проверки). После ошибки проверки задача откладывается
+(next_attempt_at) с удвоением задержки от MODERATION_RETRY_DELAY до MODERATION_RETRY_MAX_DELAY,
+поэтому не мешает новым комментариям; после MODERATION_MAX_ATTEMPTS неудач она помечается
+failed = 1 и больше не повторяется: комментарий остаётся скрытым, пока его не отправят заново
+или не запустят remoderate_comments.py (он записывает вердикт и удаляет задачу).
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm import Session
+
+from app.data_version import SCOPE_COMMENTS, bump_data_version
+
+# Сколько комментариев модерируется одновременно и как часто (в секундах) очередь перечитывается без notify()
+MODERATION_WORKERS = int(os.getenv("MODERATION_WORKERS", "2"))
+MODERATION_POLL_INTERVAL = float(os.getenv("MODERATION_POLL_INTERVAL", "5"))
+# На сколько секунд воркер захватывает задачу (больше, чем длится одна проверка с записью вердикта)
+MODERATION_CLAIM_SECONDS = float(os.getenv("MODERATION_CLAIM_SECONDS", "60"))
+# Повторы после ошибки: первая задержка, её предел и число попыток до состояния failed
+MODERATION_RETRY_DELAY = float(os.getenv("MODERATION_RETRY_DELAY", "5"))
+MODERATION_RETRY_MAX_DELAY = float(os.getenv("MODERATION_RETRY_MAX_DELAY", "600"))
+MODERATION_MAX_ATTEMPTS = int(os.getenv("MODERATION_MAX_ATTEMPTS", "8"))
+
+# Новая отправка текста начинает задачу заново: попытки, захват и состояние failed сбрасываются
+_ENQUEUE_SQL = text("""
+INSERT INTO comment_moderation_queue (answer_id, revision, attempts, enqueued_at, next_attempt_at, claimed_until, failed)
+SELECT id, 1, 0, CURRENT_TIMESTAMP, :now, NULL, 0 FROM answers WHERE response_id = :response_id AND question_id = :question_id
+ON CONFLICT (answer_id) DO UPDATE SET revision = revision + 1, attempts = 0, enqueued_at = excluded.enqueued_at,
+    next_attempt_at = excluded.next_attempt_at, claimed_until = NULL, failed = 0
+""")
+
+# Захват задач, которые пора проверять и которые никто не держит. Условие повторено во внешнем
+# WHERE: строка, которую успел захватить другой процесс, не будет захвачена второй раз
+_CLAIM_SQL = text("""
+UPDATE comment_moderation_queue SET claimed_until = :claimed_until
+WHERE answer_id IN (
+    SELECT answer_id FROM comment_moderation_queue
+    WHERE failed = 0 AND next_attempt_at <= :now AND (claimed_until IS NULL OR claimed_until < :now)
+    ORDER BY next_attempt_at, answer_id LIMIT :limit
+) AND failed = 0 AND (claimed_until IS NULL OR claimed_until < :now)
+RETURNING answer_id, revision
+""")
+_CLAIMED_VALUES_SQL = text("SELECT id, value FROM answers WHERE id IN :ids").bindparams(bindparam('ids', expanding=True))
+
+def enqueue_moderation(db: Session, response_id: int, question_ids: Iterable[int]):
+    """Ставит ответы анкеты в очередь модерации в текущей транзакции (фиксируется вместе с ответами)"""
+    now = time.time()
+    params = [{'response_id': response_id, 'question_id': qid, 'now': now} for qid in question_ids]
+    if params:
+        db.execute(_ENQUEUE_SQL, params)
+
+def pending_moderation_count(db: Session) -> int:
+    """Сколько комментариев ещё ждёт модерации (без задач в состоянии failed)"""
+    return db.execute(text("SELECT COUNT(*) FROM comment_moderation_queue WHERE failed = 0")).scalar()
+
+def retry_delay(attempts: int) -> float:
+    """Задержка перед следующей попыткой после attempts неудач подряд"""
+    return min(MODERATION_RETRY_DELAY * 2 ** (attempts - 1), MODERATION_RETRY_MAX_DELAY)
+
+class ModerationQueue:
+    """Пул потоков, который модерирует комментарии из comment_moderation_queue"""
+
+    def __init__(self, session_factory, moderate: Callable[[str], Tuple[bool, str]],
+                 workers: int = MODERATION_WORKERS, poll_interval: float = MODERATION_POLL_INTERVAL,
+                 on_moderated=None, claim_seconds: float = MODERATION_CLAIM_SECONDS,
+                 max_attempts: int = MODERATION_MAX_ATTEMPTS):
+        self._session_factory = session_factory  # Захват задач и вердикты пишутся через пишущий движок
+        self._moderate = moderate
+        self._workers = workers
+        self._poll_interval = poll_interval
+        self._on_moderated = on_moderated  # Вызывается после записи вердикта (например, сброс кэша)
+        self._claim_seconds = claim_seconds
+        self._max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._in_flight: Dict[int, float] = {}  # answer_id -> claimed_until задач, которые сейчас проверяются
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def start(self):
+        """Запускает диспетчер; задачи, оставшиеся с прошлого запуска, берутся сразу"""
+        with self._lock:
+            if self._thread is not None or self._stopped:
+                return
+            self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="moderation")
+            self._thread = threading.Thread(target=self._run, name="moderation-queue", daemon=True)
+            self._thread.start()
+        self._wakeup.set()
+
+    def notify(self):
+        """В очереди появились новые комментарии"""
+        self._wakeup.set()
+
+    def stop(self):
+        """
+        Останавливает диспетчер. Проверки, которые ещё идут, не ждём: их задачи остаются
+        в таблице, захват снимается, и их сразу может взять другой воркер или следующий запуск.
+        """
+        with self._lock:
+            self._stopped = True
+            thread, executor = self._thread, self._executor
+        self._wakeup.set()
+        if thread is not None:
+            thread.join()
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            claims = dict(self._in_flight)
+        if claims:
+            try:
+                self._release(claims)
+            except Exception as e:
+                print(f"[MODERATION] Ошибка снятия захвата задач: {e}")
+
+    def dispatch(self) -> int:
+        """Захватывает задачи из очереди, пока в пуле есть место, и отдаёт их пулу. Возвращает число задач."""
+        with self._lock:
+            free = self._workers * 2 - len(self._in_flight)  # Небольшой запас, чтобы потоки пула не простаивали
+        if free <= 0:
+            return 0
+        tasks, claimed_until = self._claim(free)
+        submitted = 0
+        for answer_id, revision, value in tasks:
+            with self._lock:
+                if self._stopped:
+                    break
+                self._in_flight[answer_id] = claimed_until
+            self._executor.submit(self._process, answer_id, revision, value, claimed_until)
+            submitted += 1
+        if submitted < len(tasks):
+            # Остановка посреди раздачи: не начатые задачи сразу возвращаются в очередь
+            self._release({answer_id: claimed_until for answer_id, _, _ in tasks[submitted:]})
+        return submitted
+
+    def _claim(self, limit: int):
+        """
+        Атомарно захватывает до limit задач, которые пора проверять и которые никто не держит.
+        Возвращает ([(answer_id, revision, текст)], claimed_until); claimed_until — метка захвата.
+        """
+        now = time.time()
+        claimed_until = now + self._claim_seconds
+        db = self._session_factory()
+        try:
+            claimed = db.execute(_CLAIM_SQL, {'now': now, 'claimed_until': claimed_until, 'limit': limit}).all()
+            values = {}
+            if claimed:
+                values = dict(db.execute(_CLAIMED_VALUES_SQL, {'ids': [answer_id for answer_id, _ in claimed]}).all())
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        return [(answer_id, revision, values.get(answer_id, '')) for answer_id, revision in claimed], claimed_until
+
+    def _release(self, claims: Dict[int, float]):
+        """Снимает захват с задач, если его не перехватили (claims: answer_id -> claimed_until)"""
+        db = self._session_factory()
+        try:
+            db.execute(text(
+                "UPDATE comment_moderation_queue SET claimed_until = NULL "
+                "WHERE answer_id = :answer_id AND claimed_until = :claimed_until"
+            ), [{'answer_id': answer_id, 'claimed_until': until} for answer_id, until in claims.items()])
+            db.commit()
+        finally:
+            db.close()
+
+    def _process(self, answer_id: int, revision: int, value: str, claimed_until: float):
+        retry_later = False
+        try:
+            t0 = time.time()
+            try:
+                approved, reason = self._moderate(value)
+            except Exception as e:
+                print(f"[MODERATION] Ошибка проверки комментария {answer_id}: {e}")
+                retry_later = True
+                self._record_failure(answer_id, revision, claimed_until)
+                return
+            if self._save_verdict(answer_id, revision, approved):
+                if not approved:
+                    print(f"⚠️  Комментарий НЕ прошёл модерацию: {reason}")
+                    print(f"   Текст: {value[:100]}...")
+                print(f"[PROFILE] Moderation {answer_id}: {time.time()-t0:.3f}s")
+                if self._on_moderated:
+                    self._on_moderated()
+        except Exception as e:
+            print(f"[MODERATION] Ошибка записи вердикта {answer_id}: {e}")
+            retry_later = True
+        finally:
+            with self._lock:
+                self._in_flight.pop(answer_id, None)
+            # Освободилось место в пуле (или текст успели изменить) — берём следующие задачи.
+            # После ошибки ждём обычного прохода диспетчера, чтобы не повторять её в цикле.
+            if not retry_later:
+                self._wakeup.set()
+
+    def _save_verdict(self, answer_id: int, revision: int, approved: bool) -> bool:
+        """Записывает вердикт, если за время проверки комментарий не отправили заново"""
+        params = {'answer_id': answer_id, 'revision': revision}
+        db = self._session_factory()
+        try:
+            done = db.execute(text(
+                "DELETE FROM comment_moderation_queue WHERE answer_id = :answer_id AND revision = :revision"
+            ), params).rowcount
+            if done:
+                db.execute(text("UPDATE answers SET moderated = :approved WHERE id = :answer_id"),
+                           {'answer_id': answer_id, 'approved': bool(approved)})
+                bump_data_version(db, SCOPE_COMMENTS)
+            db.commit()
+            return bool(done)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _record_failure(self, answer_id: int, revision: int, claimed_until: float):
+        """
+        Задача остаётся в очереди и откладывается на retry_delay(attempts) секунд;
+        после max_attempts неудач она переходит в состояние failed и больше не повторяется.
+        Если задачу за это время отправили заново или перехватили, ничего не меняется.
+        """
+        db = self._session_factory()
+        try:
+            attempts = db.execute(text(
+                "SELECT attempts FROM comment_moderation_queue "
+                "WHERE answer_id = :answer_id AND revision = :revision AND claimed_until = :claimed_until"
+            ), {'answer_id': answer_id, 'revision': revision, 'claimed_until': claimed_until}).scalar()
+            if attempts is None:
+                return
+            attempts += 1
+            failed = attempts >= self._max_attempts
+            db.execute(text(
+                "UPDATE comment_moderation_queue SET attempts = :attempts, next_attempt_at = :next_attempt_at, "
+                "claimed_until = NULL, failed = :failed WHERE answer_id = :answer_id"
+            ), {'answer_id': answer_id, 'attempts': attempts, 'failed': failed,
+                'next_attempt_at': time.time() + retry_delay(attempts)})
+            db.commit()
+        finally:
+            db.close()
+        if failed:
+            print(f"[MODERATION] Комментарий {answer_id}: {attempts} неудачных попыток, модерация остановлена (failed), "
+                  "вердикт запишет python remoderate_comments.py")
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self._poll_interval)
+            self._wakeup.clear()
+            with self._lock:
+                if self._stopped:
+                    return
+            try:
+                self.dispatch()
+            except Exception as e:
+                print(f"[MODERATION] Ошибка чтения очереди: {e}")
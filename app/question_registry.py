@@ -0,0 +1,118 @@
+"""
+Реестр вопросов анкеты: смысловая роль вопроса (email, телефон, кадастровый номер,
+комментарий, часть анкеты) -> question_id.
+
+Раньше id вопросов искались по тексту отдельным запросом на каждое поле
+(get_question_id_by_text), были зашиты в код статистики ([4, 5], 2, 6..17, 16),
+а вопрос с комментариями искался через LIKE при каждом чтении комментариев.
+Теперь таблица questions читается один раз, а реестр перечитывается только
+после изменения вопросов: add_all_questions() увеличивает версию данных
+SCOPE_QUESTIONS (см. app/data_version.py).
+"""
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import inspect, text
+
+from app.data_version import SCOPE_QUESTIONS, DataVersionReader
+from app.db import read_engine
+
+# Роли вопросов
+ROLE_FIO = 'fio'
+ROLE_KADASTR = 'kadastr'
+ROLE_PHONE = 'phone'
+ROLE_EMAIL = 'email'
+ROLE_COMMENT = 'comment'
+ROLE_SNT_SUPPORT = 'snt_support'
+ROLE_FINANCIAL_READY = 'financial_ready'
+ROLE_CONCERNS = 'concerns'
+ROLE_FEES = 'fees'
+ROLE_PARTICIPATION = 'participation'
+
+# Текст вопроса каждой роли (как в app/api/questions.py)
+ROLE_TEXTS = {
+    ROLE_FIO: 'ФИО',
+    ROLE_KADASTR: 'Кадастровый номер участка',
+    ROLE_PHONE: 'Телефон для связи',
+    ROLE_SNT_SUPPORT: 'Поддерживаете ли вы создание нового СНТ?',
+    ROLE_FINANCIAL_READY: 'Готовы ли вы нести финансовые обязательства в рамках СНТ?',
+    ROLE_CONCERNS: 'Какие у вас основные опасения или вопросы?',
+    ROLE_FEES: 'Какой максимальный ежемесячный взнос вы считаете приемлемым?',
+    ROLE_PARTICIPATION: 'Готовы ли вы лично участвовать в управлении СНТ?',
+    ROLE_COMMENT: 'Ваши предложения и комментарии',
+    ROLE_EMAIL: 'Email',
+}
+# Если текст вопроса с комментариями изменили, ищем его по этим словам
+COMMENT_TEXT_MARKERS = ('комментари', 'предложени')
+
+# Части анкеты: первая (основная) и вторая (детальное мнение) — по порядку вопросов
+PART_BASE = 'base'
+PART_DETAIL = 'detail'
+PART_ORDERS = {
+    PART_BASE: range(1, 6),
+    PART_DETAIL: range(6, 18),
+}
+
+class QuestionSet:
+    """Неизменяемый снимок таблицы questions с ролями и частями анкеты"""
+
+    def __init__(self, rows: List[Tuple[int, str, str, int]], version: int):
+        self.version = version  # Версия SCOPE_QUESTIONS, для которой прочитан снимок
+        self.questions = [(qid, qtext, qtype) for qid, qtext, qtype, _ in rows]  # По порядку вопросов
+        self.qtypes: Dict[int, str] = {qid: qtype for qid, _, qtype, _ in rows}
+        by_text = {}
+        for qid, qtext, _, _ in rows:
+            by_text.setdefault(qtext, qid)
+        self._roles = {role: by_text[qtext] for role, qtext in ROLE_TEXTS.items() if qtext in by_text}
+        if ROLE_COMMENT not in self._roles:
+            for qid, qtext, _, _ in sorted(rows):
+                if any(marker in qtext.lower() for marker in COMMENT_TEXT_MARKERS):
+                    self._roles[ROLE_COMMENT] = qid
+                    break
+        self._parts = {
+            part: tuple(qid for qid, _, _, order in rows if order in orders)
+            for part, orders in PART_ORDERS.items()
+        }
+
+    def qid(self, role: str) -> Optional[int]:
+        """id вопроса с ролью role (None — такого вопроса нет)"""
+        return self._roles.get(role)
+
+    def part(self, part: str) -> Tuple[int, ...]:
+        """id вопросов части анкеты PART_BASE / PART_DETAIL"""
+        return self._parts.get(part, ())
+
+class QuestionRegistry:
+    """Снимок вопросов, который перечитывается из БД только после изменения версии SCOPE_QUESTIONS"""
+
+    def __init__(self, engine):
+        self._engine = engine
+        self._versions = DataVersionReader(engine)
+        self._lock = threading.Lock()
+        self._current: Optional[QuestionSet] = None
+
+    def get(self) -> QuestionSet:
+        """Актуальный снимок вопросов"""
+        version = self._versions.get(SCOPE_QUESTIONS)
+        current = self._current
+        if current is not None and current.version == version:
+            return current
+        with self._lock:
+            if self._current is None or self._current.version != version:
+                self._current = self._load(version)
+            return self._current
+
+    def expire(self):
+        """Следующий get() перечитает версию вопросов из БД (после изменения в этом же процессе)"""
+        self._versions.expire()
+
+    def _load(self, version: int) -> QuestionSet:
+        if 'questions' not in inspect(self._engine).get_table_names():
+            return QuestionSet([], version)
+        with self._engine.connect() as conn:
+            rows = conn.execute(text('SELECT id, text, qtype, "order" FROM questions ORDER BY "order", id')).all()
+        print(f"[CACHE] questions: загружено {len(rows)} вопросов (версия {version})")
+        return QuestionSet([tuple(row) for row in rows], version)
+
+# Читаем через движок только для чтения: реестр запрашивается и внутри пишущих транзакций
+question_registry = QuestionRegistry(read_engine)
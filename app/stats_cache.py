@@ -0,0 +1,171 @@
+"""
+Кэш «stale-while-revalidate» для статистики и комментариев.
+
+Значение в кэше помечено версией данных, для которой оно посчитано (см. app/data_version.py).
+Когда версия данных меняется, кэш продолжает отдавать последнее удачное значение,
+а пересчёт выполняется в фоне ровно одним потоком. Изменения, пришедшие в течение
+окна debounce, объединяются в один пересчёт. Если значения ещё нет (холодный старт),
+первый читатель считает его сам, остальные ждут на блокировке, а не считают параллельно.
+
+LRUCache — ограниченный по размеру кэш с вытеснением давно не использованных записей
+и счётчиками попаданий/промахов (используется для графиков Bokeh).
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class StaleWhileRevalidateCache:
+    def __init__(self, name: str, loader: Callable[[], Any], version_source: Callable[[], int], debounce: float):
+        self.name = name  # Имя кэша для логов
+        self._loader = loader  # Функция, которая считает значение заново
+        self._version_source = version_source  # Функция, возвращающая текущую версию данных
+        self._debounce = debounce  # Окно, в котором изменения объединяются в один пересчёт
+        self._lock = threading.Lock()  # Защищает состояние кэша
+        self._load_lock = threading.Lock()  # Гарантирует, что пересчёт идёт только в одном потоке
+        self._value = None
+        self._version = None  # Версия данных, для которой посчитано значение
+        self._loaded_at = 0.0
+        self._timer: Optional[threading.Timer] = None
+        self._refreshing = False
+
+    def get(self) -> Any:
+        """Возвращает значение из кэша; устаревшее значение отдаётся сразу, а пересчёт запускается в фоне"""
+        return self.snapshot()[0]
+
+    def get_versioned(self) -> Tuple[Any, int]:
+        """
+        Возвращает (значение, версия данных).
+        По версии можно кэшировать всё, что строится из значения.
+        """
+        return self.snapshot()[:2]
+
+    def snapshot(self) -> Tuple[Any, int, float]:
+        """Возвращает (значение, версия данных, время пересчёта) — согласованно, под одной блокировкой"""
+        current = self._version_source()
+        with self._lock:
+            if self._value is not None:
+                if current != self._version:
+                    self._schedule_refresh()
+                return self._value, self._version, self._loaded_at
+        # Холодный старт: считаем сами, но только в одном потоке
+        with self._load_lock:
+            with self._lock:
+                loaded = self._value is not None
+            if not loaded:
+                self._load()
+            with self._lock:
+                return self._value, self._version, self._loaded_at
+
+    def peek_version(self) -> Optional[Tuple[int, float]]:
+        """
+        (версия данных значения, время пересчёта) без пересчёта на месте; None — если значения ещё нет.
+        Если данные изменились, запускает фоновый пересчёт, как и snapshot().
+        """
+        current = self._version_source()
+        with self._lock:
+            if self._value is None:
+                return None
+            if current != self._version:
+                self._schedule_refresh()
+            return self._version, self._loaded_at
+
+    def clear(self):
+        """Полностью очищает кэш (следующий читатель посчитает значение сам)"""
+        with self._lock:
+            self._value = None
+            self._version = None
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def _schedule_refresh(self):
+        """Планирует фоновый пересчёт через окно debounce, если он ещё не запланирован и не идёт (вызывать под self._lock)"""
+        if self._timer is not None or self._refreshing:
+            return
+        self._timer = threading.Timer(self._debounce, self._refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _refresh(self):
+        """Фоновый пересчёт; если за время пересчёта данные снова изменились, планирует ещё один"""
+        with self._lock:
+            self._timer = None
+            self._refreshing = True
+        try:
+            with self._load_lock:
+                self._load()
+        except Exception as e:
+            print(f"[CACHE] {self.name}: ошибка фонового пересчёта: {e}")
+        try:
+            current = self._version_source()
+        except Exception:
+            current = None
+        with self._lock:
+            self._refreshing = False
+            if self._value is not None and current != self._version:
+                self._schedule_refresh()
+
+    def _load(self) -> Any:
+        """Считает значение и сохраняет его в кэш (вызывать под self._load_lock)"""
+        # Версию читаем до загрузки: данные будут не старее этой версии
+        version = self._version_source()
+        t0 = time.time()
+        value = self._loader()
+        with self._lock:
+            self._value = value
+            self._version = version
+            self._loaded_at = time.time()
+        print(f"[CACHE] {self.name}: пересчитан за {time.time() - t0:.3f}s (версия данных {version})")
+        return value
+
+
+class LRUCache:
+    def __init__(self, name: str, maxsize: int):
+        self.name = name  # Имя кэша для логов
+        self.maxsize = maxsize  # Максимальное число записей
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Any:
+        """Возвращает значение по ключу или None; учитывает попадания и промахи"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def peek(self, key: Hashable) -> Any:
+        """Как get, но не меняет порядок вытеснения и счётчики"""
+        with self._lock:
+            return self._entries.get(key)
+
+    def put(self, key: Hashable, value: Any):
+        """Сохраняет значение, вытесняя самые давно использованные записи сверх maxsize"""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        """Счётчики попаданий/промахов и текущий размер кэша"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'name': self.name,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
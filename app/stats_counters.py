@@ -0,0 +1,298 @@
+"""
+Инкрементально обновляемые счётчики для страницы статистики.
+
+Вместо полного сканирования answers ⋈ responses при каждом промахе кэша
+статистика читает несколько сотен строк из таблиц stat_*_counters.
+Счётчики обновляются в той же транзакции, что и запись анкеты:
+перед изменением снимаем «вклад» анкеты в счётчики, после изменения
+считаем его заново и применяем разницу. Так корректно учитываются и
+смена ответов, и переходы статуса draft → consent → complete.
+"""
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from app import models
+from app.data_version import SCOPE_SURVEY, bump_data_version
+from app.question_registry import PART_BASE, PART_DETAIL, ROLE_KADASTR, QuestionSet, question_registry
+
+# Типы вопросов, по которым ведутся счётчики (текстовые ответы не считаем)
+COUNTED_QTYPES = ('choice', 'priority', 'checkbox')
+
+# Типы анкет (сегменты респондентов) для аналитики
+SEGMENT_FULL = 'full_with_kadastr'  # Обе части, есть кадастровый номер
+SEGMENT_PARTIAL = 'partial_with_kadastr'  # Только первая часть, есть кадастровый номер
+SEGMENT_ONLY_SECOND = 'only_second_without_kadastr'  # Только вторая часть, без кадастрового номера
+RESPONDENT_SEGMENTS = (SEGMENT_FULL, SEGMENT_PARTIAL, SEGMENT_ONLY_SECOND)
+
+# Размер пачки строк в одном INSERT при обновлении счётчиков
+_INSERT_BATCH = 500
+
+# Модель и колонки-ключи для каждого вида счётчика
+_COUNTER_TABLES = {
+    'answer': (models.StatAnswerCounter, ('question_id', 'value', 'status', 'has_kadastr')),
+    'question': (models.StatQuestionCounter, ('question_id', 'status', 'has_kadastr')),
+    'response': (models.StatResponseCounter, ('status', 'has_kadastr', 'has_basic', 'has_second')),
+}
+
+def split_checkbox_value(value: str) -> List[str]:
+    """Разбивает ответ checkbox-вопроса на отдельные варианты"""
+    if not value:
+        return []
+    return [opt.strip() for opt in str(value).split(',')]
+
+def classify_respondent(status: str, has_kadastr: bool, has_second: bool) -> Optional[str]:
+    """Определяет тип анкеты по её признакам (None — анкета не попадает ни в один тип)"""
+    if status not in ('consent', 'complete'):
+        return None
+    if has_kadastr and has_second and status == 'complete':
+        return SEGMENT_FULL
+    if has_kadastr and not has_second and status == 'consent':
+        return SEGMENT_PARTIAL
+    if not has_kadastr and has_second:
+        return SEGMENT_ONLY_SECOND
+    return None
+
+def basic_qids(questions: QuestionSet) -> Tuple[int, ...]:
+    """Вопросы первой части анкеты, которые попадают в статистику (с вариантами ответа)"""
+    return tuple(qid for qid in questions.part(PART_BASE) if questions.qtypes[qid] in COUNTED_QTYPES)
+
+def response_contribution(status: str, answers: Iterable[Tuple[int, str]], questions: QuestionSet) -> Counter:
+    """
+    Вклад одной анкеты во все счётчики.
+    answers — пары (question_id, value) этой анкеты.
+    Ключи результата: (вид счётчика, *значения ключевых колонок).
+    """
+    answers = list(answers)
+    contribution = Counter()
+    if not answers:
+        # Анкеты без ответов в статистике не участвуют
+        return contribution
+
+    kadastr_qid = questions.qid(ROLE_KADASTR)
+    basic = basic_qids(questions)
+    second_part = questions.part(PART_DETAIL)
+    has_kadastr = any(qid == kadastr_qid and value for qid, value in answers)
+    has_basic = any(qid in basic for qid, _ in answers)
+    has_second = any(qid in second_part and value for qid, value in answers)
+    contribution[('response', status, has_kadastr, has_basic, has_second)] += 1
+
+    for qid, value in answers:
+        qtype = questions.qtypes.get(qid)
+        if qtype not in COUNTED_QTYPES:
+            continue
+        contribution[('question', qid, status, has_kadastr)] += 1
+        if qtype == 'checkbox':
+            for option in split_checkbox_value(value):
+                contribution[('answer', qid, option, status, has_kadastr)] += 1
+        else:
+            contribution[('answer', qid, value, status, has_kadastr)] += 1
+    return contribution
+
+def snapshot_response(db: Session, response_id: int, questions: QuestionSet = None) -> Counter:
+    """
+    Текущий (по данным в БД) вклад анкеты в счётчики.
+    Перед вызовом незафиксированные изменения должны быть сброшены в БД (db.flush()).
+    """
+    status = db.query(models.Response.status).filter(models.Response.id == response_id).scalar()
+    if status is None:
+        return Counter()
+    if questions is None:
+        questions = question_registry.get()
+    answers = db.query(models.Answer.question_id, models.Answer.value).filter(
+        models.Answer.response_id == response_id
+    ).all()
+    return response_contribution(status, answers, questions)
+
+def apply_delta(db: Session, delta: Dict[tuple, int]):
+    """Прибавляет delta к счётчикам (в текущей транзакции) и удаляет обнулившиеся строки"""
+    rows_by_kind = {}
+    for key, diff in delta.items():
+        if diff:
+            rows_by_kind.setdefault(key[0], []).append((key[1:], diff))
+
+    for kind, rows in rows_by_kind.items():
+        model, key_columns = _COUNTER_TABLES[kind]
+        values = [dict(zip(key_columns, key), count=diff) for key, diff in rows]
+        # Пачками, чтобы не упереться в лимит переменных SQLite
+        for start in range(0, len(values), _INSERT_BATCH):
+            stmt = sqlite_insert(model.__table__).values(values[start:start + _INSERT_BATCH])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=list(key_columns),
+                set_={'count': model.__table__.c.count + stmt.excluded.count}
+            )
+            db.execute(stmt)
+        db.query(model).filter(model.count <= 0).delete(synchronize_session=False)
+
+def apply_response_change(db: Session, response_id: int, before: Counter, questions: QuestionSet = None):
+    """
+    Применяет к счётчикам изменение анкеты: before — снимок до записи.
+    Вызывается после изменения анкеты, но до commit, чтобы счётчики менялись атомарно с данными.
+    """
+    db.flush()
+    after = snapshot_response(db, response_id, questions)
+    delta = {key: after[key] - before[key] for key in set(before) | set(after)}
+    apply_delta(db, delta)
+
+def _in_list(values: Iterable[int]) -> str:
+    """Список целых чисел для подстановки в SQL IN (...)"""
+    return ', '.join(str(int(v)) for v in values)
+
+# Признаки каждой анкеты, в которой есть хотя бы один ответ (те же, что в response_contribution).
+# id вопросов подставляются из реестра вопросов в _with_questions()
+_RESPONSE_FLAGS_CTE = """
+response_flags AS (
+    SELECT
+        r.id AS response_id,
+        r.status AS status,
+        COALESCE(MAX(a.question_id IN ({kadastr_qids}) AND a.value != ''), 0) AS has_kadastr,
+        COALESCE(MAX(a.question_id IN ({basic_qids})), 0) AS has_basic,
+        COALESCE(MAX(a.question_id IN ({second_part_qids}) AND a.value != ''), 0) AS has_second
+    FROM responses r
+    JOIN answers a ON a.response_id = r.id
+    GROUP BY r.id, r.status
+)"""
+
+_COUNTED_ANSWERS_CTE = f"""
+counted_answers AS (
+    SELECT a.question_id, a.value, q.qtype, f.status, f.has_kadastr
+    FROM answers a
+    JOIN questions q ON q.id = a.question_id
+    JOIN response_flags f ON f.response_id = a.response_id
+    WHERE q.qtype IN ({', '.join(repr(t) for t in COUNTED_QTYPES)})
+)"""
+
+# Значения choice/priority-вопросов и варианты checkbox-вопросов.
+# Варианты checkbox разбираются рекурсивным CTE: строка "a, b" -> "a", "b" (как split_checkbox_value).
+_ANSWER_COUNTS_SQL = f"""
+WITH RECURSIVE {_RESPONSE_FLAGS_CTE},
+{_COUNTED_ANSWERS_CTE},
+checkbox_options(question_id, status, has_kadastr, option, rest) AS (
+    SELECT question_id, status, has_kadastr, NULL, value || ','
+    FROM counted_answers
+    WHERE qtype = 'checkbox' AND value != ''
+    UNION ALL
+    SELECT
+        question_id, status, has_kadastr,
+        TRIM(SUBSTR(rest, 1, INSTR(rest, ',') - 1), ' ' || char(9) || char(10) || char(13)),
+        SUBSTR(rest, INSTR(rest, ',') + 1)
+    FROM checkbox_options
+    WHERE rest != ''
+)
+SELECT question_id, value, status, has_kadastr, COUNT(*) AS cnt
+FROM counted_answers
+WHERE qtype != 'checkbox'
+GROUP BY question_id, value, status, has_kadastr
+UNION ALL
+SELECT question_id, option, status, has_kadastr, COUNT(*) AS cnt
+FROM checkbox_options
+WHERE option IS NOT NULL
+GROUP BY question_id, option, status, has_kadastr
+"""
+
+_QUESTION_COUNTS_SQL = f"""
+WITH {_RESPONSE_FLAGS_CTE},
+{_COUNTED_ANSWERS_CTE}
+SELECT question_id, status, has_kadastr, COUNT(*) AS cnt
+FROM counted_answers
+GROUP BY question_id, status, has_kadastr
+"""
+
+_RESPONSE_COUNTS_SQL = f"""
+WITH {_RESPONSE_FLAGS_CTE}
+SELECT status, has_kadastr, has_basic, has_second, COUNT(*) AS cnt
+FROM response_flags
+GROUP BY status, has_kadastr, has_basic, has_second
+"""
+
+# Тип каждой анкеты (те же правила, что в classify_respondent).
+# Можно использовать как подзапрос, чтобы разбивать любую аналитику по типам анкет:
+#   SELECT ... FROM answers a JOIN (respondent_segments_sql()) s ON s.response_id = a.response_id
+_RESPONDENT_SEGMENTS_SQL = f"""
+WITH {_RESPONSE_FLAGS_CTE}
+SELECT
+    response_id,
+    CASE
+        WHEN status NOT IN ('consent', 'complete') THEN NULL
+        WHEN has_kadastr AND has_second AND status = 'complete' THEN '{SEGMENT_FULL}'
+        WHEN has_kadastr AND NOT has_second AND status = 'consent' THEN '{SEGMENT_PARTIAL}'
+        WHEN NOT has_kadastr AND has_second THEN '{SEGMENT_ONLY_SECOND}'
+    END AS segment
+FROM response_flags
+"""
+
+_SEGMENT_COUNTS_SQL = f"""
+SELECT
+    COALESCE(SUM(segment = '{SEGMENT_FULL}'), 0),
+    COALESCE(SUM(segment = '{SEGMENT_PARTIAL}'), 0),
+    COALESCE(SUM(segment = '{SEGMENT_ONLY_SECOND}'), 0)
+FROM ({_RESPONDENT_SEGMENTS_SQL})
+"""
+
+def _with_questions(sql: str, questions: QuestionSet = None) -> str:
+    """Подставляет в SQL id вопросов из реестра (кадастровый номер, первая и вторая часть анкеты)"""
+    if questions is None:
+        questions = question_registry.get()
+    kadastr_qid = questions.qid(ROLE_KADASTR)
+    return sql.format(
+        kadastr_qids=_in_list([kadastr_qid] if kadastr_qid is not None else []),
+        basic_qids=_in_list(basic_qids(questions)),
+        second_part_qids=_in_list(questions.part(PART_DETAIL))
+    )
+
+def respondent_segments_sql(questions: QuestionSet = None) -> str:
+    """SQL с типом каждой анкеты: строки (response_id, segment)"""
+    return _with_questions(_RESPONDENT_SEGMENTS_SQL, questions)
+
+def get_respondent_segments(db: Session) -> Dict[str, int]:
+    """
+    Количество анкет каждого типа по сырым данным — один запрос с условной агрегацией.
+    Возвращает словарь {тип анкеты: количество} для всех RESPONDENT_SEGMENTS.
+    """
+    row = db.execute(text(_with_questions(_SEGMENT_COUNTS_SQL))).one()
+    return dict(zip(RESPONDENT_SEGMENTS, (int(value) for value in row)))
+
+def compute_counters(db: Session) -> Counter:
+    """
+    Считает все счётчики заново по сырым данным answers/responses.
+    Весь подсчёт (включая разбор вариантов checkbox) выполняется в SQLite через GROUP BY,
+    поэтому память зависит от числа уникальных значений, а не от числа ответов.
+    """
+    counters = Counter()
+    questions = question_registry.get()
+    for kind, sql in (('answer', _ANSWER_COUNTS_SQL), ('question', _QUESTION_COUNTS_SQL), ('response', _RESPONSE_COUNTS_SQL)):
+        for row in db.execute(text(_with_questions(sql, questions))):
+            counters[(kind, *row[:-1])] += row[-1]
+    return counters
+
+def read_counters(db: Session) -> Counter:
+    """Читает текущее содержимое таблиц счётчиков"""
+    counters = Counter()
+    for kind, (model, key_columns) in _COUNTER_TABLES.items():
+        columns = [getattr(model, name) for name in key_columns]
+        for row in db.query(*columns, model.count).all():
+            counters[(kind, *row[:-1])] = row[-1]
+    return counters
+
+def rebuild_counters(db: Session) -> Dict[tuple, Tuple[int, int]]:
+    """
+    Пересчитывает счётчики по сырым данным и перезаписывает таблицы в текущей транзакции
+    (commit — за вызывающим). Возвращает расхождения: ключ -> (было в счётчиках, стало по сырым данным).
+    """
+    expected = compute_counters(db)
+    actual = read_counters(db)
+    drift = {
+        key: (actual[key], expected[key])
+        for key in set(expected) | set(actual)
+        if actual[key] != expected[key]
+    }
+    for model, _ in _COUNTER_TABLES.values():
+        db.query(model).delete(synchronize_session=False)
+    apply_delta(db, expected)
+    if drift:
+        # Статистика изменилась — кэши во всех воркерах должны пересчитаться
+        bump_data_version(db, SCOPE_SURVEY)
+    return drift
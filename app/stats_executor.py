@@ -0,0 +1,79 @@
+"""
+Отдельный пул потоков для тяжёлой работы страниц статистики и комментариев.
+
+Чтение статистики, построение графиков Bokeh и рендер шаблонов — синхронный код.
+Если выполнять его прямо в async-обработчике, один промах кэша останавливает
+event loop, и все остальные запросы воркера (в том числе отправка анкет) ждут.
+Здесь такая работа уходит в ограниченный пул; если результат не готов за
+STATS_RENDER_TIMEOUT секунд, отдаётся последний удачный результат с тем же ключом.
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Hashable
+
+# Число потоков пула и максимальное число задач в нём (выполняемых и ожидающих)
+STATS_EXECUTOR_WORKERS = int(os.getenv("STATS_EXECUTOR_WORKERS", "2"))
+STATS_EXECUTOR_QUEUE = int(os.getenv("STATS_EXECUTOR_QUEUE", "16"))
+# Сколько секунд ждём результат, прежде чем отдать последний удачный
+STATS_RENDER_TIMEOUT = float(os.getenv("STATS_RENDER_TIMEOUT", "5"))
+
+_executor = ThreadPoolExecutor(max_workers=STATS_EXECUTOR_WORKERS, thread_name_prefix="stats")
+_slots = threading.BoundedSemaphore(STATS_EXECUTOR_QUEUE)
+_last_results = {}  # ключ -> последний удачный результат
+_last_results_lock = threading.Lock()
+
+
+class StatsBusyError(Exception):
+    """Пул переполнен, а последнего удачного результата для этого ключа нет"""
+
+
+def _run_and_remember(key: Hashable, func: Callable, args: tuple) -> Any:
+    try:
+        result = func(*args)
+    finally:
+        _slots.release()
+    with _last_results_lock:
+        _last_results[key] = result
+    return result
+
+
+def get_last_result(key: Hashable) -> Any:
+    """Последний удачный результат задачи с этим ключом (или None)"""
+    with _last_results_lock:
+        return _last_results.get(key)
+
+
+async def run_stats_job(key: Hashable, func: Callable, *args, timeout: float = None) -> Any:
+    """
+    Выполняет func(*args) в пуле статистики, не блокируя event loop.
+    key — ключ для запоминания результата (например, ('stats', device_type)).
+    Если пул переполнен или результат не готов за timeout секунд, возвращает
+    последний удачный результат с тем же ключом; задача при этом продолжает
+    выполняться и обновит результат для следующих запросов.
+    """
+    if timeout is None:
+        timeout = STATS_RENDER_TIMEOUT
+    fallback = get_last_result(key)
+    if not _slots.acquire(blocking=False):
+        if fallback is not None:
+            print(f"[STATS POOL] {key}: пул занят, отдаём последний результат")
+            return fallback
+        raise StatsBusyError(key)
+    t0 = time.time()
+    future = asyncio.wrap_future(_executor.submit(_run_and_remember, key, func, args))
+    if fallback is None:
+        # Нечего отдать вместо результата — ждём его сколько потребуется
+        return await future
+    try:
+        return await asyncio.wait_for(asyncio.shield(future), timeout)
+    except asyncio.TimeoutError:
+        print(f"[STATS POOL] {key}: нет результата за {time.time() - t0:.1f}s, отдаём последний")
+        return fallback
+
+
+def shutdown_stats_executor():
+    """Останавливает пул (при остановке приложения дожидается текущих задач)"""
+    _executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,93 @@
+import random
+import sys
+import time
+from collections import Counter
+
+from sqlalchemy import text
+
+from app.comment_filter import comment_filter
+from app.db import ReadSessionLocal
+from app.lexicon_filter import AhoCorasick, LexiconFilter, fold_text
+from app.question_registry import ROLE_COMMENT, question_registry
+
+# Бенчмарк локальной проверки комментариев по словарю (app/moderation_lexicon.txt).
+# Корпус — сохранённые комментарии из БД (только чтение) или файл, по комментарию в строке.
+# Выводит, какая доля комментариев, которые раньше уходили в DeepSeek, теперь отклоняется
+# локально, и скорость словаря: автомат Ахо — Корасик против поиска каждого шаблона по очереди
+# при текущем словаре и при словаре, раздутом случайными шаблонами.
+# Запуск: python bench_lexicon_filter.py [файл_с_комментариями]
+MIN_TEXTS = 20_000  # Корпус повторяется до такого размера, чтобы замер шёл не доли миллисекунды
+EXTRA_PATTERNS = (0, 1_000, 5_000)
+
+def load_corpus():
+    """[(текст, сохранённый moderated или None)]"""
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], encoding='utf-8') as f:
+            return [(line.strip(), None) for line in f if line.strip()]
+    question_id = question_registry.get().qid(ROLE_COMMENT)
+    db = ReadSessionLocal()
+    try:
+        return [tuple(row) for row in db.execute(text(
+            "SELECT value, moderated FROM answers WHERE question_id = :question_id AND TRIM(value) != ''"
+        ), {'question_id': question_id}).all()]
+    finally:
+        db.close()
+
+def timed(fn, items) -> float:
+    t0 = time.perf_counter()
+    for item in items:
+        fn(item)
+    return time.perf_counter() - t0
+
+def report_api_calls(corpus, lexicon: LexiconFilter):
+    comment_filter.lexicon = None  # Прежняя базовая проверка, без словаря
+    try:
+        to_ai = [(value, moderated) for value, moderated in corpus if comment_filter._basic_validation(value)[0]]
+    finally:
+        comment_filter.lexicon = lexicon
+    rejected = [(value, moderated, lexicon.find(value)) for value, moderated in to_ai]
+    rejected = [(value, moderated, found) for value, moderated, found in rejected if found]
+    share = len(rejected) / len(to_ai) if to_ai else 0.0
+    print(f"комментариев: {len(corpus)}, проходят базовую проверку (раньше шли в AI): {len(to_ai)}")
+    print(f"отклонено словарём без запроса к AI: {len(rejected)} ({share:.1%} запросов)")
+    for reason, count in Counter(found[0] for _, _, found in rejected).most_common():
+        print(f"  {reason}: {count}")
+    shown = [(value, found) for value, moderated, found in rejected if moderated]
+    if shown:
+        # Сейчас показываются на сайте: либо AI пропустил (был недоступен), либо словарь ошибся
+        print(f"из них сейчас показываются ({len(shown)}) — проверьте словарь:")
+        for value, found in shown[:10]:
+            print(f"  [{found[1]}] {value[:80]}")
+
+def report_speed(corpus, lexicon: LexiconFilter):
+    texts = [value for value, _ in corpus]
+    texts = (texts * (MIN_TEXTS // len(texts) + 1))[:MIN_TEXTS]
+    chars = sum(map(len, texts))
+    elapsed = timed(lexicon.find, texts)
+    print(f"\nLexiconFilter.find (свёртка + поиск): {len(texts) / elapsed:,.0f} комм/с, "
+          f"{chars / elapsed / 1e6:.1f} млн символов/с, {elapsed / len(texts) * 1e6:.1f} мкс на комментарий")
+    elapsed = timed(fold_text, texts)
+    print(f"из них свёртка текста fold_text: {elapsed / len(texts) * 1e6:.1f} мкс на комментарий")
+
+    folded = [fold_text(value) for value in texts]
+    patterns = [pattern for pattern, _, _, _ in lexicon._entries]
+    rnd = random.Random(1)
+    print("\nпоиск по свёрнутому тексту, мкс на комментарий:")
+    print(f"{'шаблонов':>9} | {'автомат':>8} | {'по очереди':>10}")
+    for extra in EXTRA_PATTERNS:
+        # Случайные «слова» из русских букв: раздувают словарь, почти не давая совпадений
+        grown = patterns + [''.join(rnd.choice('абвгдежзийклмнопрстуфхцчшщыэюя') for _ in range(rnd.randint(5, 9)))
+                            for _ in range(extra)]
+        automaton = AhoCorasick(grown)
+        automaton_time = timed(lambda folded_text: list(automaton.iter_matches(folded_text)), folded)
+        scan_time = timed(lambda folded_text: [p for p in grown if p in folded_text], folded)
+        print(f"{len(grown):>9} | {automaton_time / len(folded) * 1e6:>8.1f} | {scan_time / len(folded) * 1e6:>10.1f}")
+
+if __name__ == "__main__":
+    corpus = load_corpus()
+    if not corpus:
+        print("Комментариев нет: укажите файл с комментариями (по одному в строке)")
+        sys.exit(1)
+    lexicon = comment_filter.lexicon or LexiconFilter.load()
+    report_api_calls(corpus, lexicon)
+    report_speed(corpus, lexicon)
@@ -0,0 +1,233 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Бенчмарк модерации комментариев без обращения к настоящему DeepSeek: запускает заглушку
+# deepseek_stub.py (задержка, доля ошибок и доля отклонений задаются ключами) и при нескольких
+# уровнях параллельности измеряет:
+#   1) validate_comment() в пуле потоков — RPS и p50/p95/p99 одной проверки;
+#   2) POST /survey/details на uvicorn с app.main:app — RPS и p50/p95/p99 ответа, а также время
+#      до вердикта фоновой очереди модерации (MODERATION_WORKERS = --workers) и её пропускную способность.
+# Работает на временной БД, рабочую не трогает.
+# Запуск: python bench_moderation.py [--latency-ms 500] [--error-rate 0.02] [--levels 1,4,16,64]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Бенчмарк модерации комментариев на заглушке DeepSeek")
+    parser.add_argument("--latency-ms", type=float, default=500, help="медиана задержки заглушки")
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 503 от заглушки")
+    parser.add_argument("--reject-rate", type=float, default=0.1, help="доля отклоняемых комментариев")
+    parser.add_argument("--levels", default="1,4,16,64", help="уровни параллельности через запятую")
+    parser.add_argument("--requests", type=int, default=40, help="минимум комментариев на уровень (и не меньше 2 × уровень)")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("MODERATION_WORKERS", "2")),
+                        help="потоков фоновой модерации в приложении")
+    parser.add_argument("--stub-port", type=int, default=8790)
+    parser.add_argument("--app-port", type=int, default=8791)
+    return parser.parse_args()
+
+ARGS = parse_args()
+DATABASE_PATH = os.path.join(tempfile.mkdtemp(prefix="bench_moderation_"), "bench.sqlite3")
+os.environ.update({
+    "DATABASE_PATH": DATABASE_PATH,
+    "DEEPSEEK_API_KEY": "stub",
+    "DEEPSEEK_BASE_URL": f"http://127.0.0.1:{ARGS.stub_port}",
+    "MODERATION_WORKERS": str(ARGS.workers),
+})
+
+import httpx
+
+from app.circuit_breaker import CircuitBreaker
+from app.comment_filter import comment_filter, validate_comment
+from app.question_registry import ROLE_COMMENT, question_registry
+
+WORDS = ("дорогу", "освещение", "шлагбаум", "пруд", "мусор", "забор", "площадку", "охрану",
+         "воду", "электричество", "собрание", "взносы", "ремонт", "весной", "летом", "соседи")
+_rnd = random.Random(1)
+
+def make_comment(n: int) -> str:
+    """Уникальный комментарий, который проходит базовую проверку и словарь"""
+    return f"{' '.join(_rnd.sample(WORDS, 6)).capitalize()}, предложение номер {n}"
+
+def levels():
+    return [int(level) for level in ARGS.levels.split(',')]
+
+def count_for(level: int) -> int:
+    return max(ARGS.requests, 2 * level)
+
+def prepare_db():
+    from app import models
+    from app.api.questions import add_all_questions
+    from app.data_version import ensure_data_versions
+    from app.db import SessionLocal, engine
+    from app.migrations import apply_migrations
+
+    models.Base.metadata.create_all(engine)
+    ensure_data_versions(engine)
+    db = SessionLocal()
+    add_all_questions(db)
+    db.close()
+    apply_migrations(engine, SessionLocal)
+
+def start_server(name: str, args, port: int) -> subprocess.Popen:
+    # Логи модерации ([PROFILE], [CACHE]) на каждый комментарий не выводим
+    proc = subprocess.Popen([sys.executable, *args], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(200):
+        if proc.poll() is not None:
+            raise RuntimeError(f"{name} завершился с кодом {proc.returncode}")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/", timeout=1)
+            return proc
+        except httpx.TransportError:
+            time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError(f"{name} не запустился")
+
+def stub_counters() -> dict:
+    return httpx.get(f"http://127.0.0.1:{ARGS.stub_port}/stats").json()
+
+def percentiles(values):
+    """p50, p95, p99"""
+    if len(values) < 2:
+        return (float('nan'),) * 3
+    cuts = statistics.quantiles(values, n=100)
+    return cuts[49], cuts[94], cuts[98]
+
+def bench_validate():
+    print("\nvalidate_comment(), пул потоков:")
+    print(f"{'потоков':>7} | {'комм.':>5} | {'RPS':>6} | {'p50, мс':>8} | {'p95, мс':>8} | {'p99, мс':>8} | "
+          f"{'отклонено':>9} | {'ошибок':>6} | выключатель")
+    n = 0
+    for level in levels():
+        comment_filter.breaker = CircuitBreaker("deepseek")  # Каждый уровень — с замкнутого выключателя
+        texts = [make_comment(n + i) for i in range(count_for(level))]
+        n += len(texts)
+        latencies, verdicts = [], []
+
+        def one(text):
+            t0 = time.perf_counter()
+            verdicts.append(validate_comment(text))
+            latencies.append(time.perf_counter() - t0)
+
+        before = stub_counters()
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=level) as pool:
+                list(pool.map(one, texts))
+            elapsed = time.perf_counter() - t0
+        after = stub_counters()
+        breaker = comment_filter.breaker.stats()
+        p50, p95, p99 = (value * 1000 for value in percentiles(latencies))
+        rejected = sum(1 for approved, _ in verdicts if not approved)
+        print(f"{level:>7} | {len(texts):>5} | {len(texts) / elapsed:>6.1f} | {p50:>8.1f} | {p95:>8.1f} | {p99:>8.1f} | "
+              f"{rejected:>9} | {after['errors'] - before['errors']:>6} | "
+              f"{breaker['state']}, пропущено {breaker['short_circuited']}")
+
+def pending_sessions(con) -> set:
+    return {row[0] for row in con.execute("""
+        SELECT r.session_id FROM comment_moderation_queue q
+        JOIN answers a ON a.id = q.answer_id JOIN responses r ON r.id = a.response_id
+    """)}
+
+def watch_verdicts(submitted: dict, done: dict, lock: threading.Lock, expected: int, stop: threading.Event):
+    """Засекает, когда комментарий каждой отправленной анкеты покидает очередь модерации"""
+    con = sqlite3.connect(f"file:{DATABASE_PATH}?mode=ro", uri=True)
+    try:
+        while len(done) < expected and not stop.is_set():
+            pending = pending_sessions(con)
+            now = time.perf_counter()
+            with lock:
+                for session_id in submitted.keys() - done.keys() - pending:
+                    done[session_id] = now
+            time.sleep(0.05)
+    finally:
+        con.close()
+
+async def post_all(http, path, payloads, level, latencies=None, submitted=None, lock=None):
+    semaphore = asyncio.Semaphore(level)
+    errors = []
+
+    async def one(payload):
+        async with semaphore:
+            t0 = time.perf_counter()
+            response = await http.post(f"http://127.0.0.1:{ARGS.app_port}{path}", json=payload)
+            finished = time.perf_counter()
+            if response.status_code != 200:
+                errors.append(response.status_code)
+            if latencies is not None:
+                latencies.append(finished - t0)
+            if submitted is not None:
+                with lock:
+                    submitted[payload['session_id']] = finished
+
+    await asyncio.gather(*(one(payload) for payload in payloads))
+    return errors
+
+async def bench_details_level(http, level: int, comment_qid: int, first: int):
+    sessions = [str(uuid.uuid4()) for _ in range(count_for(level))]
+    base = [{'session_id': session_id, 'consent': True, 'answers': [
+        {'question_id': 1, 'value': 'Бенч Тест'}, {'question_id': 3, 'value': f"+7999{first + i:07d}"}
+    ]} for i, session_id in enumerate(sessions)]
+    await post_all(http, '/survey/base', base, level)
+
+    details = [{'session_id': session_id, 'answers': [{'question_id': comment_qid, 'value': make_comment(first + i)}]}
+               for i, session_id in enumerate(sessions)]
+    latencies, submitted, done, lock, stop = [], {}, {}, threading.Lock(), threading.Event()
+    watcher = threading.Thread(target=watch_verdicts, args=(submitted, done, lock, len(sessions), stop), daemon=True)
+    watcher.start()
+    t0 = time.perf_counter()
+    errors = await post_all(http, '/survey/details', details, level, latencies, submitted, lock)
+    elapsed = time.perf_counter() - t0
+    await asyncio.to_thread(watcher.join, 600)
+    stop.set()
+    drained = max(done.values()) - t0 if done else float('nan')
+    delays = sorted(done[session_id] - submitted[session_id] for session_id in done)
+    p50, p95, p99 = (value * 1000 for value in percentiles(latencies))
+    d50, d95, d99 = percentiles(delays)
+    print(f"{level:>7} | {len(sessions):>5} | {len(sessions) / elapsed:>6.1f} | {p50:>8.1f} | {p95:>8.1f} | {p99:>8.1f} | "
+          f"{len(errors):>6} | {d50:>6.1f} | {d95:>6.1f} | {d99:>6.1f} | "
+          f"{len(done) / drained:>8.1f}")
+    return len(sessions)
+
+async def bench_details(comment_qid: int):
+    print(f"\nPOST /survey/details, параллельных клиентов; модерация в фоне, потоков: {ARGS.workers}")
+    print(f"{'клиентов':>7} | {'комм.':>5} | {'RPS':>6} | {'p50, мс':>8} | {'p95, мс':>8} | {'p99, мс':>8} | "
+          f"{'ошибок':>6} | {'вердикт через, с: p50/p95/p99':^24} | {'комм/с':>8}")
+    first = 1_000_000  # Тексты не совпадают с комментариями первой части (иначе вердикт взялся бы из кэша)
+    async with httpx.AsyncClient(timeout=120, limits=httpx.Limits(max_connections=max(levels()))) as http:
+        for level in levels():
+            first += await bench_details_level(http, level, comment_qid, first)
+
+if __name__ == "__main__":
+    prepare_db()
+    comment_qid = question_registry.get().qid(ROLE_COMMENT)
+    stub = start_server("deepseek_stub.py", [os.path.join(os.path.dirname(os.path.abspath(__file__)), "deepseek_stub.py"),
+                         "--port", str(ARGS.stub_port), "--latency-ms", str(ARGS.latency_ms),
+                         "--latency-sigma", str(ARGS.latency_sigma), "--error-rate", str(ARGS.error_rate),
+                         "--reject-rate", str(ARGS.reject_rate)], ARGS.stub_port)
+    try:
+        print(f"заглушка: медиана {ARGS.latency_ms:.0f} мс, sigma {ARGS.latency_sigma}, "
+              f"ошибок {ARGS.error_rate:.0%}, отклоняет {ARGS.reject_rate:.0%}")
+        bench_validate()
+        app = start_server("uvicorn app.main:app", ["-m", "uvicorn", "app.main:app", "--port", str(ARGS.app_port),
+                            "--log-level", "warning", "--no-access-log"], ARGS.app_port)
+        try:
+            asyncio.run(bench_details(comment_qid))
+        finally:
+            app.terminate()
+            app.wait()
+    finally:
+        stub.terminate()
+        stub.wait()
@@ -0,0 +1,145 @@
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+# Бенчмарк маршрутов /survey/* под 200 одновременными клиентами: прежние синхронные
+# обработчики (Session в пуле потоков AnyIO) против асинхронных (AsyncSession поверх aiosqlite).
+# Каждый вариант запускается отдельным процессом uvicorn на временной БД, рабочую не трогает.
+# Клиент проходит check_unique, /survey/base и GET /survey/questions; выводятся RPS и p50/p99.
+# Запуск: python bench_survey_async.py [клиентов] [проходов_на_клиента]
+if __name__ == "__main__" and len(sys.argv) > 1 and sys.argv[1] == "serve":
+    MODE, PORT = sys.argv[2], int(sys.argv[3])
+else:
+    os.environ.setdefault("DATABASE_PATH", os.path.join(tempfile.mkdtemp(prefix="bench_survey_"), "bench.sqlite3"))
+    MODE = None
+
+from fastapi import APIRouter, Body, Depends, FastAPI
+from sqlalchemy.orm import Session
+
+from app import crud, schemas
+from app.db import get_db, get_read_db
+
+def build_sync_app() -> FastAPI:
+    """Прежние синхронные обработчики тех же маршрутов"""
+    from app.api.survey import UniqueCheckRequest
+    router = APIRouter(prefix="/survey")
+
+    @router.get("/questions", response_model=list[schemas.QuestionSchema])
+    def read_questions(db: Session = Depends(get_read_db)):
+        return crud.get_questions(db)
+
+    @router.post("/check_unique")
+    def check_unique(data: UniqueCheckRequest = Body(...), db: Session = Depends(get_read_db)):
+        existing = crud.get_existing_identities(db, data.email, data.phone, data.kadastr)
+        return {'email_exists': 'email' in existing, 'phone_exists': 'phone' in existing}
+
+    @router.post("/base")
+    def save_base(data: schemas.BaseStepSchema, db: Session = Depends(get_db)):
+        crud.save_survey_step(db, data.session_id, [a.dict() for a in data.answers], "consent" if data.consent else None)
+        return {"status": "ok", "session_id": data.session_id}
+
+    app = FastAPI()
+    app.include_router(router)
+    return app
+
+def build_async_app() -> FastAPI:
+    from app.api import survey
+    app = FastAPI()
+    app.include_router(survey.router)
+    return app
+
+def prepare_db():
+    from app import models
+    from app.api.questions import add_all_questions
+    from app.data_version import ensure_data_versions
+    from app.db import SessionLocal, engine
+    from app.migrations import apply_migrations
+
+    models.Base.metadata.create_all(engine)
+    ensure_data_versions(engine)
+    db = SessionLocal()
+    add_all_questions(db)
+    db.close()
+    apply_migrations(engine, SessionLocal)
+
+async def client(http, base_url, passes, latencies, errors):
+    import httpx
+    for _ in range(passes):
+        phone = f"+7999{uuid.uuid4().int % 10**7:07d}"
+        requests = (
+            ('POST', '/survey/check_unique', {'phone': phone, 'email': f'{phone}@bench.ru'}),
+            ('POST', '/survey/base', {
+                'session_id': str(uuid.uuid4()), 'consent': True,
+                'answers': [{'question_id': 1, 'value': 'Бенч Тест'}, {'question_id': 3, 'value': phone}]
+            }),
+            ('GET', '/survey/questions', None),
+        )
+        for method, path, payload in requests:
+            t0 = time.perf_counter()
+            try:
+                response = await http.request(method, base_url + path, json=payload)
+            except httpx.TransportError as e:
+                # Сервер закрыл соединение после ошибки в обработчике
+                errors.append(type(e).__name__)
+            else:
+                if response.status_code != 200:
+                    errors.append(response.status_code)
+            latencies.append((time.perf_counter() - t0) * 1000)
+
+async def load(base_url, clients, passes):
+    import httpx
+    latencies, errors = [], []
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(limits=limits, timeout=120) as http:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(client(http, base_url, passes, latencies, errors) for _ in range(clients)))
+        elapsed = time.perf_counter() - t0
+    return len(latencies) / elapsed, latencies, errors
+
+def wait_ready(base_url, proc):
+    import httpx
+    for _ in range(200):
+        if proc.poll() is not None:
+            raise RuntimeError(f"uvicorn завершился с кодом {proc.returncode}")
+        try:
+            httpx.get(base_url + '/survey/questions', timeout=1)
+            return
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise RuntimeError("uvicorn не запустился")
+
+def run(mode, port, clients, passes):
+    # Синхронный вариант под такой нагрузкой упирается в пул потоков AnyIO (40 потоков): сессии
+    # закрываются в get_db/get_read_db тоже из потока пула, и часть запросов ждёт соединение
+    # дольше SQLITE_WRITE_POOL_TIMEOUT — сокращаем его, чтобы прогон не шёл часами.
+    # Трассировки ошибок сервера не выводим — они учтены в столбце «ошибок».
+    env = dict(os.environ, SQLITE_WRITE_POOL_TIMEOUT=os.getenv("SQLITE_WRITE_POOL_TIMEOUT", "5"))
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "serve", mode, str(port)],
+                            env=env, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        wait_ready(base_url, proc)
+        rps, latencies, errors = asyncio.run(load(base_url, clients, passes))
+    finally:
+        proc.terminate()
+        proc.wait()
+    cuts = statistics.quantiles(latencies, n=100)
+    print(f"{mode:>6} | {rps:>7.0f} | {cuts[49]:>8.1f} | {cuts[98]:>8.1f} | {len(errors):>6}")
+
+if MODE is not None:
+    import uvicorn
+    uvicorn.run(build_sync_app() if MODE == "sync" else build_async_app(),
+                host="127.0.0.1", port=PORT, log_level="warning", access_log=False)
+elif __name__ == "__main__":
+    CLIENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    PASSES = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    prepare_db()
+    print(f"клиентов: {CLIENTS}, запросов: {CLIENTS * PASSES * 3} на вариант")
+    print(f"{'режим':>6} | {'RPS':>7} | {'p50, мс':>8} | {'p99, мс':>8} | {'ошибок':>6}")
+    run("sync", 8765, CLIENTS, PASSES)
+    run("async", 8766, CLIENTS, PASSES)
@@ -0,0 +1,97 @@
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+# Бенчмарк записи шага анкеты (12 ответов второй части) при 1k/10k/100k ответов в БД:
+# crud.upsert_answers (INSERT ... ON CONFLICT пачкой) против прежнего SELECT на каждый ответ.
+# Работает на временной БД, рабочую не трогает. Запуск: python bench_upsert_answers.py [число_отправок]
+os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="bench_upsert_"), "bench.sqlite3")
+
+from sqlalchemy import text
+
+from app import crud, identities, models, stats_counters
+from app.api.questions import add_all_questions
+from app.data_version import SCOPE_COMMENTS, SCOPE_SURVEY, bump_data_version
+from app.db import SessionLocal, engine
+from app.migrations import apply_migrations
+
+SIZES = (1_000, 10_000, 100_000)
+SUBMISSIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+DETAIL_QIDS = list(range(6, 18))
+
+def upsert_answers_per_row(db, response_id, answers):
+    """Прежняя реализация crud.upsert_answers: SELECT ... first() на каждый ответ"""
+    before = stats_counters.snapshot_response(db, response_id)
+    for ans in answers:
+        existing = db.query(models.Answer).filter_by(response_id=response_id, question_id=ans['question_id']).first()
+        if existing:
+            existing.value = ans['value']
+            if 'moderated' in ans:
+                existing.moderated = ans['moderated']
+        else:
+            db.add(models.Answer(
+                response_id=response_id,
+                question_id=ans['question_id'],
+                value=ans['value'],
+                moderated=ans.get('moderated', True)
+            ))
+    stats_counters.apply_response_change(db, response_id, before)
+    identities.sync_response_identities(db, response_id)
+    bump_data_version(db, SCOPE_SURVEY, SCOPE_COMMENTS)
+    db.commit()
+
+def fill_answers(target: int):
+    """Дополняет БД анкетами по 12 ответов, пока ответов не станет target"""
+    with engine.begin() as conn:
+        current = conn.execute(text("SELECT COUNT(*) FROM answers")).scalar()
+        responses = (target - current) // len(DETAIL_QIDS)
+        for _ in range(responses):
+            response_id = conn.execute(
+                text("INSERT INTO responses (session_id, status) VALUES (:sid, 'complete')"), {'sid': str(uuid.uuid4())}
+            ).lastrowid
+            conn.execute(
+                text("INSERT INTO answers (response_id, question_id, value, moderated, likes_count) VALUES (:r, :q, :v, 1, 0)"),
+                [{'r': response_id, 'q': qid, 'v': str(qid % 3)} for qid in DETAIL_QIDS]
+            )
+    db = SessionLocal()
+    try:
+        stats_counters.rebuild_counters(db)
+        db.commit()
+    finally:
+        db.close()
+
+def submission_answers(i: int):
+    answers = [{'question_id': qid, 'value': str((qid + i) % 3)} for qid in DETAIL_QIDS]
+    answers[10]['moderated'] = True  # Комментарий проходит модерацию, как в /survey/details
+    return answers
+
+def measure(upsert) -> float:
+    """Медиана (мс) одной отправки шага: новая анкета, затем повторная отправка тех же вопросов"""
+    timings = []
+    db = SessionLocal()
+    try:
+        for i in range(SUBMISSIONS):
+            resp = crud.create_response_base(db, str(uuid.uuid4()))
+            for attempt in range(2):
+                t0 = time.perf_counter()
+                upsert(db, resp.id, submission_answers(i + attempt))
+                timings.append((time.perf_counter() - t0) * 1000)
+    finally:
+        db.close()
+    return statistics.median(timings)
+
+models.Base.metadata.create_all(engine)
+db = SessionLocal()
+add_all_questions(db)
+db.close()
+apply_migrations(engine, SessionLocal)
+
+print(f"{'ответов в БД':>14} | {'пачкой, мс':>11} | {'по одному, мс':>14}")
+for size in SIZES:
+    fill_answers(size)
+    bulk = measure(crud.upsert_answers)
+    per_row = measure(upsert_answers_per_row)
+    print(f"{size:>14} | {bulk:>11.2f} | {per_row:>14.2f}")
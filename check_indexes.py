@@ -0,0 +1,69 @@
+import sys
+
+from sqlalchemy import text
+
+from app.api.stats import _COMMENTS_PAGE_SQL
+from app.db import read_engine
+
+# Проверяет через EXPLAIN QUERY PLAN, что частые запросы crud.py и stats.py идут по индексам,
+# а не полным сканированием таблицы, а запросы с ORDER BY читают строки в порядке индекса,
+# без сортировки во временном B-дереве. Код возврата 1 — есть такие запросы.
+HOT_QUERIES = {
+    'анкета по session_id': "SELECT id FROM responses WHERE session_id = 'x'",
+    'анкеты по статусу': "SELECT COUNT(*) FROM responses WHERE status = 'complete'",
+    'ответы анкеты': "SELECT question_id, value FROM answers WHERE response_id = 1",
+    'ответ анкеты на вопрос': "SELECT id FROM answers WHERE response_id = 1 AND question_id = 2",
+    'значения ответов на вопрос': "SELECT value, COUNT(*) FROM answers WHERE question_id = 4 GROUP BY value",
+    'ответ с данным значением': "SELECT response_id FROM answers WHERE question_id = 18 AND value = 'a@b.ru'",
+    # Те же запросы, что выполняет stats.py: первая страница и следующая по курсору
+    'топ комментариев': (_COMMENTS_PAGE_SQL.format(where=''), {'question_id': 16, 'limit': 20}),
+    'комментарии после курсора': (
+        _COMMENTS_PAGE_SQL.format(where='AND (a.likes_count, a.response_id, a.id) < (:likes, :response_id, :answer_id)'),
+        {'question_id': 16, 'limit': 20, 'likes': 3, 'response_id': 100, 'answer_id': 1000}
+    ),
+    'лайки комментария': "SELECT COUNT(*) FROM comment_likes WHERE answer_id = 1",
+    'лайк с IP': "SELECT id FROM comment_likes WHERE answer_id = 1 AND ip_address = '127.0.0.1'",
+    'последний код подтверждения': """
+        SELECT id FROM verification_codes WHERE email = 'a@b.ru' AND session_id = 'x'
+        ORDER BY created_at DESC LIMIT 1
+    """,
+    'контактные данные': """
+        SELECT kind, response_id, status FROM respondent_identities
+        WHERE (kind = 'email' AND normalized_value = 'a@b.ru') OR (kind = 'phone' AND normalized_value = '79991234567')
+    """,
+}
+
+def full_scans(plan_details):
+    """Шаги плана, которые читают всю таблицу (SCAN без индекса)"""
+    return [
+        detail for detail in plan_details
+        if detail.startswith('SCAN ') and 'INDEX' not in detail and 'SUBQUERY' not in detail
+    ]
+
+def temp_sorts(plan_details):
+    """
+    Сортировка во временном B-дереве (USE TEMP B-TREE FOR ORDER BY / RIGHT PART OF ORDER BY):
+    перед LIMIT сортируются все подходящие строки, а не читаются первые по индексу
+    """
+    return [detail for detail in plan_details if detail.startswith('USE TEMP B-TREE') and 'ORDER BY' in detail]
+
+failed = 0
+with read_engine.connect() as conn:
+    for name, query in HOT_QUERIES.items():
+        sql, params = query if isinstance(query, tuple) else (query, {})
+        plan = [row[-1] for row in conn.execute(text('EXPLAIN QUERY PLAN ' + sql), params)]
+        scans = full_scans(plan)
+        sorts = temp_sorts(plan) if 'ORDER BY' in sql.upper() else []
+        if scans:
+            failed += 1
+            print(f"ПОЛНОЕ СКАНИРОВАНИЕ  {name}: {'; '.join(scans)}")
+        elif sorts:
+            failed += 1
+            print(f"СОРТИРОВКА ВСЕХ СТРОК  {name}: {'; '.join(plan)}")
+        else:
+            print(f"ok  {name}: {'; '.join(plan)}")
+
+if failed:
+    print(f"Запросов без индекса или с сортировкой мимо индекса: {failed}")
+    sys.exit(1)
+print("Все частые запросы используют индексы")
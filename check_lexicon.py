@@ -0,0 +1,55 @@
+import sys
+
+from app.lexicon_filter import LexiconFilter
+
+# Проверяет словарь модерации (app/moderation_lexicon.txt, или MODERATION_LEXICON_PATH):
+# явный мат и спам должны находиться, а обычные слова, похожие на шаблоны словаря, — нет.
+# Код возврата 1 — словарь пропустил что-то из BLOCKED или отклонил что-то из ALLOWED.
+# Запуск после каждой правки словаря: python check_lexicon.py
+BLOCKED = (
+    'Председатель бля опять ничего не сделал',
+    'Какой же это уебок, честное слово',
+    'Уебался с этим забором за всё лето',
+    'Уёбище, а не дорога',
+    'Б.л.я.д.ь, опять без света',
+    'Хуууй вам, а не взносы',
+    'x у й вам',
+    'Всё распиздяйство от правления',
+    'Лучшее казино онлайн, заходите',
+    'Заработок   в интернете без вложений',
+)
+# Обычные слова, в которых есть шаблон словаря не на своём месте
+ALLOWED = (
+    'Вода с корабля пришла мутная',  # бля — только целое слово
+    'На воротах висит старая бляха',
+    'Застрахуйте дома от пожара',  # хуй* — только с начала слова
+    'Приехали из Ебурга на выходные',  # ебу — только целое слово
+    'Сосед Уебер предлагает починить насос',  # уеб* сужен до уеба*, уебк* ...
+    'Не надо оскорблять соседей',
+    'Привезите свежего хлеба в магазин',
+    'Сукачёв обещал прийти на собрание',  # сука — только целое слово
+    'Мудрое решение по дороге',  # мудак*, мудил* — не мудр*
+    'Оплатим взносы и ставки налога',
+)
+
+lexicon = LexiconFilter.load()
+failed = 0
+for text in BLOCKED:
+    found = lexicon.find(text)
+    if found is None:
+        failed += 1
+        print(f"ПРОПУЩЕНО  {text}")
+    else:
+        print(f"ok  {text}: {found[0]} ({found[1]})")
+for text in ALLOWED:
+    found = lexicon.find(text)
+    if found is not None:
+        failed += 1
+        print(f"ЛОЖНОЕ СРАБАТЫВАНИЕ  {text}: {found[0]} ({found[1]})")
+    else:
+        print(f"ok  {text}")
+
+if failed:
+    print(f"Ошибок словаря: {failed}")
+    sys.exit(1)
+print("Словарь находит мат и спам и не трогает похожие обычные слова")
@@ -0,0 +1,78 @@
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+# Проверяет, что пересчёт статистики не задерживает отправку анкет: build_statistics подменяется
+# медленной версией (STATS_DELAY секунд), и пока /stats её ждёт, /survey/base должен отвечать
+# так же быстро, как без нагрузки. Работает на временной БД, рабочую не трогает.
+# Код возврата 1 — /survey/base ждал пересчёта статистики. Запуск: python check_stats_isolation.py
+os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="check_stats_"), "check.sqlite3")
+os.chdir(os.path.dirname(os.path.abspath(__file__)))  # static/ и templates/ ищутся от корня проекта
+
+from fastapi.testclient import TestClient
+
+from app import models
+from app.api import stats as stats_api
+from app.api.questions import add_all_questions
+from app.db import SessionLocal, engine
+
+STATS_DELAY = 3.0
+REQUESTS = 20
+
+def prepare_db():
+    models.Base.metadata.create_all(engine)
+    db = SessionLocal()
+    add_all_questions(db)
+    db.close()
+
+stats_started = threading.Event()
+build_statistics = stats_api.build_statistics
+
+def slow_build_statistics(*args, **kwargs):
+    stats_started.set()
+    time.sleep(STATS_DELAY)  # Блокирующая работа: на event loop она остановила бы все запросы воркера
+    return build_statistics(*args, **kwargs)
+
+def post_base(client) -> float:
+    t0 = time.perf_counter()
+    response = client.post('/survey/base', json={
+        'session_id': str(uuid.uuid4()), 'consent': True,
+        'answers': [{'question_id': 1, 'value': 'Проверка Статистики'}]
+    })
+    assert response.status_code == 200, response.text
+    return time.perf_counter() - t0
+
+def main() -> int:
+    prepare_db()
+    stats_api.build_statistics = slow_build_statistics
+    from app.main import app
+    with TestClient(app) as client:
+        idle = [post_base(client) for _ in range(REQUESTS)]
+
+        stats_thread = threading.Thread(target=lambda: client.get('/stats'))
+        stats_thread.start()
+        if not stats_started.wait(10):
+            print("/stats не начал пересчёт статистики")
+            return 1
+        busy = []
+        while stats_thread.is_alive() and len(busy) < REQUESTS:
+            busy.append(post_base(client))
+        stats_running = stats_thread.is_alive()
+        stats_thread.join()
+
+    print(f"/survey/base без нагрузки:      p50 {statistics.median(idle) * 1000:.1f} мс, max {max(idle) * 1000:.1f} мс")
+    print(f"/survey/base во время /stats:   p50 {statistics.median(busy) * 1000:.1f} мс, max {max(busy) * 1000:.1f} мс "
+          f"({len(busy)} запросов, пересчёт {STATS_DELAY:.0f}s)")
+    # Все запросы должны уложиться в пересчёт: если бы они ждали его, первый же занял бы ~STATS_DELAY
+    if not stats_running or max(busy) > STATS_DELAY / 4:
+        print("ОШИБКА: /survey/base ждал пересчёта статистики")
+        return 1
+    print("ok: пересчёт статистики не задерживает отправку анкет")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
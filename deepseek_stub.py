@@ -0,0 +1,86 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+# Локальная заглушка DeepSeek: отвечает на POST /chat/completions так же, как OpenAI-совместимый API,
+# которым пользуется AICommentFilter (один комментарий или пакет из remoderate_comments.py).
+# Задержка — логнормальная с медианой --latency-ms, доля ответов 503 — --error-rate,
+# доля отклонённых комментариев — --reject-rate (вердикт зависит только от текста, как у кэша).
+# Запуск: python deepseek_stub.py [--port 8790] [--latency-ms 500] [--error-rate 0.02] [--reject-rate 0.1]
+# Приложение на заглушке: DEEPSEEK_API_KEY=stub DEEPSEEK_BASE_URL=http://127.0.0.1:8790
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Заглушка DeepSeek chat.completions для бенчмарков модерации")
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--latency-ms", type=float, default=500, help="медиана задержки ответа (0 — отвечать без задержки)")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="разброс задержки (sigma логнормального)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 503")
+    parser.add_argument("--reject-rate", type=float, default=0.1, help="доля отклоняемых комментариев")
+    return parser.parse_args(argv)
+
+def verdict(comment: str, reject_rate: float) -> dict:
+    """Одинаковый текст — одинаковый вердикт"""
+    bucket = int(hashlib.sha256(comment.encode('utf-8')).hexdigest()[:8], 16) / 0xFFFFFFFF
+    if bucket < reject_rate:
+        return {"approved": False, "reason": "мат"}
+    return {"approved": True, "reason": "OK"}
+
+def answer(prompt: str, reject_rate: float) -> str:
+    """Текст ответа модели: JSON-массив для пакета, JSON-объект для одного комментария"""
+    head, sep, batch = prompt.rpartition("Комментарии: ")
+    if sep:
+        try:
+            items = json.loads(batch)
+        except json.JSONDecodeError:
+            items = None
+        if isinstance(items, list):
+            return json.dumps([{"n": item.get("n"), **verdict(str(item.get("text", "")), reject_rate)}
+                               for item in items if isinstance(item, dict)], ensure_ascii=False)
+    comment = prompt.rpartition("Комментарий: ")[2]
+    return json.dumps(verdict(comment, reject_rate), ensure_ascii=False)
+
+def build_app(args) -> FastAPI:
+    app = FastAPI()
+    counters = {'requests': 0, 'errors': 0}
+
+    async def chat_completions(request: Request):
+        body = await request.json()
+        counters['requests'] += 1
+        if args.latency_ms > 0:  # У логнормальной задержки медиана должна быть положительной
+            await asyncio.sleep(random.lognormvariate(math.log(args.latency_ms / 1000), args.latency_sigma))
+        if random.random() < args.error_rate:
+            counters['errors'] += 1
+            return JSONResponse(status_code=503, content={
+                "error": {"message": "Service temporarily unavailable (stub)", "type": "server_error"}
+            })
+        prompt = body['messages'][-1]['content']
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get('model', 'deepseek-chat'),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": answer(prompt, args.reject_rate)},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+
+    app.add_api_route("/chat/completions", chat_completions, methods=["POST"])
+    app.add_api_route("/v1/chat/completions", chat_completions, methods=["POST"])
+    app.add_api_route("/stats", lambda: counters, methods=["GET"])
+    return app
+
+if __name__ == "__main__":
+    args = parse_args()
+    uvicorn.run(build_app(args), host="127.0.0.1", port=args.port, log_level="warning", access_log=False)
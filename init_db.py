@@ -1,10 +1,11 @@
-from sqlalchemy import create_engine
+from app.db import engine, SessionLocal
+from app.migrations import apply_migrations
 from app.models import Base
 
-# Создаём подключение к базе данных SQLite (файл data/db.sqlite3)
-engine = create_engine("sqlite:///data/db.sqlite3")
-
 # Создаём все таблицы, описанные в models.py (если их ещё нет)
 Base.metadata.create_all(engine)
 
-print("Таблицы успешно созданы!")
\ No newline at end of file
+# Применяем миграции схемы: существующая БД получает новые индексы
+apply_migrations(engine, SessionLocal)
+
+print("Таблицы успешно созданы!")
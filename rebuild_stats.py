@@ -0,0 +1,20 @@
+from app.db import SessionLocal, engine
+from app.models import Base
+from app.stats_counters import rebuild_counters
+
+# Пересчитывает счётчики статистики по сырым данным и сообщает о расхождениях
+Base.metadata.create_all(engine)
+db = SessionLocal()
+try:
+    drift = rebuild_counters(db)
+    db.commit()
+finally:
+    db.close()
+
+if drift:
+    print(f"Найдено расхождений в счётчиках: {len(drift)}")
+    for key, (was, now) in sorted(drift.items(), key=str):
+        print(f"  {key}: было {was}, стало {now}")
+else:
+    print("Счётчики совпадают с сырыми данными")
+
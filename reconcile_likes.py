@@ -0,0 +1,21 @@
+from app.db import SessionLocal, engine
+from app.likes import reconcile_likes
+from app.migrations import apply_migrations
+from app.models import Base
+
+# Пересчитывает счётчики лайков answers.likes_count по comment_likes и сообщает о расхождениях
+Base.metadata.create_all(engine)
+apply_migrations(engine, SessionLocal)
+db = SessionLocal()
+try:
+    drift = reconcile_likes(db)
+    db.commit()
+finally:
+    db.close()
+
+if drift:
+    print(f"Найдено расхождений в счётчиках лайков: {len(drift)}")
+    for answer_id, (was, now) in sorted(drift.items()):
+        print(f"  ответ {answer_id}: было {was}, стало {now}")
+else:
+    print("Счётчики лайков совпадают с comment_likes")
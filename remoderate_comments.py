@@ -0,0 +1,162 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import text
+
+from app.comment_filter import comment_filter, get_moderation_breaker_stats, get_moderation_cache_stats, validate_comments
+from app.data_version import SCOPE_COMMENTS, bump_data_version
+from app.db import DATABASE_PATH, ReadSessionLocal, SessionLocal, engine
+from app.migrations import apply_migrations
+from app.models import Base
+from app.question_registry import ROLE_COMMENT, question_registry
+
+# Перепроверяет все сохранённые комментарии (прошедшие и не прошедшие модерацию) текущим промптом:
+# после изменения промпта или после сбоя, когда AI был недоступен и комментарии пропускались без проверки.
+# Комментарии, фоновая модерация которых остановилась в состоянии failed, получают вердикт, а их задачи удаляются.
+# Комментарии читаются порциями по id, в модель уходят пачками по --batch штук (ответ — JSON-массив
+# вердиктов по номерам), одновременно идёт не больше --concurrency запросов. После каждой порции
+# прогресс пишется в файл --checkpoint; повторный запуск продолжает с места остановки.
+# Запуск: python remoderate_comments.py [--dry-run] [--restart]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Пакетная перепроверка комментариев AI-модерацией")
+    parser.add_argument("--chunk", type=int, default=200, help="комментариев в одной порции (и между сохранениями прогресса)")
+    parser.add_argument("--batch", type=int, default=10, help="комментариев в одном запросе к модели")
+    parser.add_argument("--concurrency", type=int, default=4, help="одновременных запросов к модели")
+    parser.add_argument("--checkpoint", default=os.path.join(os.path.dirname(DATABASE_PATH), "remoderate_checkpoint.json"))
+    parser.add_argument("--restart", action="store_true", help="начать сначала, не читая сохранённый прогресс")
+    parser.add_argument("--dry-run", action="store_true", help="только показать, что изменится")
+    return parser.parse_args()
+
+def load_checkpoint(path: str, question_id: int, restart: bool) -> dict:
+    fresh = {'question_id': question_id, 'filter_version': comment_filter.cache_version,
+             'last_answer_id': 0, 'checked': 0, 'changed': 0}
+    if restart or not os.path.exists(path):
+        return fresh
+    with open(path, encoding='utf-8') as f:
+        saved = json.load(f)
+    if (saved.get('question_id'), saved.get('filter_version')) != (question_id, comment_filter.cache_version):
+        print("Прогресс сохранён для другого вопроса или другой версии промпта — начинаем сначала")
+        return fresh
+    print(f"Продолжаем с комментария id > {saved['last_answer_id']} (уже проверено {saved['checked']})")
+    return saved
+
+def save_checkpoint(path: str, checkpoint: dict):
+    tmp = path + ".tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp, path)  # Файл прогресса не окажется записанным наполовину
+
+def read_chunk(question_id: int, after_id: int, limit: int):
+    """
+    Следующая порция непустых комментариев по возрастанию id; последнее поле — у комментария
+    есть задача фоновой модерации в состоянии failed
+    """
+    db = ReadSessionLocal()
+    try:
+        return db.execute(text("""
+            SELECT id, value, moderated,
+                   EXISTS (SELECT 1 FROM comment_moderation_queue q WHERE q.answer_id = answers.id AND q.failed = 1)
+            FROM answers
+            WHERE question_id = :question_id AND id > :after_id AND TRIM(value) != ''
+            ORDER BY id LIMIT :limit
+        """), {'question_id': question_id, 'after_id': after_id, 'limit': limit}).all()
+    finally:
+        db.close()
+
+def apply_verdicts(changes) -> int:
+    """
+    Записывает изменившиеся вердикты одной транзакцией. Комментарии, которые за это время
+    изменили или поставили в очередь фоновой модерации, не трогаем. Задачи очереди в состоянии
+    failed фоновая модерация уже не повторит: вердикт записываем, а задачу удаляем.
+    """
+    db = SessionLocal()
+    try:
+        updated = 0
+        for answer_id, value, approved in changes:
+            matched = db.execute(text("""
+                UPDATE answers SET moderated = :approved
+                WHERE id = :answer_id AND value = :value
+                AND NOT EXISTS (SELECT 1 FROM comment_moderation_queue q WHERE q.answer_id = :answer_id AND q.failed = 0)
+            """), {'answer_id': answer_id, 'value': value, 'approved': approved}).rowcount
+            if matched:
+                db.execute(text("DELETE FROM comment_moderation_queue WHERE answer_id = :answer_id AND failed = 1"),
+                           {'answer_id': answer_id})
+            updated += matched
+        if updated:
+            bump_data_version(db, SCOPE_COMMENTS)
+        db.commit()
+        return updated
+    finally:
+        db.close()
+
+def _seconds(value) -> str:
+    return '—' if value is None else f"{value:.2f}s"
+
+def main():
+    args = parse_args()
+    Base.metadata.create_all(engine)
+    apply_migrations(engine, SessionLocal)
+    question_id = question_registry.get().qid(ROLE_COMMENT)
+    if question_id is None:
+        print("Вопрос с комментариями не найден")
+        return 1
+    if not comment_filter.use_ai:
+        print("AI модерация недоступна (нет DEEPSEEK_API_KEY)")
+        return 1
+    checkpoint = load_checkpoint(args.checkpoint, question_id, args.restart)
+    after_id = checkpoint['last_answer_id']
+    checked = failed = changed = 0
+    t0 = time.time()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        while True:
+            rows = read_chunk(question_id, after_id, args.chunk)
+            if not rows:
+                break
+            batches = [rows[i:i + args.batch] for i in range(0, len(rows), args.batch)]
+            results = pool.map(lambda batch: validate_comments([row[1] for row in batch]), batches)
+            changes, chunk_failed = [], 0
+            for batch, verdicts in zip(batches, results):
+                for (answer_id, value, moderated, stuck), verdict in zip(batch, verdicts):
+                    if verdict is None:
+                        chunk_failed += 1
+                    elif bool(verdict[0]) != bool(moderated) or stuck:
+                        # Для задачи в состоянии failed вердикт записываем, даже если он не изменился
+                        changes.append((answer_id, value, bool(verdict[0])))
+                        print(f"  {answer_id}: {'показан' if moderated else 'скрыт'} -> "
+                              f"{'показан' if verdict[0] else 'скрыт'} ({verdict[1]})"
+                              f"{' [failed]' if stuck else ''}: {value[:80]}")
+            applied = len(changes) if args.dry_run else apply_verdicts(changes)
+            checked += len(rows) - chunk_failed
+            failed += chunk_failed
+            changed += applied
+            elapsed = time.time() - t0
+            print(f"[REMODERATE] до id {rows[-1][0]}: проверено {checked}, изменено {changed}, "
+                  f"{checked / elapsed:.1f} комм/с")
+            if chunk_failed:
+                # Прогресс дальше этой порции не сохраняем: при повторном запуске она будет проверена снова
+                print(f"Нет вердикта для {chunk_failed} комментариев (AI недоступен?) — остановка, запустите позже")
+                break
+            after_id = rows[-1][0]
+            if not args.dry_run:
+                checkpoint.update(last_answer_id=after_id, checked=checkpoint['checked'] + len(rows),
+                                  changed=checkpoint['changed'] + applied)
+                save_checkpoint(args.checkpoint, checkpoint)
+
+    elapsed = time.time() - t0
+    cache = get_moderation_cache_stats()
+    breaker = get_moderation_breaker_stats()
+    print(f"Проверено {checked} комментариев за {elapsed:.1f}s ({checked / elapsed if elapsed else 0:.1f} комм/с), "
+          f"{'изменилось бы' if args.dry_run else 'изменено'} {changed}, без вердикта {failed}; "
+          f"кэш вердиктов: hit_rate={cache['hit_rate']:.2f}")
+    print(f"Выключатель DeepSeek: {breaker['state']}, неудач в окне {breaker['failure_rate']:.0%}, "
+          f"p95 {_seconds(breaker['p95_latency'])}, пропущено вызовов {breaker['short_circuited']}, "
+          f"переходы {breaker['transitions'] or 'нет'}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())